@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Imports and exports the lyrics associations of LrcDb
+
+Associations are stored one per line in JSON lines files, or one per row in
+CSV files with a header row. Each association has the fields in `FIELDS`.
+
+This module can be run to import or export without the daemon:
+
+    python associations.py export associations.jsonl
+    python associations.py import --db ~/.config/osdlyrics/lrc.db lyrics.csv
+
+Run it without arguments to test the module.
+"""
+from __future__ import print_function
+from future import standard_library
+standard_library.install_aliases()
+
+import csv
+import io
+import json
+import logging
+import optparse
+import sys
+
+import lrcdb
+
+__all__ = (
+    'FIELDS',
+    'export_file',
+    'guess_format',
+    'import_file',
+    'read_associations',
+    'read_file',
+    'write_associations',
+)
+
+FIELDS = ['title', 'artist', 'album', 'tracknum', 'location', 'uri']
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+FORMATS = [FORMAT_JSONL, FORMAT_CSV]
+
+# The csv module of Python 2 only works on UTF-8 byte strings
+CSV_BYTES = sys.version_info[0] < 3
+
+
+class FormatError(Exception):
+    """ Malformed association files
+    """
+
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+
+
+def guess_format(path):
+    """
+    Guesses the format of an association file by its extension
+
+    >>> guess_format('/tmp/a.CSV')
+    'csv'
+    >>> guess_format('/tmp/a.jsonl')
+    'jsonl'
+    """
+    if path.lower().endswith('.csv'):
+        return FORMAT_CSV
+    return FORMAT_JSONL
+
+
+def read_associations(fileobj, format):
+    r"""
+    Yields the associations in a text file object one by one.
+
+    >>> lines = io.StringIO(u'{"title": "a", "uri": "file:///a.lrc"}\n\n')
+    >>> [sorted(a.items()) for a in read_associations(lines, 'jsonl')]
+    [[('title', 'a'), ('uri', 'file:///a.lrc')]]
+    >>> rows = io.StringIO(u'title,tracknum,uri\r\nb,2,none:\r\n')
+    >>> [sorted(a.items()) for a in read_associations(rows, 'csv')]
+    [[('title', 'b'), ('tracknum', '2'), ('uri', 'none:')]]
+    """
+    if format == FORMAT_CSV:
+        for association in csv.DictReader(fileobj):
+            if CSV_BYTES:
+                association = dict((_decode(k), _decode(v))
+                                   for k, v in association.items())
+            yield association
+        return
+    for lineno, line in enumerate(fileobj, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            association = json.loads(line)
+        except ValueError as e:
+            raise FormatError('Line %d: %s' % (lineno, e))
+        if not isinstance(association, dict):
+            raise FormatError('Line %d: not an object' % lineno)
+        yield association
+
+
+def write_associations(fileobj, associations, format):
+    r"""
+    Writes associations to a text file object one by one, and returns the
+    number of associations written.
+
+    >>> out = io.StringIO()
+    >>> write_associations(out, [{'title': 'a', 'tracknum': 1}], 'csv')
+    1
+    >>> print(out.getvalue().replace('\r', ''))
+    title,artist,album,tracknum,location,uri
+    a,,,1,,
+    <BLANKLINE>
+    """
+    count = 0
+    if format == FORMAT_CSV:
+        writer = csv.DictWriter(fileobj, FIELDS)
+        writer.writeheader()
+        for association in associations:
+            if CSV_BYTES:
+                association = dict((k, _encode(v)) for k, v in association.items())
+            writer.writerow(association)
+            count += 1
+        return count
+    for association in associations:
+        fileobj.write(json.dumps(association, ensure_ascii=False, sort_keys=True))
+        fileobj.write('\n')
+        count += 1
+    return count
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _encode(value):
+    if isinstance(value, type(u'')):
+        return value.encode('utf-8')
+    return value
+
+
+def _open(path, mode, format):
+    if format == FORMAT_CSV and CSV_BYTES:
+        return open(path, mode + 'b')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def read_file(path, format=None):
+    """ Returns a list of all associations in a file
+
+    FormatError is raised if any association is malformed, so nothing is
+    imported from a malformed file.
+    """
+    format = format or guess_format(path)
+    with _open(path, 'r', format) as fileobj:
+        return list(read_associations(fileobj, format))
+
+
+def import_file(db, path, format=None, progress=None):
+    """ Imports associations from a file to a `lrcdb.LrcDb` in one transaction
+
+    Returns the number of associations imported.
+    """
+    format = format or guess_format(path)
+    with _open(path, 'r', format) as fileobj:
+        return db.assign_many(read_associations(fileobj, format), progress)
+
+
+def export_file(db, path, format=None):
+    """ Exports all associations of a `lrcdb.LrcDb` to a file
+
+    Returns the number of associations exported.
+    """
+    format = format or guess_format(path)
+    with _open(path, 'w', format) as fileobj:
+        return write_associations(fileobj, db.iter_associations(), format)
+
+
+def main(args=None):
+    parser = optparse.OptionParser(
+        usage='%prog [options] import|export FILE',
+        description='Imports or exports the lyrics associations of OSD Lyrics. '
+        'Import while the daemon is running with its ImportAssociations '
+        'D-Bus method instead.')
+    parser.add_option('--db', dest='dbfile', default=None,
+                      help='the database file, default: ~/.config/osdlyrics/lrc.db')
+    parser.add_option('-f', '--format', dest='format', choices=FORMATS,
+                      help='jsonl or csv, default: guessed by the extension of FILE')
+    options, args = parser.parse_args(args)
+    if len(args) != 2 or args[0] not in ('import', 'export'):
+        parser.error('expect a command of import or export, and a file')
+    command, path = args
+    db = lrcdb.LrcDb(options.dbfile)
+    try:
+        if command == 'import':
+            def progress(count):
+                print('\r%d associations imported' % count, end='', file=sys.stderr)
+            count = import_file(db, path, options.format, progress)
+            print('\r%d associations imported' % count, file=sys.stderr)
+        else:
+            count = export_file(db, path, options.format)
+            print('%d associations exported' % count, file=sys.stderr)
+    except (IOError, FormatError, csv.Error, ValueError) as e:
+        logging.error('Failed to %s %s: %s', command, path, e)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+def test():
+    r"""
+    >>> import os, tempfile
+    >>> from osdlyrics.metadata import Metadata
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> db = lrcdb.LrcDb(os.path.join(tmpdir, 'lrc.db'))
+    >>> path = os.path.join(tmpdir, 'a.csv')
+    >>> with io.open(path, 'w', encoding='utf-8') as f:
+    ...     n = f.write(u'title,artist,location,uri\nTiger,Soldier,,file:///a.lrc\n'
+    ...                 u'标题,,file:///b.mp3,file:///b.lrc\n')
+    >>> main(['import', '--db', os.path.join(tmpdir, 'lrc.db'), path])
+    0
+    >>> db.find(Metadata(title='Tiger', artist='Soldier'))
+    'file:///a.lrc'
+    >>> export = os.path.join(tmpdir, 'a.jsonl')
+    >>> export_file(db, export)
+    2
+    >>> db2 = lrcdb.LrcDb(os.path.join(tmpdir, 'lrc2.db'))
+    >>> import_file(db2, export)
+    2
+    >>> db2.find(Metadata(location='file:///b.mp3'))
+    'file:///b.lrc'
+    >>> [a['uri'] for a in read_file(export)]
+    ['file:///a.lrc', 'file:///b.lrc']
+    >>> import shutil
+    >>> shutil.rmtree(tmpdir)
+    """
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        sys.exit(main())
+    else:
+        test()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from builtins import object
+
+import time
+
+__all__ = (
+    'CircuitBreaker',
+)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """ Stops using a failing service for a while
+
+    The breaker is closed at first. After `threshold` failures in a row, it
+    opens and `allow` returns False for a cooldown. After the cooldown, it is
+    half-open and allows a single trial. If the trial succeeds, the breaker
+    closes; otherwise it opens again with the cooldown doubled, up to
+    `max_cooldown`.
+
+    >>> now = [0]
+    >>> breaker = CircuitBreaker(threshold=2, cooldown=10, max_cooldown=25,
+    ...                          clock=lambda: now[0])
+    >>> breaker.record_failure()
+    >>> breaker.allow(), breaker.state
+    (True, 'closed')
+    >>> breaker.record_failure()
+    >>> breaker.allow(), breaker.state
+    (False, 'open')
+    >>> now[0] = 10
+    >>> breaker.allow(), breaker.state
+    (True, 'half-open')
+    >>> breaker.allow()
+    False
+    >>> breaker.record_cancel()
+    >>> breaker.allow()
+    True
+    >>> breaker.record_failure()
+    >>> breaker.state, breaker.retry_time
+    ('open', 30)
+    >>> now[0] = 30
+    >>> breaker.allow()
+    True
+    >>> breaker.record_failure()
+    >>> breaker.retry_time
+    55
+    >>> now[0] = 55
+    >>> breaker.allow()
+    True
+    >>> breaker.record_success()
+    >>> breaker.state, breaker.failures
+    ('closed', 0)
+    """
+
+    def __init__(self, threshold=3, cooldown=60, max_cooldown=3600, clock=time.time):
+        """
+
+        Arguments:
+        - `threshold`: The number of failures in a row to open the breaker
+        - `cooldown`: The number of seconds the breaker is open for the first time
+        - `max_cooldown`: The maximum number of seconds the breaker is open
+        """
+        self._threshold = threshold
+        self._base_cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._clock = clock
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._cooldown = 0
+        self._retry_time = 0
+        self._trial = False
+
+    @property
+    def state(self):
+        if self._state == STATE_OPEN and self._clock() >= self._retry_time:
+            return STATE_HALF_OPEN
+        return self._state
+
+    @property
+    def failures(self):
+        """ The number of failures in a row
+        """
+        return self._failures
+
+    @property
+    def retry_time(self):
+        """ The time when the open breaker allows a trial, or 0 if it is closed
+        """
+        return self._retry_time if self._state != STATE_CLOSED else 0
+
+    def allow(self):
+        """ Returns whether the service can be used now
+        """
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN and not self._trial:
+            self._state = STATE_HALF_OPEN
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._cooldown = 0
+        self._trial = False
+
+    def record_cancel(self):
+        """ Gives up the trial of a half-open breaker without a result
+        """
+        self._trial = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == STATE_HALF_OPEN:
+            self._cooldown = min(self._cooldown * 2, self._max_cooldown)
+        elif self._state == STATE_CLOSED and self._failures >= self._threshold:
+            self._cooldown = self._base_cooldown
+        else:
+            return
+        self._state = STATE_OPEN
+        self._retry_time = self._clock() + self._cooldown
+        self._trial = False
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'failures': self._failures,
+            'retry_time': float(self.retry_time),
+        }
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+import binascii
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+import osdlyrics.utils
+
+import lyricscache
+import sqlitecache
+
+__all__ = (
+    'DownloadCache',
+    'download_key',
+)
+
+# Bytes of downloaded content kept in memory
+DEFAULT_MEMORY_SIZE = 1024 * 1024
+# Seconds that downloaded content is kept on disk
+DEFAULT_MAX_AGE = 90 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 2000
+# The maximum total size in bytes of compressed content on disk
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return binascii.hexlify(bytes(value)).decode('ascii')
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def download_key(sourceid, downloadinfo):
+    """ Returns the key of the content downloaded from a source with the
+    ``downloadinfo`` of a search result
+
+    Dicts in ``downloadinfo`` are the same regardless of the order of keys.
+
+    >>> download_key('src', {'id': 1, 'url': 'a'}) == download_key('src', {'url': 'a', 'id': 1})
+    True
+    >>> download_key('src', 'a') == download_key('other', 'a')
+    False
+    """
+    data = json.dumps([sourceid, downloadinfo], sort_keys=True,
+                      separators=(',', ':'), default=_json_default)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class DownloadCache(sqlitecache.SqliteCache):
+    """ Caches downloaded lyrics in memory and in a SQLite database
+
+    Recently used content is kept in a `lyricscache.LyricsCache` of
+    `memory_size` bytes. All content is stored compressed on disk for up to
+    `max_age` seconds. The oldest content is dropped if there are more than
+    `max_entries` of them, or their total size is larger than `max_size`.
+
+    >>> now = [0]
+    >>> cache = DownloadCache(':memory:', memory_size=0, max_age=100,
+    ...                       max_entries=2, clock=lambda: now[0])
+    >>> cache.put('a', b'[00:01]a')
+    >>> cache.get('a') == b'[00:01]a'
+    True
+    >>> cache.get('b')
+    >>> now[0] = 100
+    >>> cache.get('a')
+    >>> for key in 'bcd':
+    ...     now[0] += 1
+    ...     cache.put(key, key.encode('ascii'))
+    >>> len(cache), cache.get('b')
+    (2, None)
+    """
+
+    def __init__(self, dbfile=None, memory_size=DEFAULT_MEMORY_SIZE,
+                 max_age=DEFAULT_MAX_AGE, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_size=DEFAULT_MAX_SIZE, clock=time.time, workers=None):
+        """
+
+        Arguments:
+        - `dbfile`: The sqlite db to open
+        - `memory_size`: The maximum size of content kept in memory
+        - `max_age`: Seconds that content is kept
+        - `max_entries`: The maximum number of content on disk
+        - `max_size`: The maximum total size of compressed content on disk
+        - `workers`: See `sqlitecache.SqliteCache`
+        """
+        if dbfile is None:
+            dbfile = osdlyrics.utils.get_config_path('download-cache.db')
+        sqlitecache.SqliteCache.__init__(self, dbfile, max_age, max_entries,
+                                         max_size, clock, workers)
+        self._memory = lyricscache.LyricsCache(memory_size)
+
+    def _encode(self, content):
+        data = zlib.compress(content)
+        return sqlite3.Binary(data), len(data)
+
+    def _decode(self, data):
+        return zlib.decompress(bytes(data))
+
+    def get(self, key):
+        """ Returns the content cached with `key`, or None if not cached
+        """
+        entry = self._memory.get(key, None)
+        if entry is not None:
+            return entry.content
+        cached = self._get(key)
+        if cached is None:
+            return None
+        content = cached[0]
+        self._memory.put(key, None, content)
+        return content
+
+    def put(self, key, content):
+        """ Caches the downloaded bytes `content` with `key`
+        """
+        content = bytes(bytearray(content))
+        self._memory.put(key, None, content)
+        # Content dropped from disk may still be in memory, which is fine.
+        self._put(key, content)
+
+    def clear(self):
+        """ Drops all cached content
+        """
+        self._memory.clear()
+        sqlitecache.SqliteCache.clear(self)
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
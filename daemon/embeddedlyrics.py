@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Reads lyrics embedded in the tags of audio files
+
+Supported tags are ID3v2 SYLT and USLT frames, Vorbis comments in FLAC, Ogg
+Vorbis and Opus files, and the ``\\xa9lyr`` atom of MP4 files.
+
+The file is mapped into memory and only the headers of tags are parsed, so the
+pages of audio data are never read.
+"""
+from builtins import object
+
+import logging
+import mmap
+import os
+import struct
+
+__all__ = (
+    'has_lyrics',
+    'read_lyrics',
+)
+
+# Names of Vorbis comments holding lyrics, in the order of preference
+VORBIS_LYRICS_KEYS = ['LYRICS', 'UNSYNCEDLYRICS', 'UNSYNCED LYRICS']
+
+# Max bytes of Ogg pages to read for the comment header, which may hold cover
+# arts.
+OGG_MAX_HEADER_SIZE = 16 * 1024 * 1024
+
+ID3_ENCODINGS = {
+    0: 'latin-1',
+    1: 'utf-16',
+    2: 'utf-16-be',
+    3: 'utf-8',
+}
+
+# SYLT time stamp format of milliseconds
+SYLT_FORMAT_MS = 2
+
+
+class TagError(Exception):
+    """ Malformed tags
+    """
+
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+
+
+def read_lyrics(path):
+    """ Returns the lyrics embedded in the audio file of `path`, or None if not
+    found.
+
+    Synchronized lyrics are converted into LRC format.
+    """
+    return _map_file(path, _read_buffer)
+
+
+def has_lyrics(path):
+    """ Whether there are lyrics embedded in the audio file of `path`
+
+    Only the headers of the frames, comments or atoms holding lyrics are read,
+    the lyrics are not decoded.
+    """
+    return bool(_map_file(path, lambda buf: _read_buffer(buf, probe=True)))
+
+
+def _map_file(path, func):
+    """ Calls `func` with the content of `path` mapped into memory.
+
+    Returns the result of `func`, or None if the file is empty or cannot be
+    parsed.
+    """
+    try:
+        with open(path, 'rb') as f:
+            with _FileMap(f) as buf:
+                if buf is None:
+                    return None
+                return func(buf)
+    except (IOError, OSError) as e:
+        logging.info('Cannot read tags of %s: %s', path, e)
+    except (TagError, struct.error, ValueError, IndexError) as e:
+        logging.info('Malformed tags in %s: %s', path, e)
+    return None
+
+
+class _FileMap(object):
+
+    def __init__(self, f):
+        self._file = f
+        self._map = None
+
+    def __enter__(self):
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return None
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def __exit__(self, *args):
+        if self._map is not None:
+            self._map.close()
+
+
+def _read_buffer(buf, probe=False):
+    """ Returns the lyrics in `buf`, or None if not found.
+
+    If `probe` is True, returns True instead of the lyrics once a tag holding
+    lyrics is found.
+    """
+    lyrics, pos = _read_id3v2(buf, 0, probe)
+    if lyrics is not None:
+        return lyrics
+    magic = buf[pos:pos + 4]
+    if magic == b'fLaC':
+        return _read_flac(buf, pos + 4, probe)
+    if magic == b'OggS':
+        return _read_ogg(buf, pos, probe)
+    if buf[pos + 4:pos + 8] == b'ftyp':
+        return _read_mp4(buf, pos, len(buf), probe)
+    return None
+
+
+def _byte(buf, pos):
+    return struct.unpack_from('B', buf, pos)[0]
+
+
+def _syncsafe(buf, pos):
+    b0, b1, b2, b3 = struct.unpack_from('4B', buf, pos)
+    return (b0 << 21) | (b1 << 14) | (b2 << 7) | b3
+
+
+def _format_time(ms):
+    return '[%02d:%02d.%02d]' % (ms // 60000, ms // 1000 % 60, ms % 1000 // 10)
+
+
+############################################################
+# ID3v2
+############################################################
+
+def _read_id3v2(buf, pos, probe=False):
+    r""" Reads the lyrics in the ID3v2 tag at `pos`.
+
+    Returns the lyrics or None, and the position after the tag.
+
+    >>> uslt = b'\x03eng\x00Hi!'
+    >>> tag = (b'ID3\x03\x00\x00\x00\x00\x00\x12USLT' +
+    ...        struct.pack('>IH', len(uslt), 0) + uslt)
+    >>> lyrics, pos = _read_id3v2(tag, 0)
+    >>> print(lyrics)
+    Hi!
+    >>> _read_id3v2(tag, 0, probe=True)
+    (True, 28)
+    """
+    if buf[pos:pos + 3] != b'ID3' or len(buf) < pos + 10:
+        return None, pos
+    major = _byte(buf, pos + 3)
+    flags = _byte(buf, pos + 5)
+    size = _syncsafe(buf, pos + 6)
+    start = pos + 10
+    end = min(start + size, len(buf))
+    next_pos = end + (10 if major >= 4 and flags & 0x10 else 0)
+    if major not in (2, 3, 4):
+        return None, next_pos
+    if flags & 0x80 and major < 4:
+        # Unsynchronisation of the whole tag
+        buf = buf[start:end].replace(b'\xff\x00', b'\xff')
+        start, end = 0, len(buf)
+    if flags & 0x40 and major >= 3:
+        # Extended header
+        if major == 3:
+            start += struct.unpack_from('>I', buf, start)[0] + 4
+        else:
+            start += _syncsafe(buf, start)
+    synced = None
+    unsynced = None
+    for frame_id, body_start, body_end, unsync in \
+            _iter_id3v2_frames(buf, start, end, major):
+        if probe:
+            if _has_frame_text(buf, frame_id, body_start, body_end):
+                return True, next_pos
+            continue
+        body = buf[body_start:body_end]
+        if unsync:
+            body = body.replace(b'\xff\x00', b'\xff')
+        if frame_id in (b'SYLT', b'SLT') and synced is None:
+            synced = _parse_sylt(body)
+        elif frame_id in (b'USLT', b'ULT') and unsynced is None:
+            unsynced = _parse_uslt(body)
+    return synced or unsynced, next_pos
+
+
+def _has_frame_text(buf, frame_id, start, end):
+    """ Whether the lyrics frame between `start` and `end` may hold any text,
+    judging from its header fields only.
+    """
+    if frame_id in (b'SYLT', b'SLT'):
+        # Encoding, language, time stamp format, content type and descriptor
+        return end - start > 7 and _byte(buf, start + 4) == SYLT_FORMAT_MS
+    # Encoding, language and descriptor
+    return end - start > 5
+
+
+def _iter_id3v2_frames(buf, pos, end, major):
+    """ Yields frame ids, the start and the end of bodies of frames holding
+    lyrics, and whether the bodies are unsynchronised. Other frames are skipped
+    without reading.
+    """
+    header_size = 6 if major == 2 else 10
+    id_size = 3 if major == 2 else 4
+    while pos + header_size <= end:
+        frame_id = buf[pos:pos + id_size]
+        if frame_id[:1] == b'\x00':
+            # Padding
+            break
+        if major == 2:
+            b0, b1, b2 = struct.unpack_from('3B', buf, pos + 3)
+            size = (b0 << 16) | (b1 << 8) | b2
+            flags = 0
+        elif major == 3:
+            size, flags = struct.unpack_from('>IH', buf, pos + 4)
+        else:
+            size = _syncsafe(buf, pos + 4)
+            flags = struct.unpack_from('>H', buf, pos + 8)[0]
+        body_start = pos + header_size
+        pos = body_start + size
+        if pos > end:
+            raise TagError('Frame %r exceeds the tag' % frame_id)
+        if frame_id not in (b'SYLT', b'SLT', b'USLT', b'ULT'):
+            continue
+        if major == 3 and flags & 0x00c0 or major == 4 and flags & 0x000c:
+            # Compressed or encrypted
+            continue
+        if major == 4 and flags & 0x0001:
+            # Data length indicator
+            body_start += 4
+        yield frame_id, body_start, pos, major == 4 and bool(flags & 0x0002)
+
+
+def _split_string(data, pos, encoding):
+    """ Returns the bytes of a NUL terminated string at `pos` and the position
+    after the terminator.
+    """
+    if encoding in (1, 2):
+        end = pos
+        while True:
+            end = data.find(b'\x00\x00', end)
+            if end < 0 or (end - pos) % 2 == 0:
+                break
+            end += 1
+        terminator = 2
+    else:
+        end = data.find(b'\x00', pos)
+        terminator = 1
+    if end < 0:
+        return data[pos:], len(data)
+    return data[pos:end], end + terminator
+
+
+def _decode(data, encoding):
+    if encoding not in ID3_ENCODINGS:
+        raise TagError('Unknown text encoding %d' % encoding)
+    if encoding == 1 and data[:2] not in (b'\xff\xfe', b'\xfe\xff'):
+        return data.decode('utf-16-le', 'replace')
+    return data.decode(ID3_ENCODINGS[encoding], 'replace')
+
+
+def _parse_uslt(body):
+    r"""
+    >>> print(_parse_uslt(b'\x03eng\x00Hello\nWorld'))
+    Hello
+    World
+    >>> print(_parse_uslt(b'\x01eng\xff\xfe\x00\x00\xff\xfeH\x00i\x00'))
+    Hi
+    """
+    encoding = _byte(body, 0)
+    _, pos = _split_string(body, 4, encoding)
+    text = _decode(body[pos:], encoding).rstrip(u'\x00')
+    return text or None
+
+
+def _parse_sylt(body):
+    r"""
+    >>> print(_parse_sylt(b'\x00eng\x02\x01\x00' +
+    ...                   b'\nHello\x00\x00\x00\x03\xe8' +
+    ...                   b'\nWorld\x00\x00\x00\xea\x60'))
+    [00:01.00]Hello
+    [01:00.00]World
+    """
+    encoding = _byte(body, 0)
+    time_format = _byte(body, 4)
+    if time_format != SYLT_FORMAT_MS:
+        # Time stamps in MPEG frames cannot be converted without decoding the
+        # audio.
+        return None
+    _, pos = _split_string(body, 6, encoding)
+    lines = []
+    while pos + 4 <= len(body):
+        text, pos = _split_string(body, pos, encoding)
+        if pos + 4 > len(body):
+            break
+        time = struct.unpack_from('>I', body, pos)[0]
+        pos += 4
+        text = _decode(text, encoding).lstrip(u'\r\n')
+        lines.append(_format_time(time) + text)
+    return u'\n'.join(lines) or None
+
+
+############################################################
+# Vorbis comments in FLAC and Ogg
+############################################################
+
+def _read_flac(buf, pos, probe=False):
+    while pos + 4 <= len(buf):
+        header = _byte(buf, pos)
+        b0, b1, b2 = struct.unpack_from('3B', buf, pos + 1)
+        size = (b0 << 16) | (b1 << 8) | b2
+        block_type = header & 0x7f
+        if block_type == 4:
+            return _parse_vorbis_comment(buf, pos + 4, pos + 4 + size, probe)
+        if header & 0x80:
+            # Last metadata block
+            break
+        pos += 4 + size
+    return None
+
+
+def _read_ogg(buf, pos, probe=False):
+    """ Reads the comment header, which is the second packet of the first
+    logical stream.
+    """
+    packets = []
+    packet = []
+    serial = None
+    limit = min(len(buf), pos + OGG_MAX_HEADER_SIZE)
+    while len(packets) < 2 and pos + 27 <= limit:
+        if buf[pos:pos + 4] != b'OggS':
+            raise TagError('Bad Ogg page')
+        page_serial = struct.unpack_from('<I', buf, pos + 14)[0]
+        nsegs = _byte(buf, pos + 26)
+        lacing = struct.unpack_from('%dB' % nsegs, buf, pos + 27)
+        data_pos = pos + 27 + nsegs
+        pos = data_pos + sum(lacing)
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            continue
+        for size in lacing:
+            packet.append(buf[data_pos:data_pos + size])
+            data_pos += size
+            if size < 255:
+                packets.append(b''.join(packet))
+                packet = []
+    if len(packets) < 2:
+        return None
+    comment = packets[1]
+    if comment[:7] == b'\x03vorbis':
+        return _parse_vorbis_comment(comment, 7, len(comment), probe)
+    if comment[:8] == b'OpusTags':
+        return _parse_vorbis_comment(comment, 8, len(comment), probe)
+    return None
+
+
+def _parse_vorbis_comment(buf, pos, end, probe=False):
+    r"""
+    >>> data = (b'\x06\x00\x00\x00vendor\x02\x00\x00\x00'
+    ...         b'\x07\x00\x00\x00TITLE=a\x0b\x00\x00\x00lyrics=Hi!\n')
+    >>> print(_parse_vorbis_comment(data, 0, len(data)))
+    Hi!
+    <BLANKLINE>
+    >>> _parse_vorbis_comment(data, 0, len(data), probe=True)
+    True
+    >>> data = (b'\x06\x00\x00\x00vendor\x01\x00\x00\x00'
+    ...         b'\x07\x00\x00\x00LYRICS=')
+    >>> print(_parse_vorbis_comment(data, 0, len(data), probe=True))
+    None
+    """
+    vendor_size = struct.unpack_from('<I', buf, pos)[0]
+    pos += 4 + vendor_size
+    count = struct.unpack_from('<I', buf, pos)[0]
+    pos += 4
+    found = {}
+    for i in range(count):
+        if pos + 4 > end:
+            break
+        size = struct.unpack_from('<I', buf, pos)[0]
+        pos += 4
+        # Only read the key, since comments such as cover arts may be large
+        key_end = buf.find(b'=', pos, min(pos + size, pos + 64))
+        if key_end >= 0:
+            key = buf[pos:key_end].decode('ascii', 'replace').upper()
+            if key in VORBIS_LYRICS_KEYS and probe:
+                if key_end + 1 < pos + size:
+                    return True
+            elif key in VORBIS_LYRICS_KEYS and key not in found:
+                found[key] = buf[key_end + 1:pos + size].decode('utf-8', 'replace')
+        pos += size
+    for key in VORBIS_LYRICS_KEYS:
+        if found.get(key):
+            return found[key]
+    return None
+
+
+############################################################
+# MP4
+############################################################
+
+def _iter_atoms(buf, pos, end):
+    """ Yields the type, the start and the end of the payload of atoms.
+    Only the headers of atoms are read.
+    """
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            raise TagError('Bad atom size')
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_atom(buf, pos, end, path):
+    for kind in path:
+        for atom_kind, start, atom_end in _iter_atoms(buf, pos, end):
+            if atom_kind == kind:
+                pos, end = start, atom_end
+                if kind == b'meta':
+                    # meta is a full atom with version and flags
+                    pos += 4
+                break
+        else:
+            return None
+    return pos, end
+
+
+def _read_mp4(buf, pos, end, probe=False):
+    r"""
+    >>> data = b'\x00\x00\x00\x0dHi there!'
+    >>> def atom(kind, payload):
+    ...     return struct.pack('>I', len(payload) + 8) + kind + payload
+    >>> lyr = atom(b'\xa9lyr', atom(b'data', b'\x00\x00\x00\x01\x00\x00\x00\x00Hi!'))
+    >>> meta = atom(b'meta', b'\x00\x00\x00\x00' + atom(b'ilst', lyr))
+    >>> buf = (atom(b'ftyp', b'M4A ') + atom(b'mdat', b'\x00' * 100) +
+    ...        atom(b'moov', atom(b'udta', meta)))
+    >>> print(_read_mp4(buf, 0, len(buf)))
+    Hi!
+    >>> _read_mp4(buf, 0, len(buf), probe=True)
+    True
+    """
+    found = _find_atom(buf, pos, end,
+                       [b'moov', b'udta', b'meta', b'ilst', b'\xa9lyr', b'data'])
+    if found is None:
+        return None
+    start, end = found
+    if probe:
+        return end > start + 8 or None
+    # Skip the type and locale of data
+    text = buf[start + 8:end].decode('utf-8', 'replace')
+    return text or None
+
+
+def test():
+    r"""
+    >>> import os, tempfile
+    >>> def write(content):
+    ...     fd, path = tempfile.mkstemp()
+    ...     os.write(fd, content)
+    ...     os.close(fd)
+    ...     return path
+    >>> uslt = b'\x03eng\x00Plain lyrics'
+    >>> frame = b'USLT' + struct.pack('>IH', len(uslt), 0) + uslt
+    >>> tag = b'ID3\x03\x00\x00' + struct.pack('>I', len(frame) + 10) + frame + b'\x00' * 10
+    >>> path = write(tag + b'\xff\xfb' * 100)
+    >>> print(read_lyrics(path))
+    Plain lyrics
+    >>> os.remove(path)
+    >>> comment = (b'\x06\x00\x00\x00vendor\x01\x00\x00\x00'
+    ...            b'\x11\x00\x00\x00LYRICS=[00:01]Hi!')
+    >>> flac = (b'fLaC\x00\x00\x00\x22' + b'\x00' * 0x22 +
+    ...         b'\x84' + struct.pack('>I', len(comment))[1:] + comment)
+    >>> path = write(flac)
+    >>> print(read_lyrics(path))
+    [00:01]Hi!
+    >>> has_lyrics(path)
+    True
+    >>> os.remove(path)
+    >>> path = write(b'')
+    >>> has_lyrics(path)
+    False
+    >>> os.remove(path)
+    >>> has_lyrics('/nonexistent')
+    False
+    """
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
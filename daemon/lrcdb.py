@@ -20,20 +20,60 @@
 from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
-from builtins import object
+from builtins import object, range
 
+import difflib
+import itertools
 import logging
 import os.path
+import queue
+import re
 import sqlite3
+import threading
+import time
+import unicodedata
+
+import glib
 
 from osdlyrics.consts import (METADATA_ALBUM, METADATA_ARTIST, METADATA_TITLE,
                               METADATA_TRACKNUM)
 import osdlyrics.utils
 
 __all__ = (
+    'DbFuture',
+    'DbTimeoutError',
     'LrcDb',
+    'ThreadedLrcDb',
+    'info_key',
 )
 
+# Number of prepared statements kept by each connection
+STATEMENT_CACHE_SIZE = 64
+
+# Writes of ThreadedLrcDb are committed once the first of them has waited for
+# this many seconds, or there are this many of them.
+COMMIT_INTERVAL = 0.05
+COMMIT_BATCH = 200
+
+# Number of rows written by each executemany call of `LrcDb.assign_many`,
+# between which the progress is reported. The daemon imports associations in
+# requests of this many rows.
+IMPORT_CHUNK_SIZE = 5000
+
+# A fuzzy match is accepted if its confidence is at least this
+FUZZY_THRESHOLD = 0.85
+# Weight of the title in the confidence of a fuzzy match, the rest is the
+# artist
+FUZZY_TITLE_WEIGHT = 0.7
+# Number of best ranked rows of full text search to compare
+FUZZY_CANDIDATES = 10
+# Max number of tokens in a full text query
+FUZZY_MAX_TOKENS = 16
+
+FUZZY_BRACKETS_RE = re.compile(r'[(\[{\uff08\u3010\u300c].*?[)\]}\uff09\u3011\u300d]')
+FUZZY_FEATURING_RE = re.compile(r'\s(?:feat|ft|featuring)\.?\s.*$')
+FUZZY_SEPARATOR_RE = re.compile(r'[\W_]+', re.UNICODE)
+
 
 def query_param_from_metadata(metadata):
     """
@@ -48,6 +88,83 @@ def query_param_from_metadata(metadata):
     return param
 
 
+def normalize_text(text):
+    """ Normalizes a metadata value so that values differ only in unicode
+    normal forms, letter cases or surrounding spaces are considered the same.
+    """
+    return unicodedata.normalize('NFC', text).strip().lower()
+
+
+def info_key(title, artist, album, tracknum):
+    r"""
+    Returns the normalized key to find lyrics of tracks by their info
+
+    >>> info_key(' Tiger', 'SOLDIER', '', 0) == info_key('tiger', 'soldier', '', 0)
+    True
+    >>> info_key('Caf\u00e9', '', '', 1) == info_key('Cafe\u0301', '', '', 1)
+    True
+    """
+    return '\x1f'.join([normalize_text(title or ''),
+                        normalize_text(artist or ''),
+                        normalize_text(album or ''),
+                        str(max(tracknum or 0, 0))])
+
+
+def fuzzy_text(text):
+    r"""
+    Reduces a title or artist to the words that identify it. Accents, letter
+    cases, bracketed parts such as "(Remastered)", featured artists and
+    punctuations are removed.
+
+    >>> fuzzy_text('Song (Remastered 2011)')
+    'song'
+    >>> fuzzy_text('Artist feat. X')
+    'artist'
+    >>> fuzzy_text('Caf\u00e9 [Live] - Part 2')
+    'cafe part 2'
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold() if hasattr(text, 'casefold') else text.lower()
+    text = FUZZY_BRACKETS_RE.sub(' ', text)
+    text = FUZZY_FEATURING_RE.sub('', text)
+    return ' '.join(FUZZY_SEPARATOR_RE.sub(' ', text).split())
+
+
+def fuzzy_confidence(title, artist, row_title, row_artist):
+    """
+    Returns how likely a row of fuzzy texts is the track, from 0 to 1
+
+    >>> fuzzy_confidence('song', 'artist', 'song', 'artist')
+    1.0
+    >>> fuzzy_confidence('song', 'artist', 'another song', 'artist') < FUZZY_THRESHOLD
+    True
+    """
+    title_ratio = difflib.SequenceMatcher(None, title, row_title).ratio()
+    if not artist and not row_artist:
+        return title_ratio
+    artist_ratio = difflib.SequenceMatcher(None, artist, row_artist).ratio()
+    return title_ratio * FUZZY_TITLE_WEIGHT + artist_ratio * (1 - FUZZY_TITLE_WEIGHT)
+
+
+def metadata_info_key(metadata):
+    param = query_param_from_metadata(metadata)
+    return info_key(*[param[m] for m in LrcDb.METADATA_LIST])
+
+
+def _padded_size(count):
+    """
+    Rounds up a number of parameters to a power of two
+
+    >>> [_padded_size(n) for n in (0, 1, 3, 4, 5, 400)]
+    [1, 1, 4, 4, 8, 512]
+    """
+    size = 1
+    while size < count:
+        size *= 2
+    return size
+
+
 class LrcDb(object):
     """ Database to store location of LRC files that have been manually assigned
     """
@@ -67,8 +184,8 @@ CREATE TABLE IF NOT EXISTS {0} (
 
     ASSIGN_LYRIC = """
 INSERT OR REPLACE INTO {0}
-  ({1}, {2}, {3}, {4}, uri, lrcpath)
-  VALUES (?, ?, ?, ?, ?, ?)
+  ({1}, {2}, {3}, {4}, uri, lrcpath, info_key, fuzzy_title, fuzzy_artist)
+  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
 """ .format(TABLE_NAME, *METADATA_LIST)
 
     UPDATE_LYRIC = """
@@ -83,35 +200,297 @@ UPDATE {0}
 
     QUERY_LOCATION = 'uri = ?'
 
-    QUERY_INFO = ' AND '.join('{0}=:{0}'.format(m) for m in METADATA_LIST)
+    LIST_LYRICS = 'SELECT {1}, {2}, {3}, {4}, uri, lrcpath FROM {0} ORDER BY id'.format(TABLE_NAME, *METADATA_LIST)
+
+    QUERY_INFO = 'info_key = ?'
+
+    # Tracks without locations are identified by their info, so assigning one
+    # replaces the rows of the same info without locations. Dbs of the
+    # original schema store empty locations instead of NULL.
+    DELETE_UNLOCATED_INFO = "DELETE FROM {0} WHERE info_key = ? AND (uri IS NULL OR uri = '')".format(TABLE_NAME)
+
+    # The first assigned row wins if several tracks share the same info.
+    # Rows of the same key are few, so sorting them is cheap.
+    QUERY_FIRST_INFO = QUERY_INFO + ' ORDER BY id LIMIT 1'
+
+    # Rows that may match any of a batch of tracks. The placeholders of track
+    # locations and info keys are filled by `find_batch`.
+    FIND_LYRIC_BATCH = """
+SELECT uri, info_key, lrcpath FROM {0}
+  WHERE uri IN ({{0}}) OR info_key IN ({{1}})
+  ORDER BY id
+""".format(TABLE_NAME)
+
+    # SQLite allows 999 parameters in a statement by default, and each track
+    # takes two.
+    BATCH_SIZE = 400
+
+    ENCODING_TABLE_NAME = 'encodings'
+
+    CREATE_ENCODING_TABLE = """
+CREATE TABLE IF NOT EXISTS {0} (
+  uri TEXT PRIMARY KEY ON CONFLICT REPLACE,
+  encoding TEXT,
+  mtime REAL,
+  size INTEGER
+)
+""".format(ENCODING_TABLE_NAME)
+
+    ASSIGN_ENCODING = """
+INSERT OR REPLACE INTO {0}
+  (uri, encoding, mtime, size)
+  VALUES (?, ?, ?, ?)
+""".format(ENCODING_TABLE_NAME)
+
+    FIND_ENCODING = """
+SELECT encoding FROM {0}
+  WHERE uri=? AND mtime=? AND size=?
+""".format(ENCODING_TABLE_NAME)
+
+    GET_ENCODING = """
+SELECT encoding, mtime, size FROM {0}
+  WHERE uri=?
+""".format(ENCODING_TABLE_NAME)
+
+    LIST_ENCODINGS = 'SELECT uri, encoding, mtime, size FROM {0}'.format(ENCODING_TABLE_NAME)
+
+    OFFSET_TABLE_NAME = 'offsets'
+
+    CREATE_OFFSET_TABLE = """
+CREATE TABLE IF NOT EXISTS {0} (
+  uri TEXT PRIMARY KEY ON CONFLICT REPLACE,
+  offset INTEGER
+)
+""".format(OFFSET_TABLE_NAME)
+
+    ASSIGN_OFFSET = 'INSERT OR REPLACE INTO {0} (uri, offset) VALUES (?, ?)'.format(OFFSET_TABLE_NAME)
+
+    FIND_OFFSET = 'SELECT offset FROM {0} WHERE uri=?'.format(OFFSET_TABLE_NAME)
+
+    DELETE_OFFSET = 'DELETE FROM {0} WHERE uri=?'.format(OFFSET_TABLE_NAME)
+
+    LIST_OFFSETS = 'SELECT uri, offset FROM {0}'.format(OFFSET_TABLE_NAME)
+
+    # Key-value states of the daemon, such as the cursor of the sweeper
+    STATE_TABLE_NAME = 'state'
+
+    CREATE_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {0} (
+  key TEXT PRIMARY KEY ON CONFLICT REPLACE,
+  value
+)
+""".format(STATE_TABLE_NAME)
+
+    SET_STATE = 'INSERT OR REPLACE INTO {0} (key, value) VALUES (?, ?)'.format(STATE_TABLE_NAME)
+
+    GET_STATE = 'SELECT value FROM {0} WHERE key=?'.format(STATE_TABLE_NAME)
+
+    LIST_ROWS_AFTER = 'SELECT id, uri, lrcpath FROM {0} WHERE id > ? ORDER BY id LIMIT ?'.format(TABLE_NAME)
+
+    # Rows reassigned since they were listed keep their ids, but have other
+    # lyrics, which are not checked yet.
+    DELETE_UNCHANGED_ROW = 'DELETE FROM {0} WHERE id=? AND lrcpath=?'.format(TABLE_NAME)
+
+    COUNT_LYRICS = 'SELECT COUNT(*) FROM {0}'.format(TABLE_NAME)
+
+    ADD_INFO_KEY = 'ALTER TABLE {0} ADD COLUMN info_key TEXT'.format(TABLE_NAME)
+
+    FILL_INFO_KEY = 'UPDATE {0} SET info_key = osdlyrics_info_key({1}, {2}, {3}, {4})'.format(TABLE_NAME, *METADATA_LIST)
+
+    # Finding by info only reads the index
+    CREATE_INFO_INDEX = """
+CREATE INDEX IF NOT EXISTS {0}_info ON {0} (info_key, lrcpath)
+""".format(TABLE_NAME)
+
+    ADD_FUZZY_COLUMNS = [
+        'ALTER TABLE {0} ADD COLUMN fuzzy_title TEXT'.format(TABLE_NAME),
+        'ALTER TABLE {0} ADD COLUMN fuzzy_artist TEXT'.format(TABLE_NAME),
+    ]
+
+    FILL_FUZZY_COLUMNS = """
+UPDATE {0} SET fuzzy_title = osdlyrics_fuzzy_text({1}),
+               fuzzy_artist = osdlyrics_fuzzy_text({2})
+""".format(TABLE_NAME, *METADATA_LIST)
+
+    FTS_TABLE_NAME = 'lyrics_fts'
+
+    # The full text index of fuzzy texts. It is an external content table of
+    # the lyrics table, kept in sync by triggers. FTS5 is an optional module
+    # of SQLite, so the index is created separately from the migrations.
+    CREATE_FTS_TABLE = [
+        """
+CREATE VIRTUAL TABLE {0} USING fts5(
+  fuzzy_title, fuzzy_artist, content='{1}', content_rowid='id'
+)
+""".format(FTS_TABLE_NAME, TABLE_NAME),
+        """
+CREATE TRIGGER IF NOT EXISTS {1}_fts_insert AFTER INSERT ON {1} BEGIN
+  INSERT INTO {0} (rowid, fuzzy_title, fuzzy_artist)
+    VALUES (new.id, new.fuzzy_title, new.fuzzy_artist);
+END
+""".format(FTS_TABLE_NAME, TABLE_NAME),
+        """
+CREATE TRIGGER IF NOT EXISTS {1}_fts_delete AFTER DELETE ON {1} BEGIN
+  INSERT INTO {0} ({0}, rowid, fuzzy_title, fuzzy_artist)
+    VALUES ('delete', old.id, old.fuzzy_title, old.fuzzy_artist);
+END
+""".format(FTS_TABLE_NAME, TABLE_NAME),
+        "INSERT INTO {0} ({0}) VALUES ('rebuild')".format(FTS_TABLE_NAME),
+    ]
+
+    FIND_FTS_TABLE = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='{0}'".format(FTS_TABLE_NAME)
+
+    FIND_FUZZY = """
+SELECT {1}.fuzzy_title, {1}.fuzzy_artist, {1}.lrcpath FROM {0}
+  JOIN {1} ON {1}.id = {0}.rowid
+  WHERE {0} MATCH ?
+  ORDER BY rank
+  LIMIT {2}
+""".format(FTS_TABLE_NAME, TABLE_NAME, FUZZY_CANDIDATES)
 
-    def __init__(self, dbfile=None):
+    def __init__(self, dbfile=None, fuzzy=False, autocommit=True):
         """
 
         Arguments:
         - `dbfile`: The sqlite db to open
+        - `fuzzy`: Whether to find by similar titles and artists if there is no
+          exact match. See `fuzzy`.
+        - `autocommit`: Whether to commit after each write. If False, writes
+          are committed by `commit`.
         """
+        self._autocommit = autocommit
         if dbfile is None:
             dbfile = osdlyrics.utils.get_config_path('lrc.db')
         self._dbfile = dbfile
         osdlyrics.utils.ensure_path(dbfile)
-        self._conn = sqlite3.connect(os.path.expanduser(dbfile))
-        self._create_table()
+        self._conn = sqlite3.connect(os.path.expanduser(dbfile),
+                                     cached_statements=STATEMENT_CACHE_SIZE)
+        # Readers are not blocked by writes in WAL mode, and a commit does
+        # not wait for fsync, which only risks the last commits on power loss.
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        # Rows replaced by INSERT OR REPLACE fire the delete trigger of the
+        # full text index only with recursive triggers.
+        self._conn.execute('PRAGMA recursive_triggers=ON')
+        self._migrate()
+        # The full text index is always kept in sync, so that fuzzy lookup can
+        # be enabled later.
+        self._has_fts = self._create_fts()
+        self.fuzzy = fuzzy
 
-    def _create_table(self):
-        """ Ensures the table structure of new open dbs
+    @property
+    def fuzzy(self):
+        """ Whether to find by similar titles and artists if there is no exact
+        match. It is always False if SQLite is built without FTS5.
+        """
+        return self._fuzzy
+
+    @fuzzy.setter
+    def fuzzy(self, value):
+        self._fuzzy = bool(value) and self._has_fts
+
+    def _migrate_v1(self, c):
+        """ Creates the tables of the original schema
         """
-        c = self._conn.cursor()
         c.execute(LrcDb.CREATE_TABLE)
-        self._conn.commit()
+        c.execute(LrcDb.CREATE_ENCODING_TABLE)
+        c.execute(LrcDb.CREATE_OFFSET_TABLE)
+
+    def _migrate_v2(self, c):
+        """ Adds normalized info keys and a covering index of them
+        """
+        self._conn.create_function('osdlyrics_info_key', 4, info_key)
+        c.execute(LrcDb.ADD_INFO_KEY)
+        c.execute(LrcDb.FILL_INFO_KEY)
+        c.execute(LrcDb.CREATE_INFO_INDEX)
+
+    def _migrate_v3(self, c):
+        """ Adds fuzzy texts of titles and artists
+        """
+        self._conn.create_function('osdlyrics_fuzzy_text', 1, fuzzy_text)
+        for statement in LrcDb.ADD_FUZZY_COLUMNS:
+            c.execute(statement)
+        c.execute(LrcDb.FILL_FUZZY_COLUMNS)
+
+    def _migrate_v4(self, c):
+        """ Adds the table of states
+        """
+        c.execute(LrcDb.CREATE_STATE_TABLE)
+
+    # The migration at index i upgrades the schema from version i to i + 1.
+    # The version of a db is stored in its user_version.
+    MIGRATIONS = [
+        _migrate_v1,
+        _migrate_v2,
+        _migrate_v3,
+        _migrate_v4,
+    ]
+
+    SCHEMA_VERSION = len(MIGRATIONS)
+
+    def _migrate(self):
+        """ Upgrades the schema of the db to `SCHEMA_VERSION`
+        """
+        c = self._conn.cursor()
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        if version > LrcDb.SCHEMA_VERSION:
+            logging.warning('Schema version %d of %s is newer than %d',
+                            version, self._dbfile, LrcDb.SCHEMA_VERSION)
+        for version in range(version, LrcDb.SCHEMA_VERSION):
+            logging.info('Upgrading schema of %s to version %d',
+                         self._dbfile, version + 1)
+            # Each migration is applied atomically with its version
+            c.execute('BEGIN')
+            try:
+                LrcDb.MIGRATIONS[version](self, c)
+                c.execute('PRAGMA user_version = %d' % (version + 1))
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
         c.close()
 
+    def _create_fts(self):
+        """ Ensures the full text index of fuzzy texts exists
+
+        Returns False if SQLite is built without FTS5.
+        """
+        c = self._conn.cursor()
+        try:
+            if c.execute(LrcDb.FIND_FTS_TABLE).fetchone() is not None:
+                return True
+            c.execute('BEGIN')
+            for statement in LrcDb.CREATE_FTS_TABLE:
+                c.execute(statement)
+            self._conn.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            self._conn.rollback()
+            logging.info('Fuzzy lookup is disabled: %s', e)
+            return False
+        finally:
+            c.close()
+
+    def commit(self):
+        """ Commits the pending writes
+        """
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _commit(self):
+        if self._autocommit:
+            self._conn.commit()
+
     def assign(self, metadata, uri):
         # type: (osdlyrics.metadata.Metadata, Text) -> None
         """ Assigns a uri of lyrics to tracks represented by metadata
         """
         c = self._conn.cursor()
-        location = metadata.location or ''
+        # Tracks without locations are stored with NULL, which does not
+        # conflict with other NULLs in the unique column.
+        location = metadata.location or None
         if self._find_by_location(metadata):
             logging.debug('Assign lyric file %s to track of location %s', uri, location)
             c.execute(LrcDb.UPDATE_LYRIC, (uri, location,))
@@ -121,10 +500,89 @@ UPDATE {0}
             album = metadata.album or ''
             tracknum = max(metadata.tracknum, 0)
             logging.debug('Assign lyrics file %s to track %s. %s - %s in album %s @ %s', uri, tracknum, artist, title, album, location)
-            c.execute(LrcDb.ASSIGN_LYRIC, (title, artist, album, tracknum, location, uri))
-        self._conn.commit()
+            key = info_key(title, artist, album, tracknum)
+            if location is None:
+                c.execute(LrcDb.DELETE_UNLOCATED_INFO, (key,))
+            c.execute(LrcDb.ASSIGN_LYRIC, (title, artist, album, tracknum, location, uri,
+                                           key, fuzzy_text(title), fuzzy_text(artist)))
+        self._commit()
         c.close()
 
+    def assign_many(self, associations, progress=None):
+        """ Assigns lyrics to many tracks in one transaction
+
+        Existing associations of the same track locations are replaced, as
+        well as those of the same info for tracks without locations.
+
+        Arguments:
+        - `associations`: An iterable of dicts with keys of ``title``,
+          ``artist``, ``album``, ``tracknum``, ``location`` and ``uri``, the
+          uri of lyrics. Missing keys are empty.
+        - `progress`: A callable invoked with the number of rows written so far
+          after every `IMPORT_CHUNK_SIZE` rows.
+
+        Returns the number of rows written. If any row fails, no row is written.
+        """
+        def to_row(association):
+            title = association.get('title') or ''
+            artist = association.get('artist') or ''
+            album = association.get('album') or ''
+            tracknum = max(int(association.get('tracknum') or 0), 0)
+            return (title, artist, album, tracknum,
+                    association.get('location') or None,
+                    association.get('uri') or '',
+                    info_key(title, artist, album, tracknum),
+                    fuzzy_text(title), fuzzy_text(artist))
+
+        rows = (to_row(a) for a in associations)
+        count = 0
+        c = self._conn.cursor()
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, IMPORT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                # Only the last of the rows without locations of the same
+                # info is kept, like assigning them one by one.
+                unlocated = dict((row[6], i) for i, row in enumerate(chunk)
+                                 if row[4] is None)
+                if unlocated:
+                    c.executemany(LrcDb.DELETE_UNLOCATED_INFO,
+                                  [(key,) for key in unlocated])
+                    chunk = [row for i, row in enumerate(chunk)
+                             if row[4] is not None or unlocated[row[6]] == i]
+                c.executemany(LrcDb.ASSIGN_LYRIC, chunk)
+                count += len(chunk)
+                if progress is not None:
+                    progress(count)
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            c.close()
+        self._conn.commit()
+        logging.info('Assigned lyrics to %d tracks', count)
+        return count
+
+    def iter_associations(self):
+        """ Yields all associations as dicts in the format of `assign_many`,
+        in the order they are assigned.
+        """
+        c = self._conn.cursor()
+        try:
+            c.execute(LrcDb.LIST_LYRICS)
+            for title, artist, album, tracknum, location, uri in c:
+                yield {
+                    'title': title or '',
+                    'artist': artist or '',
+                    'album': album or '',
+                    'tracknum': tracknum or 0,
+                    'location': location or '',
+                    'uri': uri or '',
+                }
+        finally:
+            c.close()
+
     def delete(self, metadata):
         """ Deletes lyrics association(s) for given metadata
 
@@ -135,9 +593,9 @@ UPDATE {0}
         if metadata.location:
             c.execute(LrcDb.DELETE_LYRIC + LrcDb.QUERY_LOCATION, (metadata.location,))
 
-        c.execute(LrcDb.DELETE_LYRIC + LrcDb.QUERY_INFO, query_param_from_metadata(metadata))
+        c.execute(LrcDb.DELETE_LYRIC + LrcDb.QUERY_INFO, (metadata_info_key(metadata),))
 
-        self._conn.commit()
+        self._commit()
         c.close()
 
     def find(self, metadata):
@@ -146,7 +604,8 @@ UPDATE {0}
         To find the location of lyrics, firstly find whether there is a record matched
         with the ``location`` attribute in metadata. If not found or ``location`` is
         not specified, try to find with respect to ``title``, ``artist``, ``album``
-        and ``tracknum``
+        and ``tracknum``. If still not found and `fuzzy` is true, try to find a
+        track with a similar title and artist.
 
         If found, return the uri of the LRC file. Otherwise return None. Note that
         this method may return an empty string, so use ``is None`` to figure out
@@ -158,8 +617,209 @@ UPDATE {0}
         ret = self._find_by_info(metadata)
         if ret is not None:
             return ret
+        if self.fuzzy:
+            return self._find_fuzzy(metadata)
+        return None
+
+    def assign_encoding(self, uri, validator, encoding):
+        """ Remembers the charset encoding of an LRC file
+
+        Arguments:
+        - `uri`: The uri of the LRC file
+        - `validator`: A tuple of the mtime and size of the file. The encoding
+          is forgotten once the file is changed.
+        - `encoding`: The name of the encoding
+        """
+        mtime, size = validator
+        logging.debug('Assign encoding %s to %s', encoding, uri)
+        c = self._conn.cursor()
+        c.execute(LrcDb.ASSIGN_ENCODING, (uri, encoding, mtime, size))
+        self._commit()
+        c.close()
+
+    def find_encoding(self, uri, validator):
+        """ Finds the charset encoding of an LRC file
+
+        Returns the encoding assigned by `assign_encoding` with the same
+        `validator`, or None if not found.
+        """
+        mtime, size = validator
+        c = self._conn.cursor()
+        c.execute(LrcDb.FIND_ENCODING, (uri, mtime, size))
+        r = c.fetchone()
+        c.close()
+        if r:
+            return r[0]
+        return None
+
+    def get_encoding(self, uri):
+        """ Returns a tuple of the charset encoding of an LRC file and the
+        validator it is assigned with, or None if not assigned.
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.GET_ENCODING, (uri,))
+        r = c.fetchone()
+        c.close()
+        if r:
+            return r[0], (r[1], r[2])
         return None
 
+    def list_encodings(self):
+        """ Returns a dict of all encodings assigned by `assign_encoding`, with
+        uris as keys and the return values of `get_encoding` as values.
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.LIST_ENCODINGS)
+        encodings = dict((r[0], (r[1], (r[2], r[3]))) for r in c.fetchall())
+        c.close()
+        return encodings
+
+    def assign_offset(self, uri, offset):
+        """ Sets the offset of an LRC file in milliseconds
+
+        The offset overrides the ``[offset:]`` attribute in the LRC file.
+        """
+        logging.debug('Assign offset %s to %s', offset, uri)
+        c = self._conn.cursor()
+        c.execute(LrcDb.ASSIGN_OFFSET, (uri, offset))
+        self._commit()
+        c.close()
+
+    def find_offset(self, uri):
+        """ Returns the offset of an LRC file assigned by `assign_offset`, or
+        None if not assigned.
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.FIND_OFFSET, (uri,))
+        r = c.fetchone()
+        c.close()
+        if r:
+            return r[0]
+        return None
+
+    def delete_offset(self, uri):
+        """ Removes the offset of an LRC file assigned by `assign_offset`
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.DELETE_OFFSET, (uri,))
+        self._commit()
+        c.close()
+
+    def list_offsets(self):
+        """ Returns a dict of all offsets assigned by `assign_offset`, with
+        uris as keys.
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.LIST_OFFSETS)
+        offsets = dict(c.fetchall())
+        c.close()
+        return offsets
+
+    def get_state(self, key, default=None):
+        """ Returns the state value set by `set_state`, or `default` if not set
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.GET_STATE, (key,))
+        r = c.fetchone()
+        c.close()
+        if r:
+            return r[0]
+        return default
+
+    def set_state(self, key, value):
+        """ Saves a state value of the daemon, which is an int, a float or a
+        string
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.SET_STATE, (key, value))
+        self._commit()
+        c.close()
+
+    def list_rows_after(self, row_id, limit):
+        """ Returns up to `limit` associations with ids greater than `row_id`,
+        as tuples of id, track location and lyrics uri in the order of ids.
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.LIST_ROWS_AFTER, (row_id, limit))
+        rows = c.fetchall()
+        c.close()
+        return rows
+
+    def delete_rows(self, rows):
+        """ Deletes associations returned by `list_rows_after`, unless their
+        lyrics are reassigned since then
+
+        Returns the number of deleted associations.
+        """
+        c = self._conn.cursor()
+        c.executemany(LrcDb.DELETE_UNCHANGED_ROW,
+                      [(row[0], row[2]) for row in rows])
+        count = c.rowcount
+        self._commit()
+        c.close()
+        return count
+
+    def count(self):
+        """ Returns the number of associations
+        """
+        c = self._conn.cursor()
+        c.execute(LrcDb.COUNT_LYRICS)
+        r = c.fetchone()
+        c.close()
+        return r[0]
+
+    def optimize(self, vacuum=False):
+        """ Updates the statistics of the query planner, and rebuilds the db
+        file to reclaim free pages if `vacuum` is true.
+        """
+        self._conn.commit()
+        self._conn.execute('PRAGMA optimize')
+        if vacuum:
+            self._conn.execute('VACUUM')
+
+    def find_batch(self, metadata_list):
+        """ Finds the location of LRC files for a list of metadata
+
+        Returns a list of results in the same order of `metadata_list`. Each
+        result is the same as the return value of `find`. Tracks are looked up
+        with one query for every `BATCH_SIZE` tracks.
+        """
+        results = []
+        for start in range(0, len(metadata_list), LrcDb.BATCH_SIZE):
+            results.extend(self._find_batch(metadata_list[start:start + LrcDb.BATCH_SIZE]))
+        return results
+
+    def _find_batch(self, metadata_list):
+        locations = list(set(m.location for m in metadata_list if m.location))
+        keys = [metadata_info_key(m) for m in metadata_list]
+        unique_keys = list(set(keys))
+        # Pad the lists of parameters with NULL, which matches nothing, so
+        # that the few distinct statements stay in the statement cache.
+        location_count = min(_padded_size(len(locations)), LrcDb.BATCH_SIZE)
+        key_count = min(_padded_size(len(unique_keys)), LrcDb.BATCH_SIZE)
+        query = LrcDb.FIND_LYRIC_BATCH.format(','.join('?' * location_count),
+                                              ','.join('?' * key_count))
+        c = self._conn.cursor()
+        c.execute(query, locations + [None] * (location_count - len(locations)) +
+                  unique_keys + [None] * (key_count - len(unique_keys)))
+        by_location = {}
+        by_info = {}
+        for location, key, lrcpath in c.fetchall():
+            by_location.setdefault(location, lrcpath)
+            by_info.setdefault(key, lrcpath)
+        c.close()
+        results = []
+        for metadata, key in zip(metadata_list, keys):
+            ret = None
+            if metadata.location:
+                ret = by_location.get(metadata.location)
+            if ret is None:
+                ret = by_info.get(key)
+            if ret is None and self.fuzzy:
+                ret = self._find_fuzzy(metadata)
+            results.append(ret)
+        return results
+
     def _find_by_condition(self, where_clause, parameters=None):
         query = LrcDb.FIND_LYRIC + where_clause
         logging.debug('Find by condition, query = %s, params = %s', query, parameters)
@@ -176,9 +836,362 @@ UPDATE {0}
             return None
         return self._find_by_condition(LrcDb.QUERY_LOCATION, (metadata.location,))
 
+    def _find_fuzzy(self, metadata):
+        """ Finds the lyrics of the track with the most similar title and
+        artist, if the confidence reaches `FUZZY_THRESHOLD`.
+        """
+        title = fuzzy_text(metadata.title)
+        artist = fuzzy_text(metadata.artist)
+        tokens = (title.split() + artist.split())[:FUZZY_MAX_TOKENS]
+        if not title:
+            return None
+        query = ' OR '.join('"%s"' % token for token in tokens)
+        c = self._conn.cursor()
+        try:
+            c.execute(LrcDb.FIND_FUZZY, (query,))
+            rows = c.fetchall()
+        except sqlite3.OperationalError as e:
+            logging.warning('Fuzzy lookup failed: %s', e)
+            return None
+        finally:
+            c.close()
+        best = None
+        best_confidence = 0
+        for row_title, row_artist, lrcpath in rows:
+            confidence = fuzzy_confidence(title, artist, row_title or '', row_artist or '')
+            if confidence > best_confidence:
+                best, best_confidence = lrcpath, confidence
+        if best is None:
+            return None
+        if best_confidence < FUZZY_THRESHOLD:
+            logging.debug('Best fuzzy match of %s - %s is %s with confidence %.2f, ignored',
+                          metadata.artist, metadata.title, best, best_confidence)
+            return None
+        logging.info('Fuzzy match of %s - %s: %s with confidence %.2f',
+                     metadata.artist, metadata.title, best, best_confidence)
+        return best
+
     def _find_by_info(self, metadata):
-        return self._find_by_condition(LrcDb.QUERY_INFO,
-                                       query_param_from_metadata(metadata))
+        return self._find_by_condition(LrcDb.QUERY_FIRST_INFO,
+                                       (metadata_info_key(metadata),))
+
+
+class DbTimeoutError(Exception):
+    """ Raised by `DbFuture.result` if the result is not available in time
+    """
+    pass
+
+
+class DbFuture(object):
+    """ The result of a request to `ThreadedLrcDb`, which is available later
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Waits until the result is available and returns it. Exceptions
+        raised by the request are raised again.
+
+        Raises `DbTimeoutError` if the result is not available after `timeout`
+        seconds.
+
+        >>> DbFuture().result(0.01)
+        Traceback (most recent call last):
+            ...
+        lrcdb.DbTimeoutError: the request to LrcDb timed out
+        """
+        if not self._done.wait(timeout):
+            raise DbTimeoutError('the request to LrcDb timed out')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, func):
+        """ Calls `func` with the future on the main loop once it is done
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        glib.idle_add(self._invoke, func)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            glib.idle_add(self._invoke, func)
+
+    def _invoke(self, func):
+        func(self)
+        return False
+
+
+class ThreadedLrcDb(object):
+    """ Runs a `LrcDb` on a dedicated thread
+
+    Requests are run in order on the thread, so a read sees all writes
+    requested before it. Writes return immediately and are committed
+    together, once the first of them has waited for `COMMIT_INTERVAL`
+    seconds or there are `COMMIT_BATCH` of them.
+
+    Reads have blocking forms with the same names as `LrcDb` and `_async`
+    forms returning a `DbFuture`, whose callbacks are run on the main loop.
+    The blocking forms must not be used on the main loop. Encodings and
+    offsets are few and read on every load of lyrics, so they are mirrored in
+    memory, and their reads never wait for the thread.
+
+    >>> import tempfile
+    >>> from osdlyrics.metadata import Metadata
+    >>> dbfile = tempfile.mktemp()
+    >>> db = ThreadedLrcDb(dbfile)
+    >>> db.assign(Metadata(title='Tiger', location='file:///a.mp3'), 'file:///a.lrc')
+    >>> db.assign_offset('file:///a.lrc', 200)
+    >>> db.find_offset('file:///a.lrc')
+    200
+    >>> db.find(Metadata(location='file:///a.mp3'))
+    'file:///a.lrc'
+    >>> future = db.find_batch_async([Metadata(title='Tiger'), Metadata(title='Lion')])
+    >>> future.result()
+    ['file:///a.lrc', None]
+    >>> db.close()
+    >>> LrcDb(dbfile).find(Metadata(title='Tiger'))
+    'file:///a.lrc'
+    >>> db = ThreadedLrcDb(dbfile)
+    >>> db.flush()
+    >>> db.find_offset('file:///a.lrc')
+    200
+    >>> db.close()
+    >>> os.remove(dbfile)
+    """
+
+    def __init__(self, dbfile=None, fuzzy=False):
+        """
+
+        Arguments:
+        - `dbfile`: The sqlite db to open
+        - `fuzzy`: See `LrcDb.fuzzy`
+        """
+        self._queue = queue.Queue()
+        self._fuzzy = fuzzy
+        self._mirror_lock = threading.Lock()
+        self._encodings = {}
+        self._offsets = {}
+        # Changes to the mirrors before they are loaded, which are applied
+        # again once loaded
+        self._mirror_changes = []
+        # The db is opened on the thread, so that migrations do not block the
+        # main loop. If it fails to open, every request fails with the error.
+        self._thread = threading.Thread(target=self._run,
+                                        args=(dbfile, fuzzy),
+                                        name='osdlyrics-lrcdb')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, dbfile, fuzzy):
+        try:
+            db = LrcDb(dbfile, fuzzy, autocommit=False)
+            self._load_mirrors(db)
+        except Exception as e:
+            logging.exception('Failed to open LrcDb %s', dbfile)
+            self._fail(e)
+            return
+        pending = 0
+        deadline = None
+        while True:
+            try:
+                if pending:
+                    request = self._queue.get(timeout=max(0, deadline - time.time()))
+                else:
+                    request = self._queue.get()
+            except queue.Empty:
+                self._commit(db, pending)
+                pending = 0
+                continue
+            future, func, args = request
+            if func is None:
+                # Flushed or closed
+                if pending:
+                    self._commit(db, pending)
+                    pending = 0
+                future.set_result(None)
+                if args:
+                    db.close()
+                    break
+                continue
+            if future is None:
+                # A write
+                try:
+                    func(db, *args)
+                except Exception:
+                    logging.exception('Failed to write to LrcDb')
+                pending += 1
+                if pending == 1:
+                    deadline = time.time() + COMMIT_INTERVAL
+                if pending >= COMMIT_BATCH:
+                    self._commit(db, pending)
+                    pending = 0
+                continue
+            try:
+                future.set_result(func(db, *args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _fail(self, exception):
+        while True:
+            future, func, args = self._queue.get()
+            if func is None:
+                future.set_result(None)
+                if args:
+                    break
+            elif future is not None:
+                future.set_exception(exception)
+
+    def _load_mirrors(self, db):
+        encodings = db.list_encodings()
+        offsets = db.list_offsets()
+        with self._mirror_lock:
+            self._encodings = encodings
+            self._offsets = offsets
+            changes, self._mirror_changes = self._mirror_changes, None
+            for name, uri, value in changes:
+                self._change_mirror(name, uri, value)
+
+    def _update_mirror(self, name, uri, value):
+        """ Sets the value of `uri` in the mirror named `name`, or removes it
+        if `value` is None.
+        """
+        with self._mirror_lock:
+            if self._mirror_changes is not None:
+                self._mirror_changes.append((name, uri, value))
+            self._change_mirror(name, uri, value)
+
+    def _change_mirror(self, name, uri, value):
+        mirror = getattr(self, name)
+        if value is None:
+            mirror.pop(uri, None)
+        else:
+            mirror[uri] = value
+
+    def _commit(self, db, count):
+        try:
+            db.commit()
+            logging.debug('Committed %d writes to LrcDb', count)
+        except Exception:
+            logging.exception('Failed to commit to LrcDb')
+
+    def _read(self, func, *args):
+        future = DbFuture()
+        self._queue.put((future, func, args))
+        return future
+
+    def _write(self, func, *args):
+        self._queue.put((None, func, args))
+
+    def flush(self):
+        """ Commits pending writes and waits until they are committed
+        """
+        future = DbFuture()
+        self._queue.put((future, None, ()))
+        future.result()
+
+    def close(self):
+        """ Commits pending writes and stops the thread
+        """
+        future = DbFuture()
+        self._queue.put((future, None, (True,)))
+        future.result()
+        self._thread.join()
+
+    @property
+    def fuzzy(self):
+        return self._fuzzy
+
+    @fuzzy.setter
+    def fuzzy(self, value):
+        self._fuzzy = value
+        self._write(lambda db: setattr(db, 'fuzzy', value))
+
+    def find(self, metadata):
+        return self.find_async(metadata).result()
+
+    def find_async(self, metadata):
+        return self._read(LrcDb.find, metadata)
+
+    def find_batch(self, metadata_list):
+        return self.find_batch_async(metadata_list).result()
+
+    def find_batch_async(self, metadata_list):
+        return self._read(LrcDb.find_batch, metadata_list)
+
+    def find_encoding(self, uri, validator):
+        known = self.get_encoding(uri)
+        if known is not None and tuple(known[1]) == tuple(validator):
+            return known[0]
+        return None
+
+    def get_encoding(self, uri):
+        with self._mirror_lock:
+            return self._encodings.get(uri)
+
+    def find_offset(self, uri):
+        with self._mirror_lock:
+            return self._offsets.get(uri)
+
+    def count(self):
+        return self.count_async().result()
+
+    def count_async(self):
+        return self._read(LrcDb.count)
+
+    def call_async(self, func, *args):
+        """ Runs `func` with the `LrcDb` and `args` on the thread of the db,
+        and returns a `DbFuture` of its return value.
+
+        Writes are committed before `func` is run, and `func` must commit its
+        own writes.
+        """
+        def run(db, *args):
+            db.commit()
+            return func(db, *args)
+        return self._read(run, *args)
+
+    def assign(self, metadata, uri):
+        self._write(LrcDb.assign, metadata, uri)
+
+    def delete(self, metadata):
+        self._write(LrcDb.delete, metadata)
+
+    def assign_encoding(self, uri, validator, encoding):
+        self._update_mirror('_encodings', uri, (encoding, tuple(validator)))
+        self._write(LrcDb.assign_encoding, uri, validator, encoding)
+
+    def assign_offset(self, uri, offset):
+        self._update_mirror('_offsets', uri, offset)
+        self._write(LrcDb.assign_offset, uri, offset)
+
+    def delete_offset(self, uri):
+        self._update_mirror('_offsets', uri, None)
+        self._write(LrcDb.delete_offset, uri)
+
+    def optimize(self, vacuum=False):
+        self._write(LrcDb.optimize, vacuum)
 
 
 def test():
@@ -217,14 +1230,128 @@ def test():
     '\u8def\u5f84'
     >>> db.find(Metadata.from_dict({'title': 'Tiger', 'artist': 'Soldiers', }))
     >>> db.find(Metadata())
+    >>> db.find_batch([Metadata.from_dict({'location': 'file:///tmp/asdf'}),
+    ...                metadata_uni,
+    ...                Metadata.from_dict({'title': 'Tiger', 'artist': 'Soldiers', }),
+    ...                Metadata.from_dict({'title': 'Tiger', 'artist': 'Soldier', })])
+    ['file:///tmp/b.lrc', '\u8def\u5f84', None, 'file:///tmp/b.lrc']
+    >>> db.find_batch([])
+    []
+    >>> db.assign_encoding('file:///tmp/a.lrc', (1.5, 10), 'gbk')
+    >>> db.find_encoding('file:///tmp/a.lrc', (1.5, 10))
+    'gbk'
+    >>> db.find_encoding('file:///tmp/a.lrc', (1.5, 11))
+    >>> db.get_encoding('file:///tmp/a.lrc')
+    ('gbk', (1.5, 10))
+    >>> db.list_encodings()
+    {'file:///tmp/a.lrc': ('gbk', (1.5, 10))}
+    >>> db.assign_offset('file:///tmp/a.lrc', -300)
+    >>> db.find_offset('file:///tmp/a.lrc')
+    -300
+    >>> db.list_offsets()
+    {'file:///tmp/a.lrc': -300}
+    >>> db.delete_offset('file:///tmp/a.lrc')
+    >>> db.find_offset('file:///tmp/a.lrc')
+    >>> db.fuzzy = True
+    >>> db.find(Metadata.from_dict({'title': 'Tiger (Remastered)', 'artist': 'Soldiers', }))
+    'file:///tmp/b.lrc'
+    >>> db.find(Metadata.from_dict({'title': 'Tiger', 'artist': 'Another', }))
+    >>> db.find(Metadata.from_dict({'title': 'Lion', 'artist': 'Soldier', }))
+    >>> db.fuzzy = False
     >>> db.delete(Metadata.from_dict({'location': 'file:///tmp/asdf'}))
     >>> db.find(Metadata.from_dict({'title': 'Tiger',
     ...                             'artist': 'Soldier',
     ...                             'location': 'file:///tmp/asdf'}))
+    >>> db.find(Metadata.from_dict({'title': ' \u6807\u9898', 'artist': '\u6b4c\u624b', }))
+    '\u8def\u5f84'
+
+    Reassigning a track without location replaces its lyrics
+
+    >>> wolf = {'title': 'Wolf', 'artist': 'Pack'}
+    >>> db.assign(Metadata.from_dict(wolf), 'file:///tmp/w1.lrc')
+    >>> db.assign(Metadata.from_dict(wolf), 'file:///tmp/w2.lrc')
+    >>> db.find(Metadata.from_dict(wolf))
+    'file:///tmp/w2.lrc'
+    >>> db.assign_many([dict(wolf, uri='file:///tmp/w3.lrc'),
+    ...                 dict(wolf, uri='file:///tmp/w4.lrc')])
+    1
+    >>> db.find(Metadata.from_dict(wolf))
+    'file:///tmp/w4.lrc'
+    >>> db._conn.execute("SELECT COUNT(*) FROM lyrics WHERE title = 'Wolf'").fetchone()[0]
+    1
+
+    Upgrade a db of the original schema
+
+    >>> import tempfile
+    >>> dbfile = tempfile.mktemp()
+    >>> conn = sqlite3.connect(dbfile)
+    >>> conn.execute(LrcDb.CREATE_TABLE) and None
+    >>> conn.execute("INSERT INTO lyrics (title, artist, album, tracknum, uri, lrcpath) "
+    ...              "VALUES ('Tiger', 'Soldier', '', 0, '', 'file:///tmp/a.lrc')") and None
+    >>> conn.commit()
+    >>> conn.close()
+    >>> db = LrcDb(dbfile)
+    >>> db.find(Metadata.from_dict({'title': 'tiger', 'artist': 'Soldier'}))
+    'file:///tmp/a.lrc'
+    >>> db._conn.execute('PRAGMA user_version').fetchone()[0] == LrcDb.SCHEMA_VERSION
+    True
+    >>> os.remove(dbfile)
     """
     import doctest
     doctest.testmod()
 
 
+def benchmark(rows=1000000, lookups=10000):
+    """
+    Measures `LrcDb.find` against a db with `rows` associations.
+
+    Lookups by info are compared with the full table scan of the original
+    schema, which has no index on the metadata columns.
+    """
+    import random
+    import shutil
+    import tempfile
+    import timeit
+    from osdlyrics.metadata import Metadata
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = LrcDb(os.path.join(tmpdir, 'lrc.db'))
+        start = timeit.default_timer()
+        db._conn.executemany(
+            LrcDb.ASSIGN_LYRIC,
+            (('Title %d' % i, 'Artist %d' % (i % 5000), 'Album %d' % (i % 20000), i % 20,
+              'file:///music/%d.mp3' % i, 'file:///lyrics/%d.lrc' % i,
+              info_key('Title %d' % i, 'Artist %d' % (i % 5000), 'Album %d' % (i % 20000), i % 20),
+              fuzzy_text('Title %d' % i), fuzzy_text('Artist %d' % (i % 5000)))
+             for i in range(rows)))
+        db._conn.commit()
+        print('%d rows inserted in %.1f s' % (rows, timeit.default_timer() - start))
+
+        def track(i):
+            return Metadata(title='Title %d' % i, artist='Artist %d' % (i % 5000),
+                            album='Album %d' % (i % 20000), tracknum=i % 20)
+        tracks = [track(random.randrange(rows)) for i in range(lookups)]
+        by_location = [Metadata(location='file:///music/%d.mp3' % random.randrange(rows))
+                       for i in range(lookups)]
+        info_time = timeit.timeit(lambda: [db.find(t) for t in tracks], number=1)
+        location_time = timeit.timeit(lambda: [db.find(t) for t in by_location], number=1)
+        scan_query = LrcDb.FIND_LYRIC + ' AND '.join('{0}=:{0}'.format(m) for m in LrcDb.METADATA_LIST)
+        scans = tracks[:20]
+        scan_time = timeit.timeit(
+            lambda: [db._conn.execute(scan_query, query_param_from_metadata(t)).fetchone()
+                     for t in scans],
+            number=1)
+        print('find by info:     %8.1f us/lookup' % (info_time * 1e6 / lookups))
+        print('find by location: %8.1f us/lookup' % (location_time * 1e6 / lookups))
+        print('full table scan:  %8.1f us/lookup' % (scan_time * 1e6 / len(scans)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 if __name__ == '__main__':
-    test()
+    import sys
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        test()
@@ -20,8 +20,9 @@
 
 from future import standard_library
 standard_library.install_aliases()
-from builtins import str
+from builtins import range, str
 
+import codecs
 import logging
 import os
 import os.path
@@ -32,15 +33,24 @@ import urllib.request
 import chardet
 import dbus
 import dbus.service
+import glib
 
 import osdlyrics
 from osdlyrics.app import App
 import osdlyrics.config
 import osdlyrics.lrc
 from osdlyrics.metadata import Metadata
-from osdlyrics.pattern import expand_file, expand_path
+from osdlyrics.pattern import PatternSet
 
+import associations
+import embeddedlyrics
 import lrcdb
+import lyricscache
+import lyricsindex
+import lyricstore
+import negativecache
+import sweeper
+import workerpool
 
 LYRICS_INTERFACE = 'org.osdlyrics.Lyrics'
 LYRICS_OBJECT_PATH = '/org/osdlyrics/Lyrics'
@@ -59,12 +69,45 @@ DEFAULT_PATH_PATTERNS = [
 
 SUPPORTED_SCHEMES = [
     'file',
-    # 'tag',
+    'tag',
+    'store',
     'none',
 ]
 
+# Where SetLyricContent saves lyrics, set by General/lyrics-storage: 'file' for
+# LRC files expanded from patterns, or 'store' for the compressed lyric store.
+DEFAULT_LYRICS_STORAGE = 'file'
+# Fuzzy matching may assign lyrics of another track with a similar title, so
+# it must be enabled by users
+DEFAULT_FUZZY_MATCH = False
+
+DEFAULT_CACHE_SIZE_KB = 4096
+
+# Offsets are saved to LrcDb once they are not changed for this long.
+OFFSET_SAVE_DELAY = 1000
+# If General/save-offset-to-file is set, offsets are written to LRC files once
+# they are not changed for this long.
+OFFSET_FLUSH_DELAY = 10000
+
+# Number of seconds to remember that lyrics of a track are not found
+NEGATIVE_CACHE_TTL = 600
+
+# Number of threads to load lyrics files
+LOADER_WORKERS = 2
+
 DETECT_CHARSET_GUESS_MIN_LEN = 40
 DETECT_CHARSET_GUESS_MAX_LEN = 100
+DETECT_CHARSET_FEED_CHUNK_LEN = 1024
+DETECT_CHARSET_FEED_MAX_LEN = 16 * 1024
+
+# UTF-32 goes first because its little endian BOM starts with the one of UTF-16
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
 
 
 class InvalidUriException(Exception):
@@ -98,20 +141,42 @@ def metadata_description(metadata):
     return '%s(%s)' % (metadata.title, metadata.artist)
 
 
-def decode_by_charset(content):
+def detect_charset(content):
     r"""
-    Detect the charset encoding of a string and decodes to unicode strings.
+    Detects the charset encoding of a byte string.
 
-    >>> decode_by_charset(u'\u4e2d\u6587')
-    '\u4e2d\u6587'
-    >>> decode_by_charset(u'\u4e2d\u6587'.encode('UTF-8'))
-    '\u4e2d\u6587'
-    >>> decode_by_charset(u'\u4e2d\u6587'.encode('HZ-GB-2312'))
-    '\u4e2d\u6587'
+    The cheap checks are done first. The slow detection of chardet is used
+    only if the content has no BOM and is not valid UTF-8.
+
+    >>> detect_charset(b'\xef\xbb\xbf[ti:title]')
+    'utf-8-sig'
+    >>> detect_charset(u'\u4e2d\u6587'.encode('UTF-8'))
+    'utf-8'
+    >>> detect_charset(b'plain ascii')
+    'utf-8'
     """
-    if isinstance(content, str):
-        return content
-    encoding = chardet.detect(content)['encoding']
+    for bom, encoding in BOM_ENCODINGS:
+        if content.startswith(bom):
+            return encoding
+    try:
+        content.decode('utf-8')
+        # HZ-GB-2312 is 7-bit and therefore valid UTF-8, but has `~{` to
+        # start GB2312 sequences.
+        if b'~{' not in content:
+            return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    # Most files are detected confidently within the first few KB, so try to
+    # stop early before running a full detection.
+    detector = chardet.UniversalDetector()
+    for start in range(0, min(len(content), DETECT_CHARSET_FEED_MAX_LEN),
+                       DETECT_CHARSET_FEED_CHUNK_LEN):
+        detector.feed(content[start:start + DETECT_CHARSET_FEED_CHUNK_LEN])
+        if detector.done:
+            break
+    encoding = detector.close()['encoding']
+    if not encoding and len(content) > DETECT_CHARSET_FEED_MAX_LEN:
+        encoding = chardet.detect(content)['encoding']
     # Sometimes, the content is well encoded but the last few bytes. This is
     # common in the files downloaded by old versions of OSD Lyrics. In this
     # case,chardet may fail to determine what the encoding it is. So we take
@@ -128,7 +193,7 @@ def decode_by_charset(content):
             slice_end = DETECT_CHARSET_GUESS_MIN_LEN
         logging.warning('Failed to detect encoding, try to decode a part of it')
         encoding = chardet.detect(content[:slice_end])['encoding']
-        logging.warning('guess encoding from part: ' + encoding)
+        logging.warning('guess encoding from part: %s', encoding)
     if not encoding:
         logging.warning('Failed to detect encoding, use utf-8 as fallback')
         encoding = 'utf-8'
@@ -139,7 +204,49 @@ def decode_by_charset(content):
     # string with utf-8 will always be right.
     if encoding == 'ascii':
         encoding = 'utf-8'
-    return content.decode(encoding, 'replace')
+    return encoding
+
+
+def decode_content(content, encoding=None):
+    r"""
+    Decodes content to unicode strings.
+
+    If `encoding` is given and the content can be decoded with it, the
+    detection is skipped.
+
+    Return values: text, encoding
+    - `text`: The decoded content
+    - `encoding`: The encoding used to decode, or None if `content` is
+      already a unicode string.
+
+    >>> decode_content(u'\u4e2d\u6587'.encode('GBK'), 'gbk')
+    ('\u4e2d\u6587', 'gbk')
+    >>> decode_content(u'\u4e2d\u6587'.encode('UTF-8'), 'ascii')
+    ('\u4e2d\u6587', 'utf-8')
+    """
+    if isinstance(content, str):
+        return content, None
+    if encoding:
+        try:
+            return content.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError):
+            logging.info('Cannot decode with remembered encoding %s', encoding)
+    encoding = detect_charset(content)
+    return content.decode(encoding, 'replace'), encoding
+
+
+def decode_by_charset(content):
+    r"""
+    Detect the charset encoding of a string and decodes to unicode strings.
+
+    >>> decode_by_charset(u'\u4e2d\u6587')
+    '\u4e2d\u6587'
+    >>> decode_by_charset(u'\u4e2d\u6587'.encode('UTF-8'))
+    '\u4e2d\u6587'
+    >>> decode_by_charset(u'\u4e2d\u6587'.encode('HZ-GB-2312'))
+    '\u4e2d\u6587'
+    """
+    return decode_content(content)[0]
 
 
 def is_valid_uri(uri):
@@ -184,28 +291,220 @@ def load_from_file(urlparts):
     except IOError as e:
         logging.info("Cannot open file %s to read: %s", path, e)
         return None
-    content = lrcfile.read()
+    with lrcfile:
+        max_size = osdlyrics.lrc.MAX_LRC_SIZE
+        if os.fstat(lrcfile.fileno()).st_size > max_size:
+            logging.warning("File %s is too large to be an LRC file", path)
+            return None
+        # The file may grow after fstat, so never read more than the limit.
+        content = lrcfile.read(max_size + 1)
+    if len(content) > max_size:
+        logging.warning("File %s is too large to be an LRC file", path)
+        return None
     return content
 
 
-def load_from_uri(uri):
-    # type: (Text) -> Optional[Text]
+def load_from_tag(urlparts):
     """
-    Load the content of LRC file from given URI
+    Load the lyrics embedded in the audio file from urlparse.ParseResult
+
+    Return the lyrics, or None if there are no lyrics in the file.
+    """
+    path = urllib.request.url2pathname(urlparts.path)
+    return embeddedlyrics.read_lyrics(path)
+
+
+def load_from_store(urlparts):
+    """
+    Load the lyrics from the lyric store by the hash in urlparse.ParseResult
+
+    Return the lyrics, or None if not found.
+    """
+    return lyricstore.default_store().get(urlparts.path)
+
+
+def embedded_lyrics_uri(metadata):
+    """
+    Returns the URI of lyrics embedded in the audio file of the track, or None
+    if the track is not a local file.
+
+    >>> embedded_lyrics_uri(Metadata(location='file:///music/a%20b.mp3'))
+    'tag:///music/a%20b.mp3'
+    >>> embedded_lyrics_uri(Metadata(location='http://example.com/a.mp3'))
+    """
+    location = metadata.location
+    if not location or not location.startswith('file:'):
+        return None
+    return 'tag:' + location[len('file:'):]
+
+
+def stat_uri(uri):
+    """
+    Returns a value that changes when the content of the lyrics in `uri`
+    changes, or None if the lyrics cannot be validated and should not be cached.
+    """
+    url_parts = urllib.parse.urlparse(uri)
+    if url_parts.scheme == 'store':
+        # Lyrics in the store never change for the same hash
+        return url_parts.path
+    if url_parts.scheme not in ('file', 'tag'):
+        return None
+    try:
+        st = os.stat(urllib.request.url2pathname(url_parts.path))
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _file_gone(uri):
+    """ Returns True if the file of a file: or tag: uri is missing but its
+    directory exists
+    """
+    url_parts = urllib.parse.urlparse(uri)
+    if url_parts.scheme not in ('file', 'tag'):
+        return False
+    path = urllib.request.url2pathname(url_parts.path)
+    if os.path.exists(path):
+        return False
+    return os.path.isdir(os.path.dirname(path))
+
+
+def association_exists(location, uri):
+    """
+    Returns False if the track at `location` or the lyrics `uri` assigned to
+    it are gone, so the association can be removed.
+
+    Files are only gone if their directory still exists, so tracks and lyrics
+    on unmounted media are kept. Tracks and lyrics that cannot be checked are
+    assumed to exist.
+
+    >>> association_exists('', 'file:///nonexistent.lrc')
+    False
+    >>> association_exists('', 'file:///nonexistent/a.lrc')
+    True
+    >>> association_exists('', 'none:')
+    True
+    >>> association_exists('file:///nonexistent.mp3', 'none:')
+    False
+    >>> association_exists('file:///nonexistent/a.mp3', 'none:')
+    True
+    """
+    if location and _file_gone(location):
+        return False
+    url_parts = urllib.parse.urlparse(uri or '')
+    if url_parts.scheme == 'store':
+        return url_parts.path in lyricstore.default_store()
+    return not _file_gone(uri or '')
+
+
+def load_raw_from_uri(uri):
+    # type: (Text) -> Optional[Union[bytes, Text]]
+    """
+    Load the undecoded content of LRC file from given URI
 
     If loaded, return the content. If failed, return None.
     """
     URI_LOAD_HANDLERS = {
         'file': load_from_file,
+        'tag': load_from_tag,
+        'store': load_from_store,
         'none': lambda uri: '',
     }
 
     url_parts = urllib.parse.urlparse(uri)
-    content = URI_LOAD_HANDLERS[url_parts.scheme](url_parts)
+    return URI_LOAD_HANDLERS[url_parts.scheme](url_parts)
+
+
+def decode_lrc(content, encoding=None):
+    """
+    Decodes the content of LRC file and removes NUL characters in it.
+
+    Returns the decoded content and the encoding. See `decode_content`.
+    """
+    content, encoding = decode_content(content, encoding)
+    if u'\x00' in content:
+        content = content.replace(u'\x00', '')
+    return content, encoding
+
+
+def load_from_uri(uri):
+    # type: (Text) -> Optional[Text]
+    """
+    Load the content of LRC file from given URI
+
+    If loaded, return the content. If failed, return None.
+    """
+    content = load_raw_from_uri(uri)
     if content is None:
         return None
-    content = decode_by_charset(content).replace(u'\x00', '')
-    return content
+    return decode_lrc(content)[0]
+
+
+def read_lyrics(uri, cached=None, known_encoding=None, parse=False):
+    """
+    Loads, decodes and optionally parses the lyrics in `uri`. This function
+    does not touch the database or the cache, so it can be run in worker
+    threads.
+
+    Arguments:
+    - `cached`: The `lyricscache.CacheEntry` of `uri` in the cache, or None.
+      It is returned if still valid.
+    - `known_encoding`: A tuple of encoding and validator returned by
+      `lrcdb.LrcDb.get_encoding`, or None.
+    - `parse`: Whether to parse the LRC content
+
+    Returns a tuple of the `lyricscache.CacheEntry` and the detected encoding,
+    or None if failed to load. An audio file without embedded lyrics gives an
+    entry with None content, so that it is not parsed again until modified.
+    """
+    validator = stat_uri(uri)
+    if validator is not None and cached is not None and \
+            cached.validator == validator:
+        if parse and cached.content is not None:
+            cached.lrc
+        return cached, None
+    content = load_raw_from_uri(uri)
+    if content is None:
+        if validator is not None and uri.startswith('tag:'):
+            return lyricscache.CacheEntry(validator, None), None
+        return None
+    encoding = None
+    if validator is not None and known_encoding is not None and \
+            known_encoding[1] == validator:
+        encoding = known_encoding[0]
+    content, encoding = decode_lrc(content, encoding)
+    entry = lyricscache.CacheEntry(validator, content)
+    if parse:
+        entry.lrc
+    return entry, encoding
+
+
+def probe_files(candidates):
+    """
+    Returns the first path in `candidates` that exists, or None.
+
+    `candidates` is a list of tuples of path and a function to check the path,
+    such as `os.path.isfile`, or None if the path is known to exist.
+    """
+    index = _first_existing(candidates)
+    if index is None:
+        return None
+    return candidates[index][0]
+
+
+def probe_batch(candidate_lists):
+    """
+    Returns the index of the first path that exists in each list of
+    candidates, or None if no path exists. See `probe_files`.
+    """
+    return [_first_existing(candidates) for candidates in candidate_lists]
+
+
+def _first_existing(candidates):
+    for index, (path, probe) in enumerate(candidates):
+        if probe is None or probe(path):
+            return index
+    return None
 
 
 def save_to_file(urlparts, content, create):
@@ -240,6 +539,33 @@ def save_to_file(urlparts, content, create):
     return True
 
 
+def save_to_store(urlparts, content, create):
+    # type: (Any, Union[bytes, Text], bool) -> bool
+    """
+    Save the content of LRC file to the lyric store
+
+    The content is decoded and stored as UTF-8. Return True if succeeded, or
+    False if the hash in urlparse.ParseResult does not match the content.
+    """
+    content = decode_lrc(content)[0]
+    key = lyricstore.default_store().put(content)
+    if key != urlparts.path:
+        logging.warning("Cannot save lyrics to store:%s: hash mismatch", urlparts.path)
+        return False
+    return True
+
+
+def store_uri(content):
+    # type: (Text) -> Text
+    """
+    Returns the URI of the decoded LRC content in the lyric store
+
+    >>> store_uri(u'[00:01]a')
+    'store:749042b3526cce2a8a34d318c90f4dd873594ef5'
+    """
+    return 'store:' + lyricstore.content_hash(content)
+
+
 def save_to_uri(uri, content, create=True):
     # type: (Text, bytes, bool) -> bool
     """
@@ -249,10 +575,14 @@ def save_to_uri(uri, content, create=True):
     """
     URI_SAVE_HANDLERS = {
         'file': save_to_file,
+        'store': save_to_store,
         'none': lambda urlparts, content, create: True,
     }
 
     url_parts = urllib.parse.urlparse(uri)
+    if url_parts.scheme not in URI_SAVE_HANDLERS:
+        logging.warning("Cannot save lyrics to %s: not supported", uri)
+        return False
     return URI_SAVE_HANDLERS[url_parts.scheme](url_parts, content, create)
 
 
@@ -286,12 +616,129 @@ class LyricsService(dbus.service.Object):
         dbus.service.Object.__init__(self,
                                      conn=conn,
                                      object_path=LYRICS_OBJECT_PATH)
-        self._db = lrcdb.LrcDb()
         self._config = osdlyrics.config.Config(conn)
+        self._db = lrcdb.ThreadedLrcDb(
+            fuzzy=self._config.get_bool('General/fuzzy-lyrics-match',
+                                        DEFAULT_FUZZY_MATCH))
+        self._config.connect_change('General/fuzzy-lyrics-match',
+                                    self._fuzzy_match_changed)
         self._metadata = Metadata()
+        self._cache = lyricscache.LyricsCache(self._get_cache_size())
+        self._config.connect_change('General/lyrics-cache-size',
+                                    self._cache_size_changed)
+        self._negative_cache = negativecache.NegativeCache(NEGATIVE_CACHE_TTL)
+        self._patterns = self._get_patterns()
+        self._workers = workerpool.WorkerPool(LOADER_WORKERS)
+        self._index = lyricsindex.LyricsIndex(self._patterns.static_paths,
+                                              self._workers)
+        self._index.connect_change(self._lyrics_dir_changed)
+        self._config.connect_change('General/lrc-path',
+                                    self._lrc_path_changed)
+        self._config.connect_change('General/lrc-filename',
+                                    self._lrc_filename_changed)
+        # Offsets set by SetOffset but not saved to LrcDb yet
+        self._pending_offsets = {}
+        # Offsets saved to LrcDb but not flushed to LRC files yet
+        self._unflushed_offsets = set()
+        self._offset_save_timer = None
+        self._offset_flush_timer = None
+        # URIs being loaded in worker threads and their callbacks
+        self._loading = {}
+        self._sweeper = sweeper.Sweeper(self._db, self._workers,
+                                        association_exists)
+        self._sweeper.start()
+
+    def _get_cache_size(self):
+        return self._config.get_int('General/lyrics-cache-size',
+                                    DEFAULT_CACHE_SIZE_KB) * 1024
+
+    def _cache_size_changed(self, key):
+        self._cache.max_size = self._get_cache_size()
+
+    def _fuzzy_match_changed(self, key):
+        self._db.fuzzy = self._config.get_bool('General/fuzzy-lyrics-match',
+                                               DEFAULT_FUZZY_MATCH)
+        self._negative_cache.clear()
+
+    def _get_patterns(self):
+        file_patterns = self._config.get_string_list('General/lrc-filename',
+                                                     DEFAULT_FILE_PATTERNS)
+        path_patterns = self._config.get_string_list('General/lrc-path',
+                                                     DEFAULT_PATH_PATTERNS)
+        return PatternSet(file_patterns, path_patterns)
 
-    def find_lrc_from_db(self, metadata):
-        uri = self._db.find(metadata)
+    def _lrc_path_changed(self, key):
+        self._negative_cache.clear()
+        self._patterns = self._get_patterns()
+        self._index.set_dirs(self._patterns.static_paths)
+
+    def _lrc_filename_changed(self, key):
+        self._negative_cache.clear()
+        self._patterns = self._get_patterns()
+
+    def _lyrics_dir_changed(self, dirname):
+        self._negative_cache.clear()
+
+    def load_lyrics_async(self, uri, callback,
+                          priority=workerpool.PRIORITY_DEFAULT, parse=True):
+        """ Loads and parses lyrics from uri in a worker thread
+
+        `callback` is called on the main loop with a `lyricscache.CacheEntry`,
+        or None if failed to load. Concurrent loads of the same URI share a
+        single read. If `parse` is False, the lyrics are only parsed when
+        the `lrc` of the entry is used.
+        """
+        loading = self._loading.get(uri)
+        if loading is not None:
+            loading[1].append(callback)
+            if priority < loading[0] or (parse and not loading[2]):
+                # The pending load may be queued behind background tasks, or
+                # may not parse. Whichever finishes first answers all
+                # callbacks.
+                loading[0] = min(priority, loading[0])
+                loading[2] = loading[2] or parse
+                self._submit_load(uri, loading[0], loading[2])
+            return
+        self._loading[uri] = [priority, [callback], parse]
+        self._submit_load(uri, priority, parse)
+
+    def _submit_load(self, uri, priority, parse):
+        known_encoding = self._db.get_encoding(uri)
+
+        def onfinish(result):
+            entry = self._finish_load(uri, known_encoding, result)
+            loading = self._loading.pop(uri, None)
+            if loading is not None:
+                for func in loading[1]:
+                    func(entry)
+
+        def onerror(e):
+            loading = self._loading.pop(uri, None)
+            if loading is not None:
+                for func in loading[1]:
+                    func(None)
+
+        self._workers.submit(read_lyrics,
+                             (uri, self._cache.peek(uri), known_encoding, parse),
+                             onfinish, onerror, priority)
+
+    def _finish_load(self, uri, known_encoding, result):
+        if result is None:
+            return None
+        entry, encoding = result
+        validator = entry.validator
+        if validator is None:
+            return entry
+        if encoding and (encoding, validator) != known_encoding:
+            self._db.assign_encoding(uri, validator, encoding)
+        if self._cache.get(uri, validator) is not entry:
+            self._cache.add(uri, entry)
+        if entry.content is None:
+            return None
+        return entry
+
+    @staticmethod
+    def _db_uri(uri):
         if uri == '':
             return 'none:'
         return ensure_uri_scheme(uri)
@@ -301,57 +748,300 @@ class LyricsService(dbus.service.Object):
 
     def assign_lrc_uri(self, metadata, uri):
         self._db.assign(metadata, uri)
+        self._cache.invalidate(uri)
+        self._negative_cache.clear()
         if metadata == self._metadata:
             self.CurrentLyricsChanged()
 
     @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
                          in_signature='a{sv}',
-                         out_signature='bsa{ss}aa{sv}')
-    def GetLyrics(self, metadata):
-        ret, uri, content = self.GetRawLyrics(metadata)
-        if ret:
-            attr, lines = osdlyrics.lrc.parse_lrc(content)
-            return ret, uri, attr, lines
-        else:
-            return ret, uri, {}, []
+                         out_signature='bsa{ss}aa{sv}',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetLyrics(self, metadata, reply_handler, error_handler):
+        def found(ret, uri, entry):
+            try:
+                if ret and entry is not None:
+                    attrs = entry.lrc.attrs
+                    offset = self.find_offset(uri)
+                    if offset is not None:
+                        attrs = dict(attrs)
+                        attrs['offset'] = str(offset)
+                    reply_handler(ret, uri, attrs, entry.lrc.to_dbus())
+                else:
+                    reply_handler(ret, uri, {}, [])
+            except Exception as e:
+                error_handler(e)
+        self.find_lyrics_async(metadata, found)
 
     @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
                          in_signature='a{sv}',
-                         out_signature='bss')
-    def GetRawLyrics(self, metadata):
+                         out_signature='bss',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetRawLyrics(self, metadata, reply_handler, error_handler):
+        def found(ret, uri, entry):
+            try:
+                if entry is None:
+                    reply_handler(ret, uri, '')
+                    return
+                offset = self.find_offset(uri)
+                if offset is not None:
+                    reply_handler(ret, uri, update_lrc_offset(entry.content, offset))
+                else:
+                    reply_handler(ret, uri, entry.content)
+            except Exception as e:
+                error_handler(e)
+        self.find_lyrics_async(metadata, found, parse=False)
+
+    def find_lyrics_async(self, metadata, callback,
+                          priority=workerpool.PRIORITY_DEFAULT, parse=True):
+        """ Finds the lyrics of a track, loading files in worker threads.
+        See `load_lyrics_async` for `parse`.
+
+        `callback` is called on the main loop with 3 arguments:
+        - `found`: Whether the lyrics is found.
+        - `uri`: The URI of the lyrics, or an empty string if not found.
+        - `lrc`: A `lyricscache.CacheEntry` of the loaded lyrics, or None if
+          not found or the track is assigned with no lyrics.
+        """
         if isinstance(metadata, dict):
             metadata = Metadata.from_dict(metadata)
-        uri = self.find_lrc_from_db(metadata)
-        lrc = None
-        if uri:
-            if uri == 'none:':
-                return True, uri, ''
-            lrc = load_from_uri(uri)
-            if lrc is not None:
-                return True, uri, lrc
-        uri = self.find_lrc_by_pattern(metadata)
-        if uri:
-            lrc = load_from_uri(uri)
-            if lrc is not None:
-                logging.info("LRC for track %s not found in db but found by pattern: %s", metadata_description(metadata), uri)
-        if lrc is None:
+        key = negativecache.metadata_key(metadata)
+
+        def not_found(*args):
             logging.info("LRC for track %s not found", metadata_description(metadata))
-            return False, '', ''
-        else:
-            logging.info("LRC for track %s found: %s", metadata_description(metadata), uri)
-            return True, uri, lrc
+            self._negative_cache.add(key)
+            callback(False, '', None)
+
+        def embedded_loaded(uri, entry):
+            if entry is None:
+                not_found()
+            else:
+                logging.info("LRC for track %s found in tags: %s", metadata_description(metadata), uri)
+                callback(True, uri, entry)
+
+        def find_embedded():
+            uri = embedded_lyrics_uri(metadata)
+            if not uri:
+                not_found()
+                return
+            self.load_lyrics_async(uri, lambda entry: embedded_loaded(uri, entry),
+                                   priority, parse)
+
+        def pattern_loaded(uri, entry):
+            if entry is None:
+                find_embedded()
+            else:
+                logging.info("LRC for track %s not found in db but found by pattern: %s", metadata_description(metadata), uri)
+                callback(True, uri, entry)
+
+        def pattern_probed(path):
+            if not path:
+                find_embedded()
+                return
+            uri = ensure_uri_scheme(path)
+            self.load_lyrics_async(uri, lambda entry: pattern_loaded(uri, entry),
+                                   priority, parse)
+
+        def find_by_pattern():
+            # The negative cache may report a track by mistake, so it is only
+            # checked after the database.
+            if key in self._negative_cache:
+                logging.debug("LRC for track %s is known to be not found", metadata_description(metadata))
+                callback(False, '', None)
+                return
+            candidates = self._pattern_candidates(metadata)
+            if not candidates or not candidates[0][1]:
+                pattern_probed(probe_files(candidates))
+            else:
+                self._workers.submit(probe_files, (candidates,),
+                                     pattern_probed, not_found, priority)
+
+        def db_loaded(db_uri, entry):
+            if entry is not None:
+                logging.info("LRC for track %s found: %s", metadata_description(metadata), db_uri)
+                callback(True, db_uri, entry)
+            else:
+                find_by_pattern()
+
+        def db_found(future):
+            try:
+                db_uri = self._db_uri(future.result())
+            except Exception:
+                logging.exception('Failed to find lyrics in LrcDb')
+                db_uri = None
+            if db_uri == 'none:':
+                callback(True, db_uri, None)
+            elif db_uri:
+                self.load_lyrics_async(db_uri, lambda entry: db_loaded(db_uri, entry),
+                                       priority, parse)
+            else:
+                find_by_pattern()
+
+        self._db.find_async(metadata).add_done_callback(db_found)
+
+    def resolve_batch(self, metadata_list, callback):
+        """ Finds the URIs of lyrics of tracks without loading them
+
+        Tracks are handled in chunks, with one database query and one worker
+        task checking files for each chunk.
+
+        `callback` is called on the main loop with a list of tuples of found
+        and uri, in the same order of `metadata_list`.
+        """
+        metadata_list = [m if isinstance(m, Metadata) else Metadata.from_dict(m)
+                         for m in metadata_list]
+        results = []
+
+        def resolve_chunk():
+            start = len(results)
+            if start >= len(metadata_list):
+                callback(results)
+                return
+            chunk = metadata_list[start:start + lrcdb.LrcDb.BATCH_SIZE]
+            self._db.find_batch_async(chunk).add_done_callback(
+                lambda future: resolve_found(chunk, future))
+
+        def resolve_found(chunk, future):
+            keys = [negativecache.metadata_key(m) for m in chunk]
+            try:
+                db_uris = future.result()
+            except Exception:
+                logging.exception('Failed to find lyrics in LrcDb')
+                db_uris = [None] * len(chunk)
+            # Each track has a list of candidates of (path, probe) to check on
+            # the file system and their URIs, or None if resolved.
+            candidate_lists = []
+            uri_lists = []
+            # Whether each track is known to have no lyrics other than those
+            # assigned in the database
+            known_missing = []
+            needs_probe = False
+            for metadata, key, db_uri in zip(chunk, keys, db_uris):
+                known_missing.append(key in self._negative_cache)
+                candidates = []
+                uris = []
+                if db_uri == '':
+                    candidates.append((None, None))
+                    uris.append('none:')
+                elif db_uri is not None:
+                    uri = ensure_uri_scheme(db_uri)
+                    url_parts = urllib.parse.urlparse(uri)
+                    path = urllib.request.url2pathname(url_parts.path)
+                    if url_parts.scheme == 'file':
+                        candidates.append((path, os.path.isfile))
+                    elif url_parts.scheme == 'tag':
+                        candidates.append((path, embeddedlyrics.has_lyrics))
+                    else:
+                        candidates.append((None, None))
+                    uris.append(uri)
+                if known_missing[-1]:
+                    needs_probe = needs_probe or any(c[1] is not None for c in candidates)
+                    candidate_lists.append(candidates)
+                    uri_lists.append(uris)
+                    continue
+                for path, probe in self._pattern_candidates(metadata):
+                    candidates.append((path, probe))
+                    uris.append(ensure_uri_scheme(path))
+                uri = embedded_lyrics_uri(metadata)
+                if uri:
+                    path = urllib.request.url2pathname(urllib.parse.urlparse(uri).path)
+                    candidates.append((path, embeddedlyrics.has_lyrics))
+                    uris.append(uri)
+                needs_probe = needs_probe or any(c[1] is not None for c in candidates)
+                candidate_lists.append(candidates)
+                uri_lists.append(uris)
+
+            def probed(indices):
+                for key, index, uris, missing in zip(keys, indices, uri_lists,
+                                                     known_missing):
+                    if index is None:
+                        if not missing:
+                            self._negative_cache.add(key)
+                        results.append((False, ''))
+                    else:
+                        results.append((True, uris[index]))
+                resolve_chunk()
+
+            def probe_failed(e):
+                probed([None] * len(chunk))
+
+            if needs_probe:
+                self._workers.submit(probe_batch, (candidate_lists,),
+                                     probed, probe_failed)
+            else:
+                probed(probe_batch(candidate_lists))
+
+        resolve_chunk()
+
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='aa{sv}',
+                         out_signature='a(bs)',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def HasLyricsBatch(self, metadata_list, reply_handler, error_handler):
+        self.resolve_batch(metadata_list, reply_handler)
+
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='aa{sv}',
+                         out_signature='a(bss)',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetLyricsBatch(self, metadata_list, reply_handler, error_handler):
+        def resolved(resolutions):
+            results = [(found, uri, '') for found, uri in resolutions]
+            pending = [i for i, (found, uri) in enumerate(resolutions)
+                       if found and uri != 'none:']
+            if not pending:
+                reply_handler(results)
+                return
+            remaining = [len(pending)]
+
+            def loaded(index, entry):
+                uri = results[index][1]
+                if entry is None:
+                    results[index] = (False, '', '')
+                else:
+                    offset = self.find_offset(uri)
+                    content = entry.content
+                    if offset is not None:
+                        content = update_lrc_offset(content, offset)
+                    results[index] = (True, uri, content)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    reply_handler(results)
+
+            for index in pending:
+                # Only the raw content is returned
+                self.load_lyrics_async(results[index][1],
+                                       lambda entry, index=index: loaded(index, entry),
+                                       parse=False)
+        self.resolve_batch(metadata_list, resolved)
+
+    def prefetch(self, metadata_list):
+        """ Finds and loads the lyrics of tracks in the background, so that
+        they are in the lyrics cache when requested.
+        """
+        for metadata in metadata_list:
+            self.find_lyrics_async(metadata, lambda found, uri, entry: None,
+                                   workerpool.PRIORITY_LOW)
+
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='aa{sv}',
+                         out_signature='')
+    def PrefetchLyrics(self, metadata_list):
+        self.prefetch(Metadata.from_dict(metadata) for metadata in metadata_list)
 
     @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
                          in_signature='',
-                         out_signature='bsa{ss}aa{sv}')
-    def GetCurrentLyrics(self):
-        return self.GetLyrics(self._metadata)
+                         out_signature='bsa{ss}aa{sv}',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetCurrentLyrics(self, reply_handler, error_handler):
+        self.GetLyrics(self._metadata, reply_handler, error_handler)
 
     @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
                          in_signature='',
-                         out_signature='bss')
-    def GetCurrentRawLyrics(self):
-        return self.GetRawLyrics(self._metadata)
+                         out_signature='bss',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetCurrentRawLyrics(self, reply_handler, error_handler):
+        self.GetRawLyrics(self._metadata, reply_handler, error_handler)
 
     @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
                          in_signature='a{sv}ay',
@@ -362,7 +1052,18 @@ class LyricsService(dbus.service.Object):
         # Remove any existing file association and save the new lyrics content
         # to the configured patterns.
         self._db.delete(metadata)
-        uri = self._save_to_patterns(metadata, content)
+        self._negative_cache.clear()
+        if self._config.get_string('General/lyrics-storage',
+                                   DEFAULT_LYRICS_STORAGE) == 'store':
+            uri = self._save_to_store(metadata, content)
+        else:
+            uri = self._save_to_patterns(metadata, content)
+        if uri:
+            self._cache.invalidate(uri)
+            # The offset of the new content is in the content itself
+            self._pending_offsets.pop(uri, None)
+            self._unflushed_offsets.discard(uri)
+            self._db.delete_offset(uri)
         if uri and metadata == self._metadata:
             self.CurrentLyricsChanged()
         return uri
@@ -374,6 +1075,91 @@ class LyricsService(dbus.service.Object):
         metadata = Metadata.from_dict(metadata)
         self.assign_lrc_uri(metadata, uri)
 
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='ss',
+                         out_signature='i',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def ImportAssociations(self, path, format, reply_handler, error_handler):
+        # Each chunk is written by a separate request to LrcDb, so lookups
+        # are not queued behind the whole import.
+        chunks = []
+        imported = [0]
+
+        def write_next():
+            self._db.call_async(lrcdb.LrcDb.assign_many,
+                                chunks.pop(0)).add_done_callback(import_chunk)
+
+        def finish():
+            if imported[0]:
+                self._negative_cache.clear()
+                self.CurrentLyricsChanged()
+
+        def import_chunk(future):
+            try:
+                imported[0] += future.result()
+            except Exception as e:
+                finish()
+                error_handler(e)
+                return
+            self.AssociationsImportProgress(path, imported[0])
+            if chunks:
+                write_next()
+            else:
+                finish()
+                reply_handler(imported[0])
+
+        def read(rows):
+            size = lrcdb.IMPORT_CHUNK_SIZE
+            chunks.extend(rows[i:i + size] for i in range(0, len(rows), size))
+            if chunks:
+                write_next()
+            else:
+                reply_handler(0)
+
+        self._workers.submit(associations.read_file, (path, format or None),
+                             read, error_handler, workerpool.PRIORITY_LOW)
+
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='ss',
+                         out_signature='i',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def ExportAssociations(self, path, format, reply_handler, error_handler):
+        def exported(future):
+            try:
+                reply_handler(future.result())
+            except Exception as e:
+                error_handler(e)
+
+        self._db.call_async(associations.export_file, path,
+                            format or None).add_done_callback(exported)
+
+    @dbus.service.signal(dbus_interface=LYRICS_INTERFACE,
+                         signature='si')
+    def AssociationsImportProgress(self, path, count):
+        pass
+
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='',
+                         out_signature='a{sv}',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetSweepStats(self, reply_handler, error_handler):
+        stats = self._sweeper.stats
+
+        def counted(future):
+            try:
+                stats['associations'] = future.result()
+                reply_handler(dbus.Dictionary(stats, signature='sv'))
+            except Exception as e:
+                error_handler(e)
+        self._db.count_async().add_done_callback(counted)
+
+    @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
+                         in_signature='a{sv}',
+                         out_signature='b')
+    def IsKnownMissing(self, metadata):
+        metadata = Metadata.from_dict(metadata)
+        return negativecache.metadata_key(metadata) in self._negative_cache
+
     @dbus.service.signal(dbus_interface=LYRICS_INTERFACE,
                          signature='')
     def CurrentLyricsChanged(self):
@@ -381,16 +1167,76 @@ class LyricsService(dbus.service.Object):
 
     @dbus.service.method(dbus_interface=LYRICS_INTERFACE,
                          in_signature='si',
-                         out_signature='')
-    def SetOffset(self, uri, offset_ms):
+                         out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def SetOffset(self, uri, offset_ms, reply_handler, error_handler):
         if not is_valid_uri(uri):
             raise InvalidUriException(uri)
-        content = load_from_uri(uri)
-        if content is None:
-            raise CannotLoadLrcException(uri)
-        content = update_lrc_offset(content, offset_ms).encode('utf-8')
-        if not save_to_uri(uri, content, True):
-            raise CannotSaveLrcException(uri)
+
+        def loaded(entry):
+            if entry is None:
+                error_handler(CannotLoadLrcException(uri))
+                return
+            # Offsets are kept as an overlay of the LRC file, so a burst of
+            # calls while the user is adjusting ends up in a single write to
+            # LrcDb.
+            self._pending_offsets[uri] = offset_ms
+            if self._offset_save_timer is not None:
+                glib.source_remove(self._offset_save_timer)
+            self._offset_save_timer = glib.timeout_add(OFFSET_SAVE_DELAY,
+                                                       self._save_offsets)
+            reply_handler()
+        self.load_lyrics_async(uri, loaded, parse=False)
+
+    def find_offset(self, uri):
+        """ Returns the offset set by SetOffset of the LRC file, or None if the
+        offset is not set.
+        """
+        if uri in self._pending_offsets:
+            return self._pending_offsets[uri]
+        return self._db.find_offset(uri)
+
+    def _save_offsets(self):
+        self._offset_save_timer = None
+        for uri, offset in self._pending_offsets.items():
+            self._db.assign_offset(uri, offset)
+        self._unflushed_offsets.update(self._pending_offsets)
+        self._pending_offsets = {}
+        if self._config.get_bool('General/save-offset-to-file', False):
+            if self._offset_flush_timer is not None:
+                glib.source_remove(self._offset_flush_timer)
+            self._offset_flush_timer = glib.timeout_add(OFFSET_FLUSH_DELAY,
+                                                        self._flush_offsets)
+        else:
+            self._unflushed_offsets.clear()
+        return False
+
+    def _flush_offsets(self):
+        """ Writes the offsets in LrcDb to the LRC files and removes them from
+        LrcDb
+        """
+        self._offset_flush_timer = None
+        if self._pending_offsets:
+            # The user is adjusting again. It will be flushed next time.
+            return False
+        for uri in self._unflushed_offsets:
+            offset = self._db.find_offset(uri)
+            if offset is None or not uri.startswith('file:'):
+                # Only LRC files are rewritten. Offsets of lyrics in tags or
+                # in the store are kept in LrcDb.
+                continue
+            content = load_from_uri(uri)
+            if content is None:
+                logging.warning('Cannot load %s to save the offset', uri)
+                continue
+            content = update_lrc_offset(content, offset).encode('utf-8')
+            self._cache.invalidate(uri)
+            if save_to_uri(uri, content, False):
+                self._db.delete_offset(uri)
+            else:
+                logging.warning('Cannot save the offset to %s', uri)
+        self._unflushed_offsets.clear()
+        return False
 
     def _save_to_patterns(self, metadata, content):
         """ Save content to file expanded from given patterns
@@ -399,45 +1245,58 @@ class LyricsService(dbus.service.Object):
         - `metadata`:
         - `content`:
         """
-        file_patterns = self._config.get_string_list('General/lrc-filename',
-                                                     DEFAULT_FILE_PATTERNS)
-        path_patterns = self._config.get_string_list('General/lrc-path',
-                                                     DEFAULT_PATH_PATTERNS)
-        for path_pat in path_patterns:
-            try:
-                path = expand_path(path_pat, metadata)
-            except Exception:
-                continue
-            for file_pat in file_patterns:
-                try:
-                    filename = expand_file(file_pat, metadata)
-                    fullpath = os.path.join(path, filename + '.lrc')
-                    uri = osdlyrics.utils.path2uri(fullpath)
-                    if save_to_uri(uri, content):
-                        return uri
-                except osdlyrics.pattern.PatternException:
-                    pass
+        for path, filename in self._patterns.expand(metadata):
+            fullpath = os.path.join(path, filename + '.lrc')
+            uri = osdlyrics.utils.path2uri(fullpath)
+            if save_to_uri(uri, content):
+                self._index.add(fullpath)
+                return uri
         return ''
 
+    def _save_to_store(self, metadata, content):
+        """ Save content to the lyric store and assign it to the track
+
+        Returns the URI of the lyrics, or an empty string if failed.
+        """
+        content = decode_lrc(content)[0]
+        uri = store_uri(content)
+        if not save_to_uri(uri, content):
+            return ''
+        self._db.assign(metadata, uri)
+        return uri
+
+    def _pattern_candidates(self, metadata):
+        """ Returns the paths expanded from patterns that may be the lyrics of
+        the track, in the format of `probe_files` arguments.
+
+        Paths in indexed directories are resolved with the index, so only the
+        other paths need to be checked on the file system. File names with
+        subdirectories, such as those from ``%p/%t``, are always checked as
+        subdirectories are not indexed.
+        """
+        candidates = []
+        for path, filename in self._patterns.expand(metadata):
+            filename = filename + '.lrc'
+            if os.sep not in filename and self._index.is_indexed(path):
+                fullpath = self._index.find(path, filename)
+                if fullpath is not None:
+                    candidates.append((fullpath, None))
+                    break
+            else:
+                candidates.append((os.path.join(path, filename), os.path.isfile))
+        return candidates
+
     def _expand_patterns(self, metadata):
-        file_patterns = self._config.get_string_list('General/lrc-filename',
-                                                     DEFAULT_FILE_PATTERNS)
-        path_patterns = self._config.get_string_list('General/lrc-path',
-                                                     DEFAULT_PATH_PATTERNS)
-        for path_pat in path_patterns:
-            try:
-                path = expand_path(path_pat, metadata)
-            except Exception:
-                continue
-            for file_pat in file_patterns:
-                try:
-                    filename = expand_file(file_pat, metadata)
-                    fullpath = os.path.join(path, filename + '.lrc')
-                    if os.path.isfile(fullpath):
-                        return fullpath
-                except osdlyrics.pattern.PatternException:
-                    pass
-        return None
+        return probe_files(self._pattern_candidates(metadata))
+
+    def close(self):
+        """ Saves pending offsets and closes the database
+        """
+        self._sweeper.stop()
+        if self._offset_save_timer is not None:
+            glib.source_remove(self._offset_save_timer)
+            self._save_offsets()
+        self._db.close()
 
     def set_current_metadata(self, metadata):
         logging.info('Setting current metadata: %s', metadata)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from builtins import object
+
+from collections import OrderedDict
+import logging
+import sys
+
+import osdlyrics.lrc
+
+__all__ = (
+    'LyricsCache',
+)
+
+# Rough memory cost of an entry besides its content
+ENTRY_OVERHEAD = 256
+
+
+class CacheEntry(object):
+    """ The content of an LRC file and its parsed result
+
+    The content is None for an audio file without embedded lyrics.
+    """
+
+    __slots__ = ('validator', 'content', 'size', '_lrc')
+
+    def __init__(self, validator, content):
+        self.validator = validator
+        self.content = content
+        # The parsed lines hold roughly another copy of the text.
+        self.size = sys.getsizeof(content) * 2 + ENTRY_OVERHEAD
+        self._lrc = None
+
+    @property
+    def lrc(self):
+        """ The `osdlyrics.lrc.LrcData` of the content, parsed on first access
+        """
+        if self._lrc is None:
+            self._lrc = osdlyrics.lrc.parse(self.content)
+        return self._lrc
+
+
+class LyricsCache(object):
+    """ LRU cache of loaded lyrics, bounded by an estimated memory size
+
+    Entries are keyed by the URI of lyrics. Each entry is stored with a
+    validator, such as the mtime and size of the file. An entry is only
+    returned if the validator given to `get` is the same.
+
+    >>> cache = LyricsCache(1024)
+    >>> cache.get('file:///a.lrc', (1, 2))
+    >>> cache.put('file:///a.lrc', (1, 2), '[00:01]a').lrc.texts
+    ['a']
+    >>> cache.get('file:///a.lrc', (1, 2)).content
+    '[00:01]a'
+    >>> cache.get('file:///a.lrc', (1, 3))
+    >>> cache.hits, cache.misses
+    (1, 2)
+    >>> entry = cache.put('file:///b.lrc', (1, 2), 'b' * 1024)
+    >>> cache.get('file:///b.lrc', (1, 2))
+    >>> cache.put('file:///a.lrc', (1, 2), 'a') and None
+    >>> cache.peek('file:///a.lrc').content
+    'a'
+    >>> cache.invalidate('file:///a.lrc')
+    >>> len(cache)
+    0
+    """
+
+    def __init__(self, max_size):
+        """
+
+        Arguments:
+        - `max_size`: The memory budget of the cache in bytes
+        """
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """ The estimated memory size of all entries in bytes
+        """
+        return self._size
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        self._max_size = value
+        self._shrink()
+
+    def get(self, uri, validator):
+        """ Returns the `CacheEntry` of `uri`, or None if it is not cached or
+        `validator` does not match.
+        """
+        entry = self._entries.get(uri)
+        if entry is not None and entry.validator == validator:
+            self.hits += 1
+            # Move to the most recently used end
+            del self._entries[uri]
+            self._entries[uri] = entry
+            logging.debug('Lyrics cache hit: %s (hits: %d, misses: %d)',
+                          uri, self.hits, self.misses)
+            return entry
+        self.misses += 1
+        if entry is not None:
+            self._remove(uri)
+        logging.debug('Lyrics cache miss: %s (hits: %d, misses: %d)',
+                      uri, self.hits, self.misses)
+        return None
+
+    def put(self, uri, validator, content):
+        """ Caches the content of `uri` and returns the new `CacheEntry`
+
+        If the entry is larger than the memory budget, it is returned but not
+        cached.
+        """
+        return self.add(uri, CacheEntry(validator, content))
+
+    def add(self, uri, entry):
+        """ Caches a `CacheEntry` created elsewhere, such as in a worker
+        thread, and returns it.
+        """
+        self.invalidate(uri)
+        if entry.size <= self._max_size:
+            self._entries[uri] = entry
+            self._size += entry.size
+            self._shrink()
+        return entry
+
+    def peek(self, uri):
+        """ Returns the `CacheEntry` of `uri` without validating it, or None
+        if not cached. Statistics and the LRU order are not changed.
+        """
+        return self._entries.get(uri)
+
+    def invalidate(self, uri):
+        """ Removes the entry of `uri` if exists
+        """
+        if uri in self._entries:
+            self._remove(uri)
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def _remove(self, uri):
+        entry = self._entries.pop(uri)
+        self._size -= entry.size
+
+    def _shrink(self):
+        while self._size > self._max_size and self._entries:
+            uri, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            logging.debug('Evict %s from lyrics cache', uri)
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
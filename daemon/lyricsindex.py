@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from builtins import object
+
+import logging
+import os
+import os.path
+import unicodedata
+
+import glib
+
+import workerpool
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+__all__ = (
+    'LyricsIndex',
+    'normalize_filename',
+)
+
+# Interval in milliseconds to check the mtime of directories if inotify is not
+# available
+POLL_INTERVAL = 5000
+
+
+def normalize_filename(filename):
+    r"""
+    Normalizes a file name so that names differ only in unicode normal forms
+    or letter cases are considered the same.
+
+    >>> normalize_filename(u'Café-Foo.LRC') == normalize_filename(u'caf\xe9-foo.lrc')
+    True
+    """
+    return unicodedata.normalize('NFC', filename).lower()
+
+
+class LyricsIndex(object):
+    """ Index of the files in the directories of lyrics
+
+    The index maps normalized file names to the names of files in each
+    directory, so that finding a file is a dict lookup instead of a stat call.
+    Subdirectories are not indexed.
+
+    Directories are listed in a `workerpool.WorkerPool` if given, so large or
+    remote directories do not block the main loop. A directory is not indexed
+    until it is listed, and its previous index is kept while it is listed
+    again.
+
+    The index is kept up to date with inotify if pyinotify is available.
+    The mtime of directories not watched by inotify, such as those that do
+    not exist yet, are checked periodically, and they are watched and indexed
+    again once they exist.
+
+    >>> import shutil, tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> open(os.path.join(d, 'Foo.lrc'), 'w').close()
+    >>> index = LyricsIndex([d])
+    >>> index.find(d, 'foo.lrc') == os.path.join(d, 'Foo.lrc')
+    True
+    >>> index.find(d, 'bar.lrc')
+    >>> index.add(os.path.join(d, 'bar.lrc'))
+    >>> index.find(d, 'bar.lrc') == os.path.join(d, 'bar.lrc')
+    True
+
+    Files whose names differ only in letter cases are kept apart
+
+    >>> index.add(os.path.join(d, 'foo.lrc'))
+    >>> index._remove_name(d, 'Foo.lrc')
+    >>> index.find(d, 'FOO.lrc') == os.path.join(d, 'foo.lrc')
+    True
+    >>> index.set_dirs([])
+    >>> index.is_indexed(d)
+    False
+    >>> shutil.rmtree(d)
+    >>> index = LyricsIndex([d])
+    >>> os.mkdir(d)
+    >>> open(os.path.join(d, 'baz.lrc'), 'w').close()
+    >>> index._poll()
+    True
+    >>> index.find(d, 'baz.lrc') == os.path.join(d, 'baz.lrc')
+    True
+    >>> shutil.rmtree(d)
+    """
+
+    def __init__(self, dirs=(), workers=None):
+        """
+
+        Arguments:
+        - `dirs`: The directories to index
+        - `workers`: The `workerpool.WorkerPool` to list directories in. If
+          it is None, directories are listed on the calling thread.
+        """
+        self._workers = workers
+        # Normalized file names to the lists of names of the files in each
+        # directory, or None if the directory is not listed yet
+        self._dirs = {}
+        self._mtimes = {}
+        # Changes to the directories being listed, which are applied again
+        # to their new index when listed
+        self._scanning = {}
+        self._watches = {}
+        self._poll_timer = None
+        self._notifier = None
+        self._io_watch = None
+        self._watch_manager = None
+        self._change_callbacks = []
+        if pyinotify is not None:
+            try:
+                self._watch_manager = pyinotify.WatchManager()
+                self._notifier = pyinotify.Notifier(self._watch_manager,
+                                                    self._process_event,
+                                                    timeout=0)
+                self._io_watch = glib.io_add_watch(self._watch_manager.get_fd(),
+                                                   glib.IO_IN,
+                                                   self._inotify_cb)
+            except Exception as e:
+                logging.warning('Cannot use inotify to watch lyric directories: %s', e)
+                self._watch_manager = None
+                self._notifier = None
+        self.set_dirs(dirs)
+
+    def set_dirs(self, dirs):
+        """ Sets the directories to index. Indices of directories not in `dirs`
+        are dropped.
+        """
+        dirs = set(os.path.normpath(d) for d in dirs)
+        for dirname in list(self._dirs):
+            if dirname not in dirs:
+                self._unwatch(dirname)
+                del self._dirs[dirname]
+                self._mtimes.pop(dirname, None)
+                self._scanning.pop(dirname, None)
+        for dirname in dirs:
+            if dirname not in self._dirs:
+                self._dirs[dirname] = None
+                self._watch(dirname)
+                self._scan(dirname)
+        self._start_polling()
+
+    def _start_polling(self):
+        if self._poll_timer is None and \
+                any(dirname not in self._watches for dirname in self._dirs):
+            self._poll_timer = glib.timeout_add(POLL_INTERVAL, self._poll)
+
+    def connect_change(self, func):
+        """ Registers a function to be called when files may have been added
+        to an indexed directory.
+
+        The function is called with the path of the directory.
+        """
+        self._change_callbacks.append(func)
+
+    def _notify_change(self, dirname):
+        for func in self._change_callbacks:
+            func(dirname)
+
+    def is_indexed(self, dirname):
+        """ Whether the directory is indexed
+        """
+        return self._dirs.get(os.path.normpath(dirname)) is not None
+
+    def find(self, dirname, filename):
+        """ Returns the path of file `filename` in `dirname`, or None if not
+        found or the directory is not indexed.
+        """
+        files = self._dirs.get(os.path.normpath(dirname))
+        if not files:
+            return None
+        names = files.get(normalize_filename(filename))
+        if not names:
+            return None
+        if filename in names:
+            return os.path.join(dirname, filename)
+        return os.path.join(dirname, names[0])
+
+    def add(self, path):
+        """ Adds a file to the index, if its directory is indexed.
+
+        This makes a file saved by the daemon visible immediately without
+        waiting for the next poll.
+        """
+        dirname, name = os.path.split(os.path.normpath(path))
+        if dirname in self._dirs:
+            self._add_name(dirname, name)
+            self._notify_change(dirname)
+
+    def _add_name(self, dirname, name):
+        if dirname in self._scanning:
+            self._scanning[dirname].append((True, name))
+        files = self._dirs[dirname]
+        if files is not None:
+            _add_to_files(files, name)
+
+    def _remove_name(self, dirname, name):
+        if dirname in self._scanning:
+            self._scanning[dirname].append((False, name))
+        files = self._dirs[dirname]
+        if files is not None:
+            _remove_from_files(files, name)
+
+    def _scan(self, dirname):
+        changes = []
+        self._scanning[dirname] = changes
+        if self._workers is None:
+            self._scanned(dirname, changes, _list_dir(dirname))
+        else:
+            self._workers.submit(_list_dir, (dirname,),
+                                 lambda result: self._scanned(dirname, changes, result),
+                                 lambda e: self._scanned(dirname, changes, (None, {})),
+                                 workerpool.PRIORITY_LOW)
+
+    def _scanned(self, dirname, changes, result):
+        if self._scanning.get(dirname) is not changes:
+            # The directory is dropped or listed again
+            return
+        del self._scanning[dirname]
+        mtime, files = result
+        for added, name in changes:
+            if added:
+                _add_to_files(files, name)
+            else:
+                _remove_from_files(files, name)
+        logging.debug('Indexed %d files in %s', len(files), dirname)
+        self._mtimes[dirname] = mtime
+        self._dirs[dirname] = files
+        self._notify_change(dirname)
+
+    def _poll(self):
+        unwatched = [dirname for dirname in self._dirs
+                     if dirname not in self._watches and
+                     dirname not in self._scanning]
+        for dirname in unwatched:
+            try:
+                mtime = os.stat(dirname).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtimes.get(dirname):
+                # Watch before scanning so that no file created in between is
+                # missed
+                if mtime is not None:
+                    self._watch(dirname)
+                self._scan(dirname)
+        if all(dirname in self._watches for dirname in self._dirs):
+            self._poll_timer = None
+            return False
+        return True
+
+    def _watch(self, dirname):
+        if self._watch_manager is None:
+            return
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_DELETE_SELF | pyinotify.IN_MOVE_SELF)
+        wdd = self._watch_manager.add_watch(dirname, mask, quiet=True)
+        wd = wdd.get(dirname, -1)
+        if wd >= 0:
+            self._watches[dirname] = wd
+        else:
+            logging.debug('Cannot watch lyric directory %s', dirname)
+
+    def _unwatch(self, dirname):
+        wd = self._watches.pop(dirname, None)
+        if wd is not None and self._watch_manager is not None:
+            self._watch_manager.rm_watch(wd, quiet=True)
+
+    def _inotify_cb(self, fd, condition):
+        self._notifier.read_events()
+        self._notifier.process_events()
+        return True
+
+    def _process_event(self, event):
+        dirname = os.path.normpath(event.path)
+        if dirname not in self._dirs:
+            return
+        if event.mask & (pyinotify.IN_DELETE_SELF | pyinotify.IN_MOVE_SELF):
+            # The directory is polled until it is created again
+            self._unwatch(dirname)
+            self._mtimes[dirname] = None
+            self._scanning.pop(dirname, None)
+            self._dirs[dirname] = {}
+            self._start_polling()
+        elif event.mask & (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO):
+            self._add_name(dirname, event.name)
+            self._notify_change(dirname)
+        elif event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+            self._remove_name(dirname, event.name)
+
+
+def _list_dir(dirname):
+    """ Returns the mtime of a directory, or None if it cannot be listed, and
+    the index of its files
+    """
+    files = {}
+    try:
+        mtime = os.stat(dirname).st_mtime
+        for name in os.listdir(dirname):
+            _add_to_files(files, name)
+    except OSError as e:
+        logging.debug('Cannot index lyric directory %s: %s', dirname, e)
+        mtime = None
+    return mtime, files
+
+
+def _add_to_files(files, name):
+    names = files.setdefault(normalize_filename(name), [])
+    if name not in names:
+        names.append(name)
+
+
+def _remove_from_files(files, name):
+    key = normalize_filename(name)
+    names = files.get(key)
+    if names is not None and name in names:
+        names.remove(name)
+        if not names:
+            del files[key]
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
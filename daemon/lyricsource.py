@@ -21,12 +21,21 @@
 from builtins import str
 
 import logging
+import time
 
 import dbus
+import glib
 
 import osdlyrics.config
 from osdlyrics.consts import (LYRIC_SOURCE_PLUGIN_INTERFACE,
                               LYRIC_SOURCE_PLUGIN_OBJECT_PATH_PREFIX)
+from osdlyrics.metadata import Metadata
+
+import circuitbreaker
+import downloadcache
+import ranking
+import searchcache
+import workerpool
 
 LYRIC_SOURCE_INTERFACE = 'org.osdlyrics.LyricSource'
 LYRIC_SOURCE_OBJECT_PATH = '/org/osdlyrics/LyricSource'
@@ -36,6 +45,26 @@ STATUS_SUCCESS = 0
 STATUS_CANCELLED = 1
 STATUS_FAILURE = 2
 
+# Search sources one by one until one of them returns something
+SEARCH_MODE_SEQUENTIAL = 'sequential'
+# Search all sources at once, and take the first non-empty results
+SEARCH_MODE_FIRST = 'first'
+# Search all sources at once, and merge their results within a deadline
+SEARCH_MODE_MERGE = 'merge'
+SEARCH_MODES = [SEARCH_MODE_SEQUENTIAL, SEARCH_MODE_FIRST, SEARCH_MODE_MERGE]
+
+# The default deadline in milliseconds of merging search results
+DEFAULT_SEARCH_DEADLINE = 8000
+# The default deadline in milliseconds for a source to complete a search
+DEFAULT_SOURCE_DEADLINE = 10000
+
+# A source is skipped after this many failed or timed out searches in a row
+BREAKER_THRESHOLD = 3
+# Seconds to skip a failing source for the first time, doubled every time
+# the source fails again after that
+BREAKER_COOLDOWN = 60
+BREAKER_MAX_COOLDOWN = 3600
+
 
 def validateticket(component):
     def decorator(func):
@@ -65,6 +94,13 @@ class LyricSource(dbus.service.Object):
         self._n_search_tickets = 0
         self._download_tasks = {}
         self._n_download_tickets = 0
+        # Writes of the caches are run by a single worker to keep their order
+        cache_writer = workerpool.WorkerPool(1)
+        self._search_cache = searchcache.SearchCache(workers=cache_writer)
+        self._download_cache = downloadcache.DownloadCache(workers=cache_writer)
+        # Cache keys and deadline timers of searches refreshing stale cached
+        # results, keyed by source ids and tickets of the sources
+        self._refreshes = {}
         self._detect_sources()
         self._config = osdlyrics.config.Config(conn)
 
@@ -104,6 +140,9 @@ class LyricSource(dbus.service.Object):
             'id': source_id,
             'search': {},
             'download': {},
+            'breaker': circuitbreaker.CircuitBreaker(BREAKER_THRESHOLD,
+                                                     BREAKER_COOLDOWN,
+                                                     BREAKER_MAX_COOLDOWN),
         }
         self._sources[source_id] = source
         proxy.connect_to_signal('SearchComplete',
@@ -118,30 +157,122 @@ class LyricSource(dbus.service.Object):
         logging.info('Search complete from %s, ticket: %s, status: %s, result: %s',
                      source_id, ticket, status, len(results))
         source = self._sources[source_id]
+        if status == STATUS_SUCCESS:
+            source['breaker'].record_success()
+        elif status == STATUS_CANCELLED:
+            source['breaker'].record_cancel()
+        else:
+            source['breaker'].record_failure()
         myticket = source['search'].pop(ticket)
+        if myticket is None:
+            self._refresh_complete(source_id, ticket, status, results)
+            return
         if myticket not in self._search_tasks:
             return
+        mytask = self._search_tasks[myticket]
+        self._cache_results(mytask['cache_key'], source_id, status, results)
+        if mytask['subtickets'].get(source_id) != ticket:
+            return
+        self._source_search_done(myticket, source_id, status, results)
+
+    def _source_search_done(self, ticket, source_id, status, results):
+        task = self._search_tasks[ticket]
+        del task['subtickets'][source_id]
+        timer = task['deadlines'].pop(source_id, None)
+        if timer is not None:
+            glib.source_remove(timer)
+        if status == STATUS_CANCELLED:
+            self._finish_search(ticket, status, [])
+            return
+        # task['failure'] is set to True only when all sources fail to search.
+        # To ensure that, we set this value to None when task is created, and
+        # set it to False when a search task succeeds, thus `not task['failure']`
+        # will return True. The value is set to True only when it was not False,
+        # so no search tasks from other sources succeed.
         if status == STATUS_SUCCESS:
-            mytask = self._search_tasks[myticket]
-            mytask['failure'] = False
-        if (status == STATUS_SUCCESS and len(results) > 0) or \
-                status == STATUS_CANCELLED:
-            self.SearchComplete(myticket, status, results)
-        else:  # STATUS_FAILURE
-            mytask = self._search_tasks[myticket]
-            # mytask['failure'] is set to True only when all sources fail to search.
-            # To ensure that, we set this value to None when task is created, and
-            # set it to False when a search task succeeds, thus `not task['failure']`
-            # will return True. The value is set to True only when it was not False,
-            # so no search tasks from other sources succeed.
-            if status == STATUS_FAILURE and mytask['failure'] is not False:
-                mytask['failure'] = True
-            if len(mytask['sources']) == 0 or mytask['sources'][0] != source_id:
-                logging.warning('Error, no source exists or source id mismatch with current id')
-                self.SearchComplete(myticket, STATUS_FAILURE, results)
-            else:
-                mytask['sources'].pop(0)
-                self._do_search(myticket)
+            task['failure'] = False
+            task['results'][source_id] = results
+        elif task['failure'] is not False:
+            task['failure'] = True
+        if status == STATUS_SUCCESS and len(results) > 0 and \
+                task['mode'] != SEARCH_MODE_MERGE:
+            self._finish_search(ticket, status, results)
+        elif task['mode'] == SEARCH_MODE_SEQUENTIAL:
+            self._do_search(ticket)
+        elif not task['subtickets']:
+            self._finish_search(ticket, STATUS_SUCCESS, self._merge_results(task))
+
+    def _source_deadline_cb(self, ticket, sourceid):
+        task = self._search_tasks[ticket]
+        sourceticket = task['subtickets'][sourceid]
+        logging.warning('Search from source %s timed out', sourceid)
+        breaker = self._sources[sourceid]['breaker']
+        breaker.record_failure()
+        if breaker.state != circuitbreaker.STATE_CLOSED:
+            logging.warning('Skip source %s until %s', sourceid,
+                            time.ctime(breaker.retry_time))
+        # The search is forgotten, so its late result, whether cancelled or
+        # not, neither counts again in the breaker nor reaches the task.
+        self._del_source_search(sourceid, sourceticket)
+        self._cancel_source_search(sourceid, sourceticket)
+        self._source_search_done(ticket, sourceid, STATUS_FAILURE, [])
+        return False
+
+    def _cached_search_cb(self, ticket, sourceid, results):
+        task = self._search_tasks.get(ticket)
+        if task is not None and sourceid in task['subtickets'] and \
+                task['subtickets'][sourceid] is None:
+            del task['idles'][sourceid]
+            self._source_search_done(ticket, sourceid, STATUS_SUCCESS, results)
+        return False
+
+    def _refresh_search(self, sourceid, metadata, cache_key):
+        """ Searches from a source in the background to refresh its stale
+        cached results
+        """
+        for source_key in self._refreshes:
+            if source_key[0] == sourceid and self._refreshes[source_key][0] == cache_key:
+                return
+        breaker = self._sources[sourceid]['breaker']
+        if not breaker.allow():
+            return
+        logging.info('Refreshing cached search results of source %s', sourceid)
+        try:
+            sourceticket = self._get_source_proxy(sourceid).Search(metadata)
+        except dbus.exceptions.DBusException as e:
+            logging.warning('Fail to search from source %s: %s', sourceid, e)
+            breaker.record_failure()
+            return
+        self._set_source_search(sourceid, sourceticket, None)
+        deadline = self._config.get_int('Download/source-deadline',
+                                        DEFAULT_SOURCE_DEADLINE)
+        timer = glib.timeout_add(deadline, self._refresh_deadline_cb,
+                                 sourceid, sourceticket)
+        self._refreshes[(sourceid, sourceticket)] = (cache_key, timer)
+
+    def _refresh_complete(self, sourceid, sourceticket, status, results):
+        refresh = self._refreshes.pop((sourceid, sourceticket), None)
+        if refresh is None:
+            return
+        cache_key, timer = refresh
+        glib.source_remove(timer)
+        self._cache_results(cache_key, sourceid, status, results)
+
+    def _cache_results(self, cache_key, sourceid, status, results):
+        # Empty results are not cached, as the lyrics may be uploaded to the
+        # source later.
+        if status == STATUS_SUCCESS and len(results) > 0:
+            self._search_cache.put(cache_key, sourceid, results)
+
+    def _refresh_deadline_cb(self, sourceid, sourceticket):
+        del self._refreshes[(sourceid, sourceticket)]
+        logging.warning('Refreshing search results from source %s timed out',
+                        sourceid)
+        self._sources[sourceid]['breaker'].record_failure()
+        # Forgotten like timed out searches of tasks, see _source_deadline_cb
+        self._del_source_search(sourceid, sourceticket)
+        self._cancel_source_search(sourceid, sourceticket)
+        return False
 
     @validateticket('download')
     def download_complete_cb(self, source_id, ticket, status, content):
@@ -151,8 +282,15 @@ class LyricSource(dbus.service.Object):
         myticket = source['download'].pop(ticket)
         if myticket not in self._download_tasks:
             return
+        if status == STATUS_SUCCESS:
+            self._download_cache.put(self._download_tasks[myticket]['key'], content)
         self.DownloadComplete(myticket, status, content)
 
+    def _cached_download_cb(self, ticket, content):
+        self._download_tasks[ticket]['timer'] = None
+        self.DownloadComplete(ticket, STATUS_SUCCESS, content)
+        return False
+
     def _get_source_proxy(self, sourceid):
         return self._sources[sourceid]['proxy']
 
@@ -178,24 +316,115 @@ class LyricSource(dbus.service.Object):
     def _del_source_download(self, sourceid, sourceticket):
         del self._sources[sourceid]['download'][sourceticket]
 
+    def _start_source_search(self, ticket, sourceid):
+        """ Sends the search request of a task to a source
+
+        Returns True if the request is sent.
+        """
+        task = self._search_tasks[ticket]
+        if sourceid not in self._sources:
+            logging.warning('Source %s not exist', sourceid)
+            return False
+        cached = self._search_cache.get(task['cache_key'], sourceid)
+        if cached is not None:
+            results, fresh = cached
+            logging.info('Found %s cached search results of source %s',
+                         'fresh' if fresh else 'stale', sourceid)
+            if not fresh:
+                self._refresh_search(sourceid, task['metadata'], task['cache_key'])
+            # Results are returned after Search returns the ticket
+            task['subtickets'][sourceid] = None
+            task['idles'][sourceid] = glib.idle_add(self._cached_search_cb,
+                                                    ticket, sourceid, results)
+            self.SearchStarted(ticket, sourceid, self._sources[sourceid]['name'])
+            return True
+        breaker = self._sources[sourceid]['breaker']
+        if not breaker.allow():
+            logging.info('Skip source %s which failed recently', sourceid)
+            return False
+        try:
+            newticket = self._get_source_proxy(sourceid).Search(task['metadata'])
+        except dbus.exceptions.DBusException as e:
+            logging.warning('Fail to search from source %s: %s', sourceid, e)
+            breaker.record_failure()
+            return False
+        self._set_source_search(sourceid, newticket, ticket)
+        task['subtickets'][sourceid] = newticket
+        deadline = self._config.get_int('Download/source-deadline',
+                                        DEFAULT_SOURCE_DEADLINE)
+        task['deadlines'][sourceid] = glib.timeout_add(
+            deadline, self._source_deadline_cb, ticket, sourceid)
+        self.SearchStarted(ticket, sourceid, self._sources[sourceid]['name'])
+        return True
+
     def _do_search(self, ticket):
         task = self._search_tasks[ticket]
-        nextsource = None
-        while task['sources']:
-            if task['sources'][0] in self._sources:
-                nextsource = task['sources'][0]
-                break
-            else:
-                logging.warning('Source %s not exist', task['sources'][0])
-                task['sources'].pop(0)
-        if nextsource is None:
-            status = STATUS_SUCCESS if not task['failure'] else STATUS_FAILURE
-            self.SearchComplete(ticket, STATUS_SUCCESS, [])
+        if task['mode'] == SEARCH_MODE_SEQUENTIAL:
+            while task['sources']:
+                if self._start_source_search(ticket, task['sources'].pop(0)):
+                    break
         else:
-            newticket = self._get_source_proxy(nextsource).Search(task['metadata'])
-            self._set_source_search(nextsource, newticket, ticket)
-            task['ticket'] = newticket
-            self.SearchStarted(ticket, nextsource, self._sources[nextsource]['name'])
+            for sourceid in task['sources']:
+                self._start_source_search(ticket, sourceid)
+            if task['mode'] == SEARCH_MODE_MERGE and task['subtickets']:
+                deadline = self._config.get_int('Download/search-deadline',
+                                                DEFAULT_SEARCH_DEADLINE)
+                task['timer'] = glib.timeout_add(deadline, self._search_deadline_cb,
+                                                 ticket)
+        if not task['subtickets']:
+            self._finish_search(ticket, STATUS_SUCCESS, self._merge_results(task))
+
+    def _search_deadline_cb(self, ticket):
+        task = self._search_tasks[ticket]
+        task['timer'] = None
+        logging.info('Search deadline of ticket %s reached, %d sources pending',
+                     ticket, len(task['subtickets']))
+        self._finish_search(ticket, STATUS_SUCCESS, self._merge_results(task))
+        return False
+
+    def _merge_results(self, task):
+        """ Returns the results of all sources of a task in the order of its
+        source list
+        """
+        results = []
+        for sourceid in task['order']:
+            results.extend(task['results'].get(sourceid, []))
+        return results
+
+    def _cancel_source_search(self, sourceid, sourceticket):
+        try:
+            self._get_source_proxy(sourceid).CancelSearch(sourceticket)
+        except dbus.exceptions.DBusException as e:
+            logging.warning('Fail to cancel search of source %s: %s', sourceid, e)
+
+    def _cancel_source_searches(self, task):
+        for sourceid, sourceticket in task['subtickets'].items():
+            # Cached results are not searched from the source
+            if sourceticket is not None:
+                self._cancel_source_search(sourceid, sourceticket)
+
+    def _finish_search(self, ticket, status, results):
+        """ Cancels pending searches of the sources and emits `SearchComplete`
+        """
+        task = self._search_tasks[ticket]
+        if task['timer'] is not None:
+            glib.source_remove(task['timer'])
+            task['timer'] = None
+        for timer in list(task['deadlines'].values()) + list(task['idles'].values()):
+            glib.source_remove(timer)
+        task['deadlines'].clear()
+        task['idles'].clear()
+        self._cancel_source_searches(task)
+        if status == STATUS_SUCCESS and results:
+            results = ranking.rank(task['query'], results, self._source_reliability())
+        self.SearchComplete(ticket, status, results)
+
+    def _source_reliability(self):
+        """ Returns how reliable the sources are for ranking search results,
+        which halves with each failure in a row
+        """
+        return dict((sourceid, 0.5 ** source['breaker'].failures)
+                    for sourceid, source in self._sources.items())
 
     @dbus.service.signal(dbus_interface=LYRIC_SOURCE_INTERFACE,
                          signature='iiaa{sv}')
@@ -220,11 +449,29 @@ class LyricSource(dbus.service.Object):
     def Search(self, metadata, sources):
         self._n_search_tickets += 1
         ticket = self._n_search_tickets
+        sources = [str(id) for id in sources]
+        if not sources:
+            sources = self._config.get_string_list('Download/download-engine', [])
+        mode = self._config.get_string('Download/search-mode',
+                                       SEARCH_MODE_SEQUENTIAL)
+        if mode not in SEARCH_MODES:
+            logging.warning('Unknown search mode %s', mode)
+            mode = SEARCH_MODE_SEQUENTIAL
+        query = Metadata.from_dict(metadata)
         task = {
             'metadata': metadata,
-            'sources': [str(id) for id in sources],
-            'ticket': None,
-            'failure': None,    # See comments in search_complete_cb()
+            'query': query,
+            'cache_key': searchcache.metadata_key(query),
+            'mode': mode,
+            'order': list(sources),
+            'sources': sources,  # Sources not searched yet in sequential mode
+            'subtickets': {},    # Tickets of the sources being searched, or
+                                 # None for sources with cached results
+            'deadlines': {},     # Deadline timers of the sources being searched
+            'idles': {},         # Idle sources returning cached results
+            'results': {},       # Results of the sources that completed
+            'timer': None,       # The deadline timer in merge mode
+            'failure': None,     # See comments in search_complete_cb()
         }
         self._search_tasks[ticket] = task
         self._do_search(ticket)
@@ -236,10 +483,16 @@ class LyricSource(dbus.service.Object):
     def CancelSearch(self, ticket):
         if ticket not in self._search_tasks:
             return
-        task = self._search_tasks[ticket]
-        sourceticket = task['ticket']
-        sourceid = task['sources'][0]
-        self._get_source_proxy(sourceid).CancelSearch(sourceticket)
+        # Searches of the sources are cancelled too, and their completions
+        # are ignored as the task is gone.
+        self._finish_search(ticket, STATUS_CANCELLED, [])
+
+    @dbus.service.method(dbus_interface=LYRIC_SOURCE_INTERFACE,
+                         in_signature='',
+                         out_signature='')
+    def ClearSearchCache(self):
+        self._search_cache.clear()
+        self._download_cache.clear()
 
     @dbus.service.method(dbus_interface=LYRIC_SOURCE_INTERFACE,
                          in_signature='sv',
@@ -247,6 +500,20 @@ class LyricSource(dbus.service.Object):
     def Download(self, source_id, downloaddata):
         if source_id not in self._sources:
             return -1
+        key = downloadcache.download_key(source_id, downloaddata)
+        content = self._download_cache.get(key)
+        if content is not None:
+            logging.info('Found cached download from source %s', source_id)
+            self._n_download_tickets += 1
+            ticket = self._n_download_tickets
+            # The content is sent after Download returns the ticket
+            self._download_tasks[ticket] = {
+                'ticket': None,
+                'source': source_id,
+                'key': key,
+                'timer': glib.idle_add(self._cached_download_cb, ticket, content),
+            }
+            return ticket
         sourceticket = self._get_source_proxy(source_id).Download(downloaddata)
         if sourceticket < 0:
             return -1
@@ -255,6 +522,7 @@ class LyricSource(dbus.service.Object):
         self._download_tasks[ticket] = {
             'ticket': sourceticket,
             'source': source_id,
+            'key': key,
         }
         self._set_source_download(source_id, sourceticket, ticket)
         return ticket
@@ -267,6 +535,10 @@ class LyricSource(dbus.service.Object):
             return
         task = self._download_tasks[ticket]
         sourceticket = task['ticket']
+        if sourceticket is None:
+            glib.source_remove(task['timer'])
+            self.DownloadComplete(ticket, STATUS_CANCELLED, b'')
+            return
         sourceid = task['source']
         self._get_source_proxy(sourceid).CancelDownload(sourceticket)
 
@@ -276,7 +548,8 @@ class LyricSource(dbus.service.Object):
     def ListSources(self):
         enabled = self._config.get_string_list('Download/download-engine')
         sources = [
-            {'id': id, 'name': v['name'], 'enabled': id in enabled}
+            dict(v['breaker'].to_dict(),
+                 id=id, name=v['name'], enabled=id in enabled)
             for id, v in self._sources.items()
         ]
         order = {id: i for i, id in enumerate(enabled)}
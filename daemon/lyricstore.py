@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import unicode_literals
+from builtins import object
+
+import hashlib
+import logging
+import os.path
+import sqlite3
+import threading
+import zlib
+
+import osdlyrics.utils
+
+__all__ = (
+    'LyricStore',
+    'content_hash',
+    'default_store',
+)
+
+
+def content_hash(content):
+    """ Returns the key of the text `content` in the store
+
+    >>> content_hash('[00:01]a')
+    '749042b3526cce2a8a34d318c90f4dd873594ef5'
+    """
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class LyricStore(object):
+    """ A content-addressed store of lyrics in a SQLite database
+
+    Lyrics are stored as zlib-compressed UTF-8 text keyed by the SHA-1 of the
+    text, so the same lyrics of different tracks are stored once. The store
+    can be used from multiple threads, with a connection for each thread.
+
+    >>> store = LyricStore(':memory:')
+    >>> key = store.put('[00:01]a')
+    >>> store.put('[00:01]a') == key
+    True
+    >>> store.get(key)
+    '[00:01]a'
+    >>> store.get('nonexistent')
+    >>> key in store, 'nonexistent' in store
+    (True, False)
+    >>> len(store)
+    1
+    """
+
+    TABLE_NAME = 'blobs'
+
+    CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {0} (
+  hash TEXT PRIMARY KEY,
+  size INTEGER,
+  content BLOB
+)
+""".format(TABLE_NAME)
+
+    INSERT_BLOB = 'INSERT OR IGNORE INTO {0} (hash, size, content) VALUES (?, ?, ?)'.format(TABLE_NAME)
+
+    FIND_BLOB = 'SELECT content FROM {0} WHERE hash=?'.format(TABLE_NAME)
+
+    HAS_BLOB = 'SELECT 1 FROM {0} WHERE hash=?'.format(TABLE_NAME)
+
+    COUNT_BLOBS = 'SELECT COUNT(*) FROM {0}'.format(TABLE_NAME)
+
+    def __init__(self, dbfile=None):
+        """
+
+        Arguments:
+        - `dbfile`: The sqlite db to open
+        """
+        if dbfile is None:
+            dbfile = osdlyrics.utils.get_config_path('lyrics-store.db')
+        if dbfile != ':memory:':
+            osdlyrics.utils.ensure_path(dbfile)
+            dbfile = os.path.expanduser(dbfile)
+        self._dbfile = dbfile
+        self._local = threading.local()
+        # An in-memory database is private to its connection, so it is shared
+        # by all threads.
+        self._shared_conn = None
+        if dbfile == ':memory:':
+            self._shared_conn = sqlite3.connect(dbfile, check_same_thread=False)
+            self._shared_lock = threading.Lock()
+        self._create_table()
+
+    def _connection(self):
+        if self._shared_conn is not None:
+            return self._shared_conn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._dbfile)
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql, args=(), commit=False):
+        conn = self._connection()
+        lock = self._shared_lock if self._shared_conn is not None else None
+        if lock is not None:
+            lock.acquire()
+        try:
+            c = conn.cursor()
+            c.execute(sql, args)
+            ret = c.fetchone()
+            if commit:
+                conn.commit()
+            c.close()
+            return ret
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _create_table(self):
+        self._execute(LyricStore.CREATE_TABLE, commit=True)
+
+    def put(self, content):
+        """ Stores the text `content` and returns its key
+        """
+        key = content_hash(content)
+        data = content.encode('utf-8')
+        self._execute(LyricStore.INSERT_BLOB,
+                      (key, len(data), sqlite3.Binary(zlib.compress(data))),
+                      commit=True)
+        logging.debug('Stored lyrics %s of %d bytes', key, len(data))
+        return key
+
+    def get(self, key):
+        """ Returns the text stored with `key`, or None if not found
+        """
+        row = self._execute(LyricStore.FIND_BLOB, (key,))
+        if row is None:
+            return None
+        return zlib.decompress(bytes(row[0])).decode('utf-8')
+
+    def __contains__(self, key):
+        return self._execute(LyricStore.HAS_BLOB, (key,)) is not None
+
+    def __len__(self):
+        return self._execute(LyricStore.COUNT_BLOBS)[0]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    """ Returns the store in the config directory, which is opened on first
+    use.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = LyricStore()
+        return _default_store
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
@@ -22,6 +22,7 @@ from __future__ import print_function
 import logging
 
 import dbus
+import glib
 
 from osdlyrics import PACKAGE_VERSION
 from osdlyrics.app import AlreadyRunningException, App
@@ -50,6 +51,14 @@ class InvalidClientNameException(Exception):
         Exception.__init__(self, 'Client bus name %s is invalid' % name)
 
 
+# Number of upcoming tracks to prefetch lyrics for
+PREFETCH_TRACK_COUNT = 2
+
+# Delay in milliseconds after a track change before prefetching, so that the
+# lyrics of the current track are loaded first
+PREFETCH_DELAY = 3000
+
+
 class MainApp(App):
     def __init__(self, ):
         App.__init__(self, 'Daemon', False)
@@ -60,9 +69,16 @@ class MainApp(App):
         self.request_bus_name(DAEMON_MPRIS2_NAME)
         self._daemon_object = DaemonObject(self)
         self._lyricsource = lyricsource.LyricSource(self.connection)
+        self._prefetch_timer = None
         self._lyrics.set_current_metadata(Metadata.from_dict(
             self._player.current_player.Metadata))
 
+    def run(self):
+        try:
+            return App.run(self)
+        finally:
+            self._lyrics.close()
+
     def _connect_metadata_signal(self, ):
         self._mpris_proxy = self.connection.get_object(DAEMON_BUS_NAME,
                                                        MPRIS2_OBJECT_PATH)
@@ -79,6 +95,16 @@ class MainApp(App):
         if 'Metadata' in changed:
             self._lyrics.set_current_metadata(Metadata.from_dict(
                 changed['Metadata']))
+            if self._prefetch_timer is not None:
+                glib.source_remove(self._prefetch_timer)
+            self._prefetch_timer = glib.timeout_add(PREFETCH_DELAY,
+                                                    self._prefetch_next_tracks)
+
+    def _prefetch_next_tracks(self):
+        self._prefetch_timer = None
+        self._player.current_player.get_next_tracks(PREFETCH_TRACK_COUNT,
+                                                    self._lyrics.prefetch)
+        return False
 
 
 def is_valid_client_bus_name(name):
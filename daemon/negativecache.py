@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import division
+from builtins import object, range
+
+import hashlib
+import math
+import struct
+import time
+import unicodedata
+
+__all__ = (
+    'NegativeCache',
+    'metadata_key',
+)
+
+
+def metadata_key(metadata):
+    r""" Returns the normalized key of a `osdlyrics.metadata.Metadata`
+
+    >>> from osdlyrics.metadata import Metadata
+    >>> a = Metadata.from_dict({'title': u'Caf\xe9', 'artist': 'Foo'})
+    >>> b = Metadata.from_dict({'title': u'CAFÉ', 'artist': 'foo'})
+    >>> metadata_key(a) == metadata_key(b)
+    True
+    """
+    values = [metadata.location, metadata.title, metadata.artist,
+              metadata.album]
+    key = u'\0'.join(v or u'' for v in values)
+    return unicodedata.normalize('NFC', key).lower()
+
+
+class _BloomFilter(object):
+
+    __slots__ = ('bits', 'count')
+
+    def __init__(self, nbits):
+        self.bits = bytearray((nbits + 7) // 8)
+        self.count = 0
+
+
+class NegativeCache(object):
+    """ Remembers the keys of tracks known to have no lyrics for a while
+
+    Keys are stored in bloom filters, so the memory cost does not depend on
+    the length of keys. Keys are added to the current generation of filter,
+    which replaces the previous generation every ``ttl / 2`` seconds or when
+    it is full, so a key expires between ``ttl / 2`` and ``ttl`` seconds
+    after added. Single keys cannot be removed; use `clear` instead.
+
+    A bloom filter may report a key that is not added with a probability of
+    `error_rate` for each generation.
+
+    >>> now = [0]
+    >>> cache = NegativeCache(60, capacity=100, clock=lambda: now[0])
+    >>> cache.add('foo')
+    >>> 'foo' in cache, 'bar' in cache
+    (True, False)
+    >>> now[0] = 40
+    >>> 'foo' in cache
+    True
+    >>> now[0] = 61
+    >>> 'foo' in cache
+    False
+    >>> cache.add('bar')
+    >>> cache.clear()
+    >>> 'bar' in cache
+    False
+    """
+
+    def __init__(self, ttl, capacity=50000, error_rate=0.001, clock=time.time):
+        """
+
+        Arguments:
+        - `ttl`: The number of seconds to remember a key
+        - `capacity`: The number of keys a generation holds
+        - `error_rate`: The false positive probability of a full generation
+        """
+        self._ttl = ttl
+        self._capacity = capacity
+        self._clock = clock
+        self._nbits = int(math.ceil(-capacity * math.log(error_rate) /
+                                    (math.log(2) ** 2)))
+        self._nhashes = max(1, int(round(self._nbits / capacity * math.log(2))))
+        self.clear()
+
+    def clear(self):
+        """ Forgets all keys
+        """
+        self._current = _BloomFilter(self._nbits)
+        self._previous = None
+        self._rotate_time = self._clock()
+
+    def add(self, key):
+        self._expire()
+        if self._current.count >= self._capacity:
+            self._rotate()
+        bits = self._current.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self._current.count += 1
+
+    def __contains__(self, key):
+        self._expire()
+        positions = self._positions(key)
+        for bloom in (self._current, self._previous):
+            if bloom is not None and \
+                    all(bloom.bits[pos >> 3] & (1 << (pos & 7))
+                        for pos in positions):
+                return True
+        return False
+
+    def _positions(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self._nbits for i in range(self._nhashes)]
+
+    def _rotate(self, rotate_time=None):
+        self._previous = self._current
+        self._current = _BloomFilter(self._nbits)
+        self._rotate_time = self._clock() if rotate_time is None else rotate_time
+
+    def _expire(self):
+        elapsed = self._clock() - self._rotate_time
+        if elapsed >= self._ttl:
+            self.clear()
+        elif elapsed >= self._ttl / 2:
+            # Keys in the previous generation must not outlive the TTL even
+            # if nothing is looked up for a while.
+            self._rotate(self._rotate_time + self._ttl / 2)
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
@@ -28,9 +28,11 @@ from osdlyrics import PROGRAM_NAME
 from osdlyrics.app import App
 from osdlyrics.consts import (MPRIS2_OBJECT_PATH, MPRIS2_PLAYER_INTERFACE,
                               PLAYER_PROXY_INTERFACE,
-                              PLAYER_PROXY_OBJECT_PATH_PREFIX)
+                              PLAYER_PROXY_OBJECT_PATH_PREFIX,
+                              PLAYER_PROXY_PLAYER_INTERFACE)
 from osdlyrics.dbusext.service import (Object as DBusObject,
                                        property as dbus_property)
+from osdlyrics.metadata import Metadata
 import osdlyrics.timer
 
 MPRIS2_ROOT_INTERFACE = 'org.mpris.MediaPlayer2'
@@ -254,6 +256,22 @@ class Mpris2Player(DBusObject):
         self._player = None
         self._clear_properties()
 
+    def get_next_tracks(self, count, callback):
+        """ Asks the connected player for the tracks to be played after the
+        current one.
+
+        `callback` is called with a list of Metadata, which is empty if the
+        player does not support it.
+        """
+        if self._player is None:
+            callback([])
+            return
+        self._player.GetNextTracks(
+            count,
+            dbus_interface=PLAYER_PROXY_PLAYER_INTERFACE,
+            reply_handler=lambda tracks: callback([Metadata.from_mpris2(t) for t in tracks]),
+            error_handler=lambda e: callback([]))
+
     def _setup_timer_status(self, status):
         status_map = {
             'Playing': 'play',
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import division
+
+import re
+
+import lrcdb
+
+__all__ = (
+    'rank',
+    'text_tokens',
+)
+
+# Weights of the parts of a score. Parts that cannot be compared, such as
+# the album if the query has none, are left out.
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.25
+ALBUM_WEIGHT = 0.1
+DURATION_WEIGHT = 0.15
+RELIABILITY_WEIGHT = 0.1
+
+# Durations that differ by this many milliseconds or more do not match
+DURATION_TOLERANCE = 10000
+
+# Characters of CJK scripts, which are words by themselves as they are not
+# separated by spaces
+CJK_RE = re.compile(u'([⺀-鿿가-힯豈-﫿])')
+
+
+def text_tokens(text):
+    r"""
+    Returns the set of words in a title, artist or album to compare
+
+    >>> sorted(text_tokens('The Song (Live) feat. X'))
+    ['song', 'the']
+    >>> sorted(text_tokens(u'海阔天空'))
+    ['天', '海', '空', '阔']
+    """
+    return frozenset(CJK_RE.sub(r' \1 ', lrcdb.fuzzy_text(text)).split())
+
+
+def _similarity(a, b):
+    """ Returns the Dice coefficient of two sets of tokens
+    """
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def rank(metadata, results, reliability=None):
+    r"""
+    Scores search results against the metadata of the track searched, and
+    returns the results sorted by the scores. Each result is a copy of the
+    given one with its score, from 0 to 1, in ``score``. Results with the
+    same score keep their order.
+
+    Arguments:
+    - `metadata`: The `osdlyrics.metadata.Metadata` searched
+    - `results`: A list of dicts of search results. The ``length`` of a result
+      is the duration of its track in milliseconds, if it is known.
+    - `reliability`: A dict from source ids to how reliable the sources are,
+      from 0 to 1. Sources not in it are not scored by reliability.
+
+    >>> from osdlyrics.metadata import Metadata
+    >>> metadata = Metadata(title='Hello', artist='Adele', length=295000)
+    >>> results = [
+    ...     {'title': 'Hello (Cover)', 'artist': 'Someone', 'sourceid': 'a'},
+    ...     {'title': 'Hello', 'artist': 'Adele', 'sourceid': 'b', 'length': 120000},
+    ...     {'title': 'hello', 'artist': 'ADELE', 'sourceid': 'a', 'length': 296000},
+    ... ]
+    >>> [(r['artist'], round(r['score'], 2)) for r in rank(metadata, results, {'a': 1.0, 'b': 0.5})]
+    [('ADELE', 0.98), ('Adele', 0.8), ('Someone', 0.71)]
+    """
+    title = text_tokens(metadata.title)
+    artist = text_tokens(metadata.artist)
+    album = text_tokens(metadata.album)
+    length = metadata.length if metadata.length and metadata.length > 0 else None
+    reliability = reliability or {}
+    # Results often share artists and albums, so texts are split once
+    tokens = {}
+
+    def tokens_of(text):
+        if text not in tokens:
+            tokens[text] = text_tokens(text)
+        return tokens[text]
+
+    scored = []
+    for result in results:
+        total = 0.0
+        weights = 0.0
+        for query, key, weight in ((title, 'title', TITLE_WEIGHT),
+                                   (artist, 'artist', ARTIST_WEIGHT),
+                                   (album, 'album', ALBUM_WEIGHT)):
+            if query:
+                total += weight * _similarity(query, tokens_of(result.get(key) or ''))
+                weights += weight
+        result_length = result.get('length', -1)
+        if length is not None and result_length > 0:
+            diff = abs(result_length - length)
+            total += DURATION_WEIGHT * max(0.0, 1 - diff / DURATION_TOLERANCE)
+            weights += DURATION_WEIGHT
+        sourceid = result.get('sourceid')
+        if sourceid in reliability:
+            total += RELIABILITY_WEIGHT * reliability[sourceid]
+            weights += RELIABILITY_WEIGHT
+        score = total / weights if weights else 0.0
+        scored.append(dict(result, score=score))
+    scored.sort(key=lambda result: -result['score'])
+    return scored
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
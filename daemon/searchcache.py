@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import time
+
+import osdlyrics.utils
+
+import lrcdb
+import sqlitecache
+
+__all__ = (
+    'SearchCache',
+    'metadata_key',
+)
+
+# Seconds that cached results are fresh
+DEFAULT_TTL = 24 * 3600
+# Seconds that stale results are still returned while being refreshed
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+# The maximum total size in bytes of cached results
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+
+def metadata_key(metadata):
+    r""" Returns the normalized key of the metadata of a search
+
+    The location is used only if the track has no title, as sources search by
+    the title, artist and album.
+
+    >>> from osdlyrics.metadata import Metadata
+    >>> a = Metadata(title=' Tiger', artist='SOLDIER', location='file:///a.mp3')
+    >>> b = Metadata(title='tiger', artist='soldier')
+    >>> metadata_key(a) == metadata_key(b)
+    True
+    >>> metadata_key(Metadata(location='file:///a.mp3')) == metadata_key(Metadata())
+    False
+    """
+    key = lrcdb.info_key(metadata.title, metadata.artist, metadata.album, 0)
+    if not metadata.title:
+        key += '\x1f' + (metadata.location or '')
+    return key
+
+
+class SearchCache(sqlitecache.SqliteCache):
+    """ Caches search results of lyric sources in a SQLite database
+
+    Results are fresh for `ttl` seconds after cached, then stale for up to
+    `max_age` seconds, after which they are dropped. The oldest results are
+    dropped if there are more than `max_entries` of them, or their total size
+    is larger than `max_size`.
+
+    >>> now = [0]
+    >>> cache = SearchCache(':memory:', ttl=10, max_age=100, max_entries=2,
+    ...                     clock=lambda: now[0])
+    >>> cache.put('key', 'src', [{'title': 'a', 'downloadinfo': [1, 'b']}])
+    >>> cache.get('key', 'src')
+    ([{'title': 'a', 'downloadinfo': [1, 'b']}], True)
+    >>> cache.get('key', 'other')
+    >>> now[0] = 10
+    >>> cache.get('key', 'src')[1]
+    False
+    >>> now[0] = 100
+    >>> cache.get('key', 'src')
+    >>> cache.put('key1', 'src', [])
+    >>> now[0] = 101
+    >>> cache.put('key2', 'src', [])
+    >>> now[0] = 102
+    >>> cache.put('key3', 'src', [])
+    >>> len(cache), cache.get('key1', 'src')
+    (2, None)
+    >>> cache.clear()
+    >>> len(cache)
+    0
+    """
+
+    def __init__(self, dbfile=None, ttl=DEFAULT_TTL, max_age=DEFAULT_MAX_AGE,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_size=DEFAULT_MAX_SIZE,
+                 clock=time.time, workers=None):
+        """
+
+        Arguments:
+        - `dbfile`: The sqlite db to open
+        - `ttl`: Seconds that cached results are fresh
+        - `max_age`: Seconds that cached results are kept
+        - `max_entries`: The maximum number of cached results
+        - `max_size`: The maximum total size of cached results in bytes
+        - `workers`: See `sqlitecache.SqliteCache`
+        """
+        if dbfile is None:
+            dbfile = osdlyrics.utils.get_config_path('search-cache.db')
+        sqlitecache.SqliteCache.__init__(self, dbfile, max_age, max_entries,
+                                         max_size, clock, workers)
+        self._ttl = ttl
+
+    @staticmethod
+    def _key(key, source):
+        return key + '\x1e' + source
+
+    def _encode(self, results):
+        data = json.dumps(results, ensure_ascii=False, separators=(',', ':'))
+        return data, len(data.encode('utf-8'))
+
+    def _decode(self, data):
+        return json.loads(data)
+
+    def get(self, key, source):
+        """ Returns a tuple of cached results of `source` for the search of
+        `key`, and whether they are fresh, or None if not cached.
+        """
+        cached = self._get(SearchCache._key(key, source))
+        if cached is None:
+            return None
+        results, age = cached
+        return results, age < self._ttl
+
+    def put(self, key, source, results):
+        """ Caches the results of `source` for the search of `key`
+        """
+        self._put(SearchCache._key(key, source), results)
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from builtins import object
+
+import logging
+import os.path
+import sqlite3
+import threading
+import time
+
+import osdlyrics.utils
+
+__all__ = (
+    'SqliteCache',
+)
+
+
+class SqliteCache(object):
+    """ A cache of values in a SQLite database, bounded by age, number and
+    total size
+
+    Values are dropped `max_age` seconds after they are cached. The oldest
+    values are dropped if there are more than `max_entries` of them, or their
+    total size is larger than `max_size`.
+
+    Subclasses store their values by overriding `_encode` and `_decode`.
+
+    Writes are run in `workers`, a `workerpool.WorkerPool` of one worker so
+    that they keep their order, and are visible to reads at once. If
+    `workers` is None or the db is in memory, writes are run on the calling
+    thread.
+
+    >>> now = [0]
+    >>> cache = SqliteCache(':memory:', max_age=100, max_entries=2,
+    ...                     max_size=10, clock=lambda: now[0])
+    >>> cache._put('a', 'foo')
+    >>> cache._get('a')
+    ('foo', 0.0)
+    >>> now[0] = 100
+    >>> cache._get('a')
+    >>> for key in 'bcd':
+    ...     now[0] += 1
+    ...     cache._put(key, key)
+    >>> len(cache), cache._get('b')
+    (2, None)
+    >>> cache._put('e', 'longer than 10')
+    >>> len(cache)
+    0
+    >>> cache._put('f', 'f')
+    >>> cache.clear()
+    >>> len(cache)
+    0
+    """
+
+    # The cache is dropped if the db is of another version
+    SCHEMA_VERSION = 1
+
+    TABLE_NAME = 'cache'
+
+    CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {0} (
+  key TEXT PRIMARY KEY,
+  value BLOB,
+  size INTEGER,
+  time REAL
+)
+""".format(TABLE_NAME)
+
+    CREATE_TIME_INDEX = """
+CREATE INDEX IF NOT EXISTS {0}_time ON {0} (time)
+""".format(TABLE_NAME)
+
+    LIST_TABLES = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+
+    INSERT_VALUE = """
+INSERT OR REPLACE INTO {0} (key, value, size, time) VALUES (?, ?, ?, ?)
+""".format(TABLE_NAME)
+
+    FIND_VALUE = 'SELECT value, time FROM {0} WHERE key=?'.format(TABLE_NAME)
+
+    DELETE_EXPIRED = 'DELETE FROM {0} WHERE time<=?'.format(TABLE_NAME)
+
+    LIST_BY_TIME = 'SELECT rowid, size FROM {0} ORDER BY time DESC'.format(TABLE_NAME)
+
+    DELETE_OLDER = 'DELETE FROM {0} WHERE time<(SELECT time FROM {0} WHERE rowid=?)'.format(TABLE_NAME)
+
+    DELETE_ALL = 'DELETE FROM {0}'.format(TABLE_NAME)
+
+    COUNT_VALUES = 'SELECT COUNT(*) FROM {0}'.format(TABLE_NAME)
+
+    def __init__(self, dbfile, max_age, max_entries, max_size,
+                 clock=time.time, workers=None):
+        """
+
+        Arguments:
+        - `dbfile`: The sqlite db to open
+        - `max_age`: Seconds that values are kept
+        - `max_entries`: The maximum number of values
+        - `max_size`: The maximum total size of values
+        - `workers`: The `workerpool.WorkerPool` to write in
+        """
+        if dbfile != ':memory:':
+            osdlyrics.utils.ensure_path(dbfile)
+            dbfile = os.path.expanduser(dbfile)
+        self._max_age = max_age
+        self._max_entries = max_entries
+        self._max_size = max_size
+        self._clock = clock
+        self._conn = self._connect(dbfile)
+        self._migrate()
+        if workers is None or dbfile == ':memory:':
+            self._workers = None
+            self._writer = self._conn
+        else:
+            self._workers = workers
+            self._writer = self._connect(dbfile)
+        self._write_lock = threading.Lock()
+        # Values being written, which are not visible to `_conn` yet
+        self._pending = {}
+        # The number of clears being run, while no value is visible in `_conn`
+        self._clearing = 0
+
+    @staticmethod
+    def _connect(dbfile):
+        conn = sqlite3.connect(dbfile, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _migrate(self):
+        c = self._conn.cursor()
+        c.execute('PRAGMA user_version')
+        if c.fetchone()[0] != self.SCHEMA_VERSION:
+            c.execute(SqliteCache.LIST_TABLES)
+            for (name,) in c.fetchall():
+                c.execute('DROP TABLE "%s"' % name)
+            c.execute('PRAGMA user_version=%d' % self.SCHEMA_VERSION)
+        c.execute(SqliteCache.CREATE_TABLE)
+        c.execute(SqliteCache.CREATE_TIME_INDEX)
+        self._conn.commit()
+        c.close()
+
+    def _encode(self, value):
+        """ Returns the data of `value` to store and its size
+        """
+        return value, len(value)
+
+    def _decode(self, data):
+        """ Returns the value of the stored data
+        """
+        return data
+
+    def _get(self, key):
+        """ Returns a tuple of the value cached with `key` and its age in
+        seconds, or None if not cached
+        """
+        row = self._pending.get(key)
+        if row is None:
+            if self._clearing:
+                return None
+            c = self._conn.cursor()
+            c.execute(SqliteCache.FIND_VALUE, (key,))
+            row = c.fetchone()
+            c.close()
+        if row is None:
+            return None
+        age = self._clock() - row[1]
+        if age >= self._max_age:
+            return None
+        return self._decode(row[0]), age
+
+    def _put(self, key, value):
+        """ Caches `value` with `key`
+        """
+        data, size = self._encode(value)
+        row = (data, self._clock())
+        self._pending[key] = row
+
+        def written(result=None):
+            if self._pending.get(key) is row:
+                del self._pending[key]
+        self._write(self._insert, (key, data, size, row[1]), written)
+
+    def _write(self, func, args, onfinish):
+        if self._workers is None:
+            func(*args)
+            onfinish()
+        else:
+            self._workers.submit(func, args, onfinish, onfinish)
+
+    def _insert(self, key, data, size, now):
+        with self._write_lock:
+            c = self._writer.cursor()
+            try:
+                c.execute(SqliteCache.INSERT_VALUE, (key, data, size, now))
+                self._trim(c, now)
+                self._writer.commit()
+            finally:
+                c.close()
+
+    def _trim(self, c, now):
+        c.execute(SqliteCache.DELETE_EXPIRED, (now - self._max_age,))
+        c.execute(SqliteCache.LIST_BY_TIME)
+        count = 0
+        size = 0
+        last = None
+        for row_id, row_size in c.fetchall():
+            count += 1
+            size += row_size
+            if count > self._max_entries or size > self._max_size:
+                break
+            last = row_id
+        else:
+            return
+        # Drop everything older than the last value that fits
+        logging.debug('Trimming %s to %d entries', type(self).__name__, count - 1)
+        if last is None:
+            c.execute(SqliteCache.DELETE_ALL)
+        else:
+            c.execute(SqliteCache.DELETE_OLDER, (last,))
+
+    def _delete_all(self):
+        with self._write_lock:
+            self._writer.execute(SqliteCache.DELETE_ALL)
+            self._writer.commit()
+
+    def clear(self):
+        """ Drops all cached values
+        """
+        self._pending.clear()
+        self._clearing += 1
+
+        def cleared(result=None):
+            self._clearing -= 1
+        self._write(self._delete_all, (), cleared)
+
+    def __len__(self):
+        c = self._conn.cursor()
+        c.execute(SqliteCache.COUNT_VALUES)
+        count = c.fetchone()[0]
+        c.close()
+        return count
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
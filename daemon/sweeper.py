@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from builtins import object
+
+import logging
+import time
+
+import glib
+
+import workerpool
+
+__all__ = (
+    'Sweeper',
+    'find_dead',
+    'read_batch',
+    'save_batch',
+    'sweep',
+)
+
+# Number of associations checked in each step
+SWEEP_BATCH_SIZE = 50
+# Delay in milliseconds between steps of a pass
+SWEEP_STEP_INTERVAL = 2000
+# Delay in milliseconds before the first step after the daemon starts
+SWEEP_START_DELAY = 60 * 1000
+# Delay in milliseconds between the end of a pass and the next pass
+SWEEP_PASS_INTERVAL = 6 * 3600 * 1000
+# The db file is vacuumed after a pass if this many associations are removed
+# since the last vacuum
+VACUUM_THRESHOLD = 1000
+
+# Names of statistics, which are also their keys in the state table prefixed
+# by `STATE_PREFIX`
+STATS = [
+    'cursor',
+    'checked',
+    'removed',
+    'passes',
+    'last_pass_time',
+    'removed_since_vacuum',
+    'last_vacuum_time',
+]
+
+STATE_PREFIX = 'sweeper.'
+
+
+def read_batch(db, limit=SWEEP_BATCH_SIZE):
+    """ Returns the statistics of a `lrcdb.LrcDb`, see `STATS`, and the next
+    `limit` associations to check as returned by `lrcdb.LrcDb.list_rows_after`.
+    Run it on the thread of the db.
+    """
+    stats = dict((name, db.get_state(STATE_PREFIX + name, 0)) for name in STATS)
+    return stats, db.list_rows_after(stats['cursor'], limit)
+
+
+def find_dead(rows, exists):
+    """ Returns the dead associations in `rows` returned by `read_batch`.
+
+    It checks the file system, so run it off the thread of the db.
+
+    Arguments:
+    - `exists`: A callable with the track location and the uri of lyrics of
+      an association, which returns False if the association is dead.
+    """
+    dead = []
+    for row in rows:
+        row_id, location, uri = row
+        try:
+            if not exists(location, uri):
+                dead.append(row)
+        except Exception:
+            logging.exception('Failed to check association %s -> %s', location, uri)
+    return dead
+
+
+def save_batch(db, stats, rows, dead, clock=time.time):
+    """ Removes the `dead` associations found in `rows`, and saves the updated
+    statistics. Run it on the thread of the db.
+
+    Returns the statistics with two extra keys: ``pass_done`` telling whether
+    a pass completed, after which the db should be optimized, and ``vacuum``
+    telling whether it should be vacuumed too.
+    """
+    stats = dict(stats)
+    removed = 0
+    if dead:
+        removed = db.delete_rows(dead)
+        logging.info('Removed %d dead associations', removed)
+    stats['checked'] += len(rows)
+    stats['removed'] += removed
+    stats['removed_since_vacuum'] += removed
+    stats['pass_done'] = not rows
+    stats['vacuum'] = False
+    if rows:
+        stats['cursor'] = rows[-1][0]
+    else:
+        stats['cursor'] = 0
+        stats['passes'] += 1
+        stats['last_pass_time'] = clock()
+        stats['vacuum'] = stats['removed_since_vacuum'] >= VACUUM_THRESHOLD
+        if stats['vacuum']:
+            stats['removed_since_vacuum'] = 0
+            stats['last_vacuum_time'] = clock()
+        logging.debug('Sweeping pass %d done, vacuum: %s', stats['passes'], stats['vacuum'])
+    for name in STATS:
+        db.set_state(STATE_PREFIX + name, stats[name])
+    db.commit()
+    return stats
+
+
+def sweep(db, exists, limit=SWEEP_BATCH_SIZE, clock=time.time):
+    """ Checks the next `limit` associations of a `lrcdb.LrcDb` and removes
+    the dead ones in a single thread.
+
+    The position is kept in the db, so sweeping continues where the last
+    step stopped, even after restarts. When all associations are checked, a
+    pass completes and the db is optimized.
+
+    `Sweeper` runs the same steps with the file system checked off the thread
+    of the db.
+
+    Arguments:
+    - `exists`: See `find_dead`
+
+    Returns the statistics returned by `save_batch`.
+
+    >>> import os, tempfile
+    >>> import lrcdb
+    >>> from osdlyrics.metadata import Metadata
+    >>> dbfile = tempfile.mktemp()
+    >>> db = lrcdb.LrcDb(dbfile)
+    >>> for i in range(5):
+    ...     db.assign(Metadata(location='file:///%d.mp3' % i), 'file:///%d.lrc' % i)
+    >>> exists = lambda location, uri: uri != 'file:///3.lrc'
+    >>> stats = sweep(db, exists, 3)
+    >>> stats['checked'], stats['removed'], stats['pass_done']
+    (3, 0, False)
+    >>> stats = sweep(db, exists, 3)
+    >>> stats['checked'], stats['removed'], stats['pass_done']
+    (5, 1, False)
+    >>> stats = sweep(db, exists, 3)
+    >>> stats['passes'], stats['cursor'], stats['pass_done']
+    (1, 0, True)
+    >>> [uri for row_id, location, uri in db.list_rows_after(0, 10)]
+    ['file:///0.lrc', 'file:///1.lrc', 'file:///2.lrc', 'file:///4.lrc']
+
+    Associations reassigned after they are checked are kept
+
+    >>> stats, rows = read_batch(db)
+    >>> dead = find_dead(rows, lambda location, uri: False)
+    >>> db.assign(Metadata(location='file:///0.mp3'), 'file:///new.lrc')
+    >>> save_batch(db, stats, rows, dead)['removed'] - stats['removed']
+    3
+    >>> db.list_rows_after(0, 10)[0][2]
+    'file:///new.lrc'
+    >>> os.remove(dbfile)
+    """
+    stats, rows = read_batch(db, limit)
+    stats = save_batch(db, stats, rows, find_dead(rows, exists), clock)
+    if stats['pass_done']:
+        db.optimize(stats['vacuum'])
+    return stats
+
+
+class Sweeper(object):
+    """ Removes dead associations of a `lrcdb.ThreadedLrcDb` in the background
+
+    Each step reads a few associations on the thread of the db, checks them
+    in a `workerpool.WorkerPool`, and removes the dead ones on the thread of
+    the db, so lookups are never delayed by the file system.
+    """
+
+    def __init__(self, db, workers, exists):
+        """
+
+        Arguments:
+        - `db`: The `lrcdb.ThreadedLrcDb`
+        - `workers`: The `workerpool.WorkerPool` to check associations
+        - `exists`: See `find_dead`
+        """
+        self._db = db
+        self._workers = workers
+        self._exists = exists
+        self._timer = None
+        self._running = False
+        self._stats = {}
+
+    def start(self):
+        """ Starts sweeping after `SWEEP_START_DELAY`
+        """
+        self._schedule(SWEEP_START_DELAY)
+
+    def stop(self):
+        if self._timer is not None:
+            glib.source_remove(self._timer)
+            self._timer = None
+
+    @property
+    def stats(self):
+        """ The statistics of the last step, see `STATS`. It is empty before
+        the first step.
+        """
+        return dict((name, self._stats[name]) for name in STATS if name in self._stats)
+
+    def _schedule(self, delay):
+        self.stop()
+        self._timer = glib.timeout_add(delay, self._step)
+
+    def _step(self):
+        self._timer = None
+        if not self._running:
+            self._running = True
+            self._db.call_async(read_batch).add_done_callback(self._read)
+        return False
+
+    def _retry(self, e=None):
+        self._running = False
+        self._schedule(SWEEP_PASS_INTERVAL)
+
+    def _read(self, future):
+        try:
+            stats, rows = future.result()
+        except Exception:
+            logging.exception('Failed to read associations to sweep')
+            self._retry()
+            return
+
+        def checked(dead):
+            self._db.call_async(save_batch, stats, rows, dead).add_done_callback(self._saved)
+        # Errors of checking are logged by the worker pool
+        self._workers.submit(find_dead, (rows, self._exists),
+                             checked, self._retry, workerpool.PRIORITY_LOW)
+
+    def _saved(self, future):
+        try:
+            self._stats = future.result()
+        except Exception:
+            logging.exception('Failed to remove dead associations')
+            self._retry()
+            return
+        self._running = False
+        if self._stats['pass_done']:
+            self._db.optimize(self._stats['vacuum'])
+            self._schedule(SWEEP_PASS_INTERVAL)
+        else:
+            self._schedule(SWEEP_STEP_INTERVAL)
+
+
+def test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011  Tiger Soldier
+#
+# This file is part of OSD Lyrics.
+#
+# OSD Lyrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OSD Lyrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OSD Lyrics.  If not, see <http://www.gnu.org/licenses/>.
+#
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+
+import itertools
+import logging
+import queue
+import threading
+
+import glib
+
+__all__ = (
+    'PRIORITY_DEFAULT',
+    'PRIORITY_LOW',
+    'WorkerPool',
+)
+
+PRIORITY_DEFAULT = 0
+PRIORITY_LOW = 100
+
+
+class WorkerPool(object):
+    """ A bounded pool of threads to run blocking tasks off the main loop
+
+    Tasks with a smaller priority value are run first. Tasks of the same
+    priority are run in the order they are submitted. Their results are
+    delivered to callbacks on the main loop, so callbacks can use objects
+    owned by the main thread, such as the database connection.
+    """
+
+    def __init__(self, max_workers):
+        """
+
+        Arguments:
+        - `max_workers`: The max number of threads. Threads are created on
+          demand.
+        """
+        self._max_workers = max_workers
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._idle = 0
+
+    def submit(self, target, args=(), onfinish=None, onerror=None,
+               priority=PRIORITY_DEFAULT):
+        """ Runs `target(*args)` in a worker thread
+
+        Arguments:
+        - `onfinish`: A callable invoked on the main loop with the return
+          value of `target`.
+        - `onerror`: A callable invoked on the main loop with the exception
+          raised by `target`.
+        - `priority`: `PRIORITY_DEFAULT` for tasks someone is waiting for,
+          or `PRIORITY_LOW` for background tasks.
+        """
+        with self._lock:
+            if self._idle > 0:
+                self._idle -= 1
+            elif self._workers < self._max_workers:
+                self._workers += 1
+                thread = threading.Thread(target=self._run,
+                                          name='osdlyrics-worker-%d' % self._workers)
+                thread.daemon = True
+                thread.start()
+        self._queue.put((priority, next(self._counter),
+                         target, args, onfinish, onerror))
+
+    def _run(self):
+        while True:
+            _, _, target, args, onfinish, onerror = self._queue.get()
+            try:
+                ret = target(*args)
+            except Exception as e:
+                logging.exception('Got exception in worker thread')
+                if onerror is not None:
+                    glib.idle_add(self._invoke, onerror, e)
+            else:
+                if onfinish is not None:
+                    glib.idle_add(self._invoke, onfinish, ret)
+            with self._lock:
+                self._idle += 1
+
+    @staticmethod
+    def _invoke(func, arg):
+        func(arg)
+        return False
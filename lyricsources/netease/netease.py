@@ -56,7 +56,8 @@ class NeteaseSource(BaseLyricSourcePlugin):
                                 artist=artist_name,
                                 album=song['album']['name'],
                                 sourceid=self.id,
-                                downloadinfo=url)
+                                downloadinfo=url,
+                                length=song.get('duration', -1))
 
         parsed = json.loads(content.decode('utf-8'))
         result = list(map(map_func, parsed['result']['songs']))
@@ -73,6 +73,7 @@ class Cmds(object):
     NOIDLE = 'noidle'
     PAUSE = 'pause'
     PLAY = 'play'
+    PLAYLISTINFO = 'playlistinfo'
     PREVIOUS = 'previous'
     RANDOM = 'random'
     REPEAT = 'repeat'
@@ -270,6 +271,7 @@ class MpdPlayer(BasePlayer):
         Cmds.NEXT: None,
         Cmds.PAUSE: None,
         Cmds.PLAY: None,
+        Cmds.PLAYLISTINFO: '_handle_playlistinfo',
         Cmds.PREVIOUS: None,
         Cmds.RANDOM: None,
         Cmds.REPEAT: None,
@@ -308,6 +310,8 @@ class MpdPlayer(BasePlayer):
         self._single = None
         self._random = None
         self._state = None
+        self._nextsong = None
+        self._next_tracks = []
         self._elapsed = Timer(100)
         self._send_cmd(Cmds.STATUS, sync=True)
         self._inited = True
@@ -345,6 +349,9 @@ class MpdPlayer(BasePlayer):
                 setattr(self, '_' + prop, value)
                 changes.add(handler[1])
 
+        # The position of the next song in the playlist
+        self._nextsong = int(status['nextsong']) if 'nextsong' in status else None
+
         if 'track' in changes:
             if self._songid is None:
                 self.__metadata = Metadata()
@@ -372,6 +379,13 @@ class MpdPlayer(BasePlayer):
 
     def _handle_currentsong(self, metadata):
         logging.debug('currentsong: %s', metadata)
+        self.__metadata = self._song_to_metadata(metadata)
+
+    def _handle_playlistinfo(self, songs):
+        self._next_tracks = [self._song_to_metadata(song) for song in songs]
+
+    @staticmethod
+    def _song_to_metadata(metadata):
         args = {}
         for key in ('title', 'artist', 'album'):
             if key in metadata:
@@ -380,7 +394,7 @@ class MpdPlayer(BasePlayer):
             args['length'] = int(float(metadata['elapsed']) * 1000)
         if 'track' in metadata:
             args['tracknum'] = int(metadata['track'].split('/')[0])
-        self.__metadata = Metadata(**args)
+        return Metadata(**args)
 
     @staticmethod
     def _parse_status(value):
@@ -470,6 +484,16 @@ class MpdPlayer(BasePlayer):
     def set_position(self, pos):
         self._send_cmd(Cmds.SEEK, self._songid, int(pos // 1000))
 
+    def get_next_tracks(self, count):
+        if self._nextsong is None or count <= 0:
+            return []
+        # Only the next song is known in random mode
+        end = self._nextsong + (1 if self._random else count)
+        self._next_tracks = []
+        self._send_cmd(Cmds.PLAYLISTINFO, '%d:%d' % (self._nextsong, end),
+                       sync=True)
+        return self._next_tracks
+
     def debug_info(self):
         ret = dbus.Dictionary(signature='sv')
         ret.update({
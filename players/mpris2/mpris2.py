@@ -26,11 +26,14 @@ import dbus.service
 import dbus.types
 
 from osdlyrics.consts import (DAEMON_MPRIS2_NAME, MPRIS2_OBJECT_PATH,
-                              MPRIS2_PLAYER_INTERFACE, MPRIS2_PREFIX)
+                              MPRIS2_PLAYER_INTERFACE, MPRIS2_PREFIX,
+                              MPRIS2_TRACKLIST_INTERFACE)
 from osdlyrics.metadata import Metadata
 from osdlyrics.player_proxy import (CAPS, REPEAT, STATUS, BasePlayer,
                                     BasePlayerProxy, PlayerInfo)
 
+MPRIS2_ROOT_INTERFACE = 'org.mpris.MediaPlayer2'
+
 # These constants map flags/enums from MPRIS2-specific values to OSDLyrics values.
 CAPS_MAP = {
     'CanGoNext': CAPS.NEXT,
@@ -97,6 +100,10 @@ class Mpris2Player(BasePlayer):
                 self.connection.get_object(mpris2_object_path,
                                            MPRIS2_OBJECT_PATH),
                 dbus.PROPERTIES_IFACE)
+            self._tracklist = dbus.Interface(
+                self.connection.get_object(mpris2_object_path,
+                                           MPRIS2_OBJECT_PATH),
+                MPRIS2_TRACKLIST_INTERFACE)
             self._properties_changed_signal = (
                 self._player_prop.connect_to_signal(
                     'PropertiesChanged', self._player_properties_changed))
@@ -121,6 +128,7 @@ class Mpris2Player(BasePlayer):
             self._name_watch = None
         self._player = None
         self._player_prop = None
+        self._tracklist = None
         BasePlayer.disconnect(self)
 
     def _player_properties_changed(self, iface, changed, invalidated):
@@ -233,6 +241,29 @@ class Mpris2Player(BasePlayer):
     def get_position(self):
         return self._player_prop.Get(MPRIS2_PLAYER_INTERFACE, 'Position') // 1000
 
+    def get_next_tracks(self, count):
+        try:
+            if not self._player_prop.Get(MPRIS2_ROOT_INTERFACE, 'HasTrackList'):
+                return []
+            # The order of the track list is not the playing order in shuffle
+            # mode.
+            if self.get_shuffle():
+                return []
+            tracks = self._player_prop.Get(MPRIS2_TRACKLIST_INTERFACE, 'Tracks')
+            trackid = self._player_prop.Get(MPRIS2_PLAYER_INTERFACE,
+                                            'Metadata').get('mpris:trackid')
+            if trackid not in tracks:
+                return []
+            start = tracks.index(trackid) + 1
+            next_tracks = tracks[start:start + count]
+            if not next_tracks:
+                return []
+            return [Metadata.from_mpris2(metadata) for metadata in
+                    self._tracklist.GetTracksMetadata(next_tracks)]
+        except Exception as e:
+            logging.debug('Failed to get next tracks: %s', e)
+            return []
+
 
 def run():
     mpris2 = ProxyObject()
@@ -29,7 +29,9 @@ CONFIG_BUS_NAME = 'org.osdlyrics.Config'
 CONFIG_OBJECT_PATH = '/org/osdlyrics/Config'
 PLAYER_PROXY_INTERFACE = 'org.osdlyrics.PlayerProxy'
 PLAYER_PROXY_OBJECT_PATH_PREFIX = '/org/osdlyrics/PlayerProxy/'
+PLAYER_PROXY_PLAYER_INTERFACE = 'org.osdlyrics.PlayerProxy.Player'
 MPRIS2_PLAYER_INTERFACE = 'org.mpris.MediaPlayer2.Player'
+MPRIS2_TRACKLIST_INTERFACE = 'org.mpris.MediaPlayer2.TrackList'
 MPRIS2_OBJECT_PATH = '/org/mpris/MediaPlayer2'
 LYRIC_SOURCE_PLUGIN_INTERFACE = 'org.osdlyrics.LyricSourcePlugin'
 LYRIC_SOURCE_PLUGIN_OBJECT_PATH_PREFIX = '/org/osdlyrics/LyricSourcePlugin/'
@@ -19,8 +19,14 @@
 #
 
 from __future__ import print_function
-from builtins import object
-
+from builtins import object, range
+
+from array import array
+from bisect import bisect_right
+import codecs
+import io
+import mmap
+import os
 import re
 
 import dbus.types
@@ -29,15 +35,70 @@ __all__ = (
     'AttrToken',
     'TimeToken',
     'StringToken',
+    'LrcData',
+    'LyricsTimeline',
+    'LrcTooLargeException',
     'tokenize',
+    'tokenize_stream',
+    'parse',
     'parse_lrc',
 )
 
 
+# LRC files larger than this are not loaded. It is large enough for karaoke
+# files, and stops audio files wrongly assigned as LRC files from being read.
+MAX_LRC_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+
 LINE_PATTERN = re.compile(r'(\[[^\[]*?\])')
 TIMESTAMP_PATTERN = re.compile(r'^\[(\d+(:\d+){0,2}(\.\d+)?)\]$')
 ATTR_PATTERN = re.compile(r'^\[([\w\d]+):(.*)\]$')
 
+# Characters that `str.splitlines` treats as line boundaries
+LINE_BREAKS = u'\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+# A timestamp tag or an attribute tag. The timestamp branch comes first so that
+# ``[01:23]`` is never taken as an attribute, which is consistent with `tokenize`.
+TAG_PATTERN = re.compile(u'\\[(?:(?:(?:(\\d+):)?(\\d+):)?(\\d+(?:\\.\\d+)?)'
+                         u'|(\\w+):([^\\[\\]%s]*))\\]' % LINE_BREAKS)
+# Matches a whole line including its line break. The first group is the leading
+# tags and the second group is the text.
+LRC_LINE_PATTERN = re.compile(u'((?:\\[(?:\\d+(?::\\d+){0,2}(?:\\.\\d+)?'
+                              u'|\\w+:[^\\[\\]%s]*)\\])*)'
+                              u'([^%s]*)(?:\\r\\n|[%s]|$)' % ((LINE_BREAKS,) * 3))
+# Word timestamps of enhanced LRC, such as ``<00:33.79>``
+WORD_TAG_PATTERN = re.compile(r'<(\d+(?::\d+){0,2}(?:\.\d+)?)>')
+# Line timestamps are kept in arrays of 64-bit integers. Python 2 has no
+# ``'q'`` typecode, where ``'l'`` is used instead.
+try:
+    TIMESTAMP_TYPECODE = array('q').typecode
+except ValueError:
+    TIMESTAMP_TYPECODE = 'l'
+# Word times are kept in ``array('i')``, so absurd ones are clamped to it
+WORD_TIME_MAX = 2 ** 31 - 1
+WORD_TIME_MIN = -2 ** 31
+
+
+def timestamp_to_ms(string):
+    """ Converts a timestamp of the form ``h:m:s.ms`` to milliseconds
+
+    >>> timestamp_to_ms('1:03:56.66')
+    3836660
+    >>> timestamp_to_ms('52.78')
+    52780
+    """
+    parts = string.split(':')
+    ms = int(float(parts[-1]) * 1000)
+    factor = 1000
+    for s in reversed(parts[:-1]):
+        factor = factor * 60
+        ms = ms + factor * int(s)
+    return ms
+
+
+class LrcTooLargeException(Exception):
+    def __init__(self, max_size):
+        Exception.__init__(self, 'LRC file is larger than %d bytes' % max_size)
+
 
 class AttrToken(object):
     """
@@ -72,19 +133,215 @@ class TimeToken(object):
     """
 
     def __init__(self, string):
-        parts = string.split(':')
-        parts.reverse()
-        factor = 1000
-        ms = int(float(parts[0]) * factor)
-        for s in parts[1:]:
-            factor = factor * 60
-            ms = ms + factor * int(s)
-        self.time = ms
+        self.time = timestamp_to_ms(string)
 
     def __repr__(self):
         return '[%s]' % self.time
 
 
+class LrcData(object):
+    """
+    Parsed content of an LRC file in columnar form
+
+    Instead of one object per line, the lines are stored in parallel columns:
+    - `timestamps`: An array of `TIMESTAMP_TYPECODE` of the start time of
+      each line in milliseconds, in ascending order.
+    - `texts`: A list of the text of each line. Equal texts share one string
+      object.
+    - `attrs`: A dict represents attributes in LRC file
+
+    Word timestamps of enhanced LRC are stored in flat arrays as well. Words
+    of the ``i``-th line are in the range ``word_begin[i]:word_end[i]`` of:
+    - `word_offsets`: An ``array('i')`` of the offsets in the line text where
+      the words start.
+    - `word_times`: An ``array('i')`` of the start time of the words, relative
+      to the timestamp of the line.
+    Lines with the same content share the same range. If there is no word
+    timestamps in the file, all of the word arrays are empty.
+    """
+
+    __slots__ = ('attrs', 'timestamps', 'texts',
+                 'word_offsets', 'word_times', 'word_begin', 'word_end')
+
+    def __init__(self, attrs, timestamps, texts,
+                 word_offsets=None, word_times=None,
+                 word_begin=None, word_end=None):
+        self.attrs = attrs
+        self.timestamps = timestamps
+        self.texts = texts
+        self.word_offsets = word_offsets if word_offsets is not None else array('i')
+        self.word_times = word_times if word_times is not None else array('i')
+        self.word_begin = word_begin if word_begin is not None else array('i')
+        self.word_end = word_end if word_end is not None else array('i')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return '<LrcData: %d lines, %d words, attrs: %s>' % (
+            len(self), len(self.word_offsets), self.attrs)
+
+    @property
+    def has_words(self):
+        """ Whether there are word timestamps of enhanced LRC
+        """
+        return len(self.word_offsets) > 0
+
+    def line_at(self, position_ms):
+        """
+        Returns the index of the line that is shown at `position_ms`, or -1 if
+        `position_ms` is before the first line.
+        """
+        return bisect_right(self.timestamps, position_ms) - 1
+
+    def words(self, line):
+        """
+        Returns a list of ``(offset, time)`` of the words in given line, where
+        `time` is the absolute start time of the word in milliseconds.
+        """
+        if not self.has_words:
+            return []
+        base = self.timestamps[line]
+        return [(self.word_offsets[i], base + self.word_times[i])
+                for i in range(self.word_begin[line], self.word_end[line])]
+
+    def word_at(self, position_ms):
+        """
+        Finds the word that is being sung at `position_ms` in O(log n).
+
+        Returns a tuple of ``(line, word)``. `line` is the same as `line_at`.
+        `word` is the index of the word in the line, or -1 if the line has no
+        word timestamps or the first word of it has not started yet.
+
+        >>> data = parse('[00:01.00]<00:01.00>foo <00:01.50>bar\\n'
+        ...              '[00:03.00]baz')
+        >>> data.texts
+        ['foo bar', 'baz']
+        >>> data.words(0)
+        [(0, 1000), (4, 1500)]
+        >>> data.word_at(500), data.word_at(1200), data.word_at(1500)
+        ((-1, -1), (0, 0), (0, 1))
+        >>> data.word_at(4000)
+        (1, -1)
+        """
+        line = self.line_at(position_ms)
+        if line < 0 or not self.has_words:
+            return line, -1
+        begin = self.word_begin[line]
+        word = bisect_right(self.word_times,
+                            position_ms - self.timestamps[line],
+                            begin,
+                            self.word_end[line]) - 1
+        if word < begin:
+            return line, -1
+        return line, word - begin
+
+    def to_dbus(self):
+        """
+        Converts the lines to the D-Bus structure described in `parse_lrc`
+        """
+        Int64 = dbus.types.Int64
+        UInt32 = dbus.types.UInt32
+        return [{'id': UInt32(i), 'timestamp': Int64(timestamp), 'text': text}
+                for i, (timestamp, text) in enumerate(zip(self.timestamps,
+                                                          self.texts))]
+
+
+class LyricsTimeline(object):
+    """
+    Index of the start time of lyric lines for finding the current line
+
+    The timeline remembers the line found last time. During sequential
+    playback, the next lookup is either in the same line or in the next one,
+    so `line_at` takes O(1) time in most cases and falls back to bisection
+    when seeking.
+    """
+
+    def __init__(self, lyrics):
+        """
+
+        Arguments:
+        - `lyrics`: Either an `LrcData` object or the list of lines returned by
+          `parse_lrc`.
+        """
+        if isinstance(lyrics, LrcData):
+            self._timestamps = lyrics.timestamps
+        else:
+            self._timestamps = array(TIMESTAMP_TYPECODE, [line['timestamp'] for line in lyrics])
+        self._last = -1
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def line_at(self, position_ms):
+        """
+        Returns the index of the line that is shown at `position_ms`, or -1 if
+        `position_ms` is before the first line.
+
+        >>> timeline = LyricsTimeline(parse('[00:01]a\\n[00:02]b\\n[00:03]c'))
+        >>> [timeline.line_at(t) for t in (0, 1000, 1500, 2000, 5000, 1999)]
+        [-1, 0, 0, 1, 2, 0]
+        """
+        timestamps = self._timestamps
+        last = self._last
+        n = len(timestamps)
+        if last < 0 or timestamps[last] <= position_ms:
+            # Try the remembered line and the one after it
+            for index in (last, last + 1):
+                if index + 1 >= n or position_ms < timestamps[index + 1]:
+                    if index < 0 or timestamps[index] <= position_ms:
+                        self._last = index
+                        return index
+                    break
+        self._last = bisect_right(timestamps, position_ms) - 1
+        return self._last
+
+    def next_change_after(self, position_ms):
+        """
+        Returns the timestamp in milliseconds of the first line that starts
+        after `position_ms`, or None if there is no more lines. Callers can
+        sleep until then instead of polling the current line.
+
+        >>> timeline = LyricsTimeline(parse('[00:01]a\\n[00:02]b'))
+        >>> timeline.next_change_after(0), timeline.next_change_after(1000)
+        (1000, 2000)
+        >>> timeline.next_change_after(2000)
+        """
+        index = self.line_at(position_ms) + 1
+        if index < len(self._timestamps):
+            return self._timestamps[index]
+        return None
+
+
+def _parse_tag(tag):
+    m = TIMESTAMP_PATTERN.match(tag)
+    if m:
+        return TimeToken(m.group(1))
+    m = ATTR_PATTERN.match(tag)
+    if m:
+        return AttrToken(m.group(1), m.group(2))
+    return None
+
+
+def _tokenize_line(line):
+    pos = 0
+    tokens = []
+    while pos < len(line) and line[pos] == '[':
+        has_tag = False
+        m = LINE_PATTERN.search(line, pos)
+        if m and m.start() == pos:
+            tag = m.group()
+            token = _parse_tag(tag)
+            if token:
+                tokens.append(token)
+                has_tag = True
+                pos = m.end()
+        if not has_tag:
+            break
+    tokens.append(StringToken(line[pos:]))
+    return tokens
+
+
 def tokenize(content):
     """ Split the content of LRC file into tokens
 
@@ -93,44 +350,209 @@ def tokenize(content):
     Arguments:
     - `content`: UTF8 string, the content to be tokenized
     """
-    def parse_tag(tag):
-        m = TIMESTAMP_PATTERN.match(tag)
-        if m:
-            return TimeToken(m.group(1))
-        m = ATTR_PATTERN.match(tag)
-        if m:
-            return AttrToken(m.group(1), m.group(2))
-        return None
-
-    def tokenize_line(line):
-        pos = 0
-        tokens = []
-        while pos < len(line) and line[pos] == '[':
-            has_tag = False
-            m = LINE_PATTERN.search(line, pos)
-            if m and m.start() == pos:
-                tag = m.group()
-                token = parse_tag(tag)
-                if token:
-                    tokens.append(token)
-                    has_tag = True
-                    pos = m.end()
-            if not has_tag:
-                break
-        tokens.append(StringToken(line[pos:]))
-        return tokens
-
-    lines = content.splitlines()
     tokens = []
-    for line in lines:
-        tokens.extend(tokenize_line(line))
+    for line in content.splitlines():
+        tokens.extend(_tokenize_line(line))
     return tokens
 
 
+def iter_lines(fileobj, encoding='utf-8', max_size=MAX_LRC_SIZE,
+               chunk_size=STREAM_CHUNK_SIZE):
+    r"""
+    Reads and decodes lines from a binary file incrementally
+
+    Lines are yielded without line breaks once they are complete, so only one
+    chunk of the file is held in memory at a time. NUL characters are removed.
+
+    Arguments:
+    - `fileobj`: A binary file object or an ``mmap.mmap`` object.
+    - `encoding`: The encoding of the file. Undecodable bytes are replaced.
+    - `max_size`: The maximum number of bytes to read. If the file is larger,
+      `LrcTooLargeException` is raised before any more bytes are read. Set to
+      None or 0 to disable the limit.
+    - `chunk_size`: The number of bytes to read at a time.
+
+    >>> import io
+    >>> list(iter_lines(io.BytesIO(b'a\r\nb\x00c\rd\n'), chunk_size=2)) == ['a', 'bc', 'd']
+    True
+    >>> list(iter_lines(io.BytesIO(b'\xe6\xad\x8c'), chunk_size=1)) == [u'\u6b4c']
+    True
+    >>> list(iter_lines(io.BytesIO(b'1234567890\n'), max_size=8))
+    ... # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+        ...
+    LrcTooLargeException: LRC file is larger than 8 bytes
+    """
+    if max_size:
+        try:
+            size = os.fstat(fileobj.fileno()).st_size
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            size = len(fileobj) if isinstance(fileobj, mmap.mmap) else 0
+        if size > max_size:
+            raise LrcTooLargeException(max_size)
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    total = 0
+    pending = ''
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_size and total > max_size:
+            raise LrcTooLargeException(max_size)
+        text = pending + decoder.decode(chunk)
+        if u'\x00' in text:
+            text = text.replace(u'\x00', '')
+        lines = text.splitlines(True)
+        # The last line may be incomplete, or ends with a '\r' that is followed
+        # by '\n' in the next chunk.
+        pending = lines.pop() if lines else ''
+        for line in lines:
+            yield line.rstrip(LINE_BREAKS)
+    text = pending + decoder.decode(b'', True)
+    for line in text.replace(u'\x00', '').splitlines():
+        yield line
+
+
+def tokenize_stream(fileobj, encoding='utf-8', max_size=MAX_LRC_SIZE):
+    """
+    Generates the tokens of an LRC file line by line.
+
+    This is the streaming version of `tokenize`. See `iter_lines` for the
+    meaning of the arguments.
+    """
+    for line in iter_lines(fileobj, encoding, max_size):
+        for token in _tokenize_line(line):
+            yield token
+
+
+def parse(content):
+    """
+    Parse the content of an LRC file into an `LrcData` in a single pass
+
+    Unlike `tokenize`, no intermediate objects are created for tags or lines.
+    Lines with several timestamps appear once for each timestamp. Lines that
+    are equal share the same string object.
+
+    Arguments:
+    - `content`: LRC file content encoded in UTF8
+
+    >>> data = parse('[ti:title][00:02.00][00:01.00]foo\\n[00:03]bar\\nbaz')
+    >>> data.attrs
+    {'ti': 'title'}
+    >>> list(data.timestamps)
+    [1000, 2000, 3000]
+    >>> data.texts
+    ['foo', 'foo', 'bar']
+    >>> data.texts[0] is data.texts[1]
+    True
+    >>> list(parse('[1000000:00.00]far').timestamps) == [60000000000]
+    True
+    """
+    attrs = {}
+    timestamps = []
+    texts = []
+    interned = {}
+    # Indices in `timestamps` of lines with word timestamps, and the range of
+    # their words in `word_offsets` and `word_times`
+    word_lines = {}
+    word_offsets = array('i')
+    word_times = array('i')
+    in_order = True
+    last = -1
+    find_tags = TAG_PATTERN.findall
+    for line in LRC_LINE_PATTERN.finditer(content):
+        tags = line.group(1)
+        if not tags:
+            continue
+        n_times = 0
+        for hours, minutes, seconds, key, value in find_tags(tags):
+            if seconds:
+                ms = int(float(seconds) * 1000)
+                if minutes:
+                    ms += int(minutes) * 60000
+                    if hours:
+                        ms += int(hours) * 3600000
+                if ms < last:
+                    in_order = False
+                last = ms
+                timestamps.append(ms)
+                n_times += 1
+            else:
+                attrs[key] = value
+        if n_times:
+            raw = line.group(2)
+            if raw in interned:
+                text, word_range = interned[raw]
+            else:
+                text, word_range = raw, None
+                if '<' in raw:
+                    line_time = min(timestamps[-n_times:])
+                    text, word_range = _parse_words(raw, line_time,
+                                                    word_offsets, word_times)
+                interned[raw] = text, word_range
+            if word_range is not None:
+                for i in range(len(timestamps) - n_times, len(timestamps)):
+                    word_lines[i] = word_range
+            if n_times == 1:
+                texts.append(text)
+            else:
+                texts.extend([text] * n_times)
+    order = None
+    if not in_order:
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        timestamps = [timestamps[i] for i in order]
+        texts = [texts[i] for i in order]
+    if not word_lines:
+        return LrcData(attrs, array(TIMESTAMP_TYPECODE, timestamps), texts)
+    word_begin = array('i', [0]) * len(timestamps)
+    word_end = array('i', [0]) * len(timestamps)
+    for new_index in range(len(timestamps)):
+        old_index = order[new_index] if order is not None else new_index
+        if old_index in word_lines:
+            word_begin[new_index], word_end[new_index] = word_lines[old_index]
+    return LrcData(attrs, array(TIMESTAMP_TYPECODE, timestamps), texts,
+                   word_offsets, word_times, word_begin, word_end)
+
+
+def _parse_words(raw, line_time, word_offsets, word_times):
+    """
+    Strips word timestamps from the text of a line and appends them to
+    `word_offsets` and `word_times`
+
+    Returns the stripped text and the range of the words appended, or None
+    instead of the range if there is no word timestamp.
+
+    >>> offsets, times = array('i'), array('i')
+    >>> _parse_words('a<00:01>b<100000000:00>c', 0, offsets, times)
+    ('abc', (0, 2))
+    >>> list(times) == [1000, WORD_TIME_MAX]
+    True
+    """
+    begin = len(word_offsets)
+    parts = []
+    length = 0
+    pos = 0
+    for m in WORD_TAG_PATTERN.finditer(raw):
+        part = raw[pos:m.start()]
+        parts.append(part)
+        length += len(part)
+        word_offsets.append(length)
+        word_time = timestamp_to_ms(m.group(1)) - line_time
+        word_times.append(max(WORD_TIME_MIN, min(WORD_TIME_MAX, word_time)))
+        pos = m.end()
+    if pos == 0:
+        return raw, None
+    parts.append(raw[pos:])
+    return ''.join(parts), (begin, len(word_offsets))
+
+
 def parse_lrc(content):
     """
     Parse an lrc file
 
+    This is an adapter of `parse` for D-Bus.
+
     Arguments:
     - `content`: LRC file content encoded in UTF8
 
@@ -139,6 +561,15 @@ def parse_lrc(content):
     - `lyrics`: A list of dict with 3 keys: id, timestamp and text.
       The list is sorted in ascending order by timestamp. Id increases from 0.
     """
+    data = parse(content)
+    return data.attrs, data.to_dbus()
+
+
+def _legacy_parse_lrc(content):
+    """
+    The token based parser that `parse_lrc` used before `parse` exists. It is
+    kept for benchmarking only.
+    """
     tokens = tokenize(content)
     attrs = {}
     lyrics = []
@@ -158,7 +589,7 @@ def parse_lrc(content):
     for lyric in lyrics:
         lyric['id'] = dbus.types.UInt32(i)
         i = i + 1
-    return attrs, lyrics
+    return tokens, attrs, lyrics
 
 
 def test():
@@ -186,5 +617,58 @@ def test():
     test_parser()
 
 
+def benchmark(repeat=20):
+    """
+    Compares `parse` and `parse_lrc` with the token based parser they replace.
+
+    A karaoke-sized LRC content is parsed `repeat` times with each parser.
+    The time taken and the approximate size of the results are printed. Only
+    the results are measured, not the intermediate tokens of the token based
+    parser.
+    """
+    import sys
+    import timeit
+
+    lines = ['[ti:benchmark][ar:OSD Lyrics]']
+    for i in range(3000):
+        minutes, seconds = divmod(i * 1.37, 60)
+        lines.append('[%02d:%05.2f]%s' % (minutes, seconds,
+                                         'Line of lyrics number %d' % (i % 40)))
+    content = '\n'.join(lines)
+
+    def sizeof_strings(strings):
+        # Equal strings may be the same object, which is counted once
+        return sum(sys.getsizeof(text)
+                   for text in dict((id(text), text) for text in strings).values())
+
+    def sizeof_lines(lyrics):
+        size = sys.getsizeof(lyrics)
+        size += sum(sys.getsizeof(line) + sys.getsizeof(line['timestamp']) +
+                    sys.getsizeof(line['id'])
+                    for line in lyrics)
+        return size + sizeof_strings(line['text'] for line in lyrics)
+
+    def sizeof_columnar(data):
+        size = sys.getsizeof(data.timestamps) + sys.getsizeof(data.texts)
+        return size + sizeof_strings(data.texts)
+
+    legacy_time = timeit.timeit(lambda: _legacy_parse_lrc(content), number=repeat)
+    columnar_time = timeit.timeit(lambda: parse(content), number=repeat)
+    dbus_time = timeit.timeit(lambda: parse_lrc(content), number=repeat)
+    legacy_size = sizeof_lines(_legacy_parse_lrc(content)[2])
+    columnar_size = sizeof_columnar(parse(content))
+    dbus_size = sizeof_lines(parse_lrc(content)[1])
+    print('%d lines, %d runs' % (len(lines), repeat))
+    print('tokenizer: %8.2f ms/run, %9d bytes' % (legacy_time * 1000 / repeat, legacy_size))
+    print('parse:     %8.2f ms/run, %9d bytes' % (columnar_time * 1000 / repeat, columnar_size))
+    print('parse_lrc: %8.2f ms/run, %9d bytes' % (dbus_time * 1000 / repeat, dbus_size))
+    print('speedup of parse: %.1fx, of parse_lrc: %.1fx' % (legacy_time / columnar_time,
+                                                             legacy_time / dbus_time))
+
+
 if __name__ == '__main__':
-    test()
+    import sys
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        test()
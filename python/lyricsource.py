@@ -56,7 +56,8 @@ class SearchResult(object):
     """ Lyrics that match the metadata to be searched.
     """
 
-    def __init__(self, sourceid, downloadinfo, title='', artist='', album='', comment=''):
+    def __init__(self, sourceid, downloadinfo, title='', artist='', album='', comment='',
+                 length=-1):
         """
 
         Arguments:
@@ -68,6 +69,8 @@ class SearchResult(object):
           ``downloadinfo`` MUST be composed with basic types such as numbers,
           lists, dicts or strings so that it can be converted to D-Bus compatible
           dict with `to_dict` method.
+        - `length`: The duration of the matched track in milliseconds, or -1 if
+          unknown. It helps to rank the results.
         """
         self._title = title
         self._artist = artist
@@ -75,16 +78,20 @@ class SearchResult(object):
         self._comment = comment
         self._sourceid = sourceid
         self._downloadinfo = downloadinfo
+        self._length = length
 
     def to_dict(self, ):
         """ Convert the result to a dict so that it can be sent with D-Bus.
         """
-        return {'title': self._title,
-                'artist': self._artist,
-                'album': self._album,
-                'comment': self._comment,
-                'sourceid': self._sourceid,
-                'downloadinfo': self._downloadinfo}
+        ret = {'title': self._title,
+               'artist': self._artist,
+               'album': self._album,
+               'comment': self._comment,
+               'sourceid': self._sourceid,
+               'downloadinfo': self._downloadinfo}
+        if self._length >= 0:
+            ret['length'] = dbus.Int64(self._length)
+        return ret
 
 
 class BaseTaskThread(threading.Thread):
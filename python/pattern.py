@@ -20,7 +20,7 @@
 from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
-from builtins import str
+from builtins import object, str
 
 import os.path
 import urllib.parse
@@ -29,6 +29,233 @@ import urllib.request
 from .errors import PatternException
 
 
+__all__ = (
+    'FilePattern',
+    'PathPattern',
+    'PatternSet',
+    'TrackValues',
+    'expand_file',
+    'expand_path',
+)
+
+# Place holders in file patterns and the attributes of metadata they refer to.
+# `None` refers to the file name of the music.
+FILE_PLACE_HOLDERS = {
+    't': 'title',
+    'p': 'artist',
+    'a': 'album',
+    'n': 'tracknum',
+    'f': None,
+}
+
+# Max number of compiled patterns kept by `expand_file` and `expand_path`
+COMPILED_CACHE_SIZE = 64
+
+_file_patterns = {}
+_path_patterns = {}
+
+
+class TrackValues(object):
+    """ The values of a track used to expand patterns
+
+    The values, including the file name and directory derived from the
+    location, are computed at most once, so expanding several patterns of the
+    same track shares the work.
+    """
+
+    def __init__(self, metadata):
+        self._metadata = metadata
+        self._values = {}
+        self._location = None
+
+    def get(self, key):
+        """ Returns the string value of attribute `key` of the metadata
+
+        Raises PatternException if the value is empty.
+        """
+        value = self._values.get(key)
+        if value is None:
+            value = getattr(self._metadata, key)
+            if not value:
+                raise PatternException('%s not in metadata' % key)
+            if not isinstance(value, str):
+                value = str(value)
+            self._values[key] = value
+        return value
+
+    def _parse_location(self):
+        if self._location is None:
+            location = self._metadata.location
+            if not location:
+                raise PatternException('Location not found in metadata')
+            uri = urllib.parse.urlparse(location)
+            if uri.scheme == '':
+                path = uri.path
+            else:
+                path = urllib.request.url2pathname(uri.path)
+            self._location = (uri.scheme, path)
+        return self._location
+
+    @property
+    def filename(self):
+        """ The file name of the music without the extension
+        """
+        value = self._values.get(None)
+        if value is None:
+            scheme, path = self._parse_location()
+            if scheme != '' and scheme not in ['file']:
+                raise PatternException('Unsupported file scheme %s' % scheme)
+            value = os.path.splitext(os.path.basename(path))[0]
+            self._values[None] = value
+        return value
+
+    @property
+    def dirname(self):
+        """ The directory of the music
+        """
+        scheme, path = self._parse_location()
+        if scheme not in ['file']:
+            raise PatternException('Unsupported file scheme %s' % scheme)
+        return os.path.dirname(path)
+
+
+def _track_values(metadata):
+    if isinstance(metadata, TrackValues):
+        return metadata
+    return TrackValues(metadata)
+
+
+class FilePattern(object):
+    """ A file name pattern compiled into literal strings and place holders
+
+    See `expand_file` for the syntax of patterns.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        # Literal strings, or tuples of the key of a place holder
+        self._parts = []
+        literal = []
+        start = 0
+        while start < len(pattern):
+            end = pattern.find('%', start)
+            if end == -1:
+                literal.append(pattern[start:])
+                break
+            literal.append(pattern[start:end])
+            tag = pattern[end + 1:end + 2]
+            if tag == '%':
+                literal.append('%')
+                start = end + 2
+            elif tag and tag in FILE_PLACE_HOLDERS:
+                if literal:
+                    self._parts.append(''.join(literal))
+                    literal = []
+                self._parts.append((FILE_PLACE_HOLDERS[tag],))
+                start = end + 2
+            else:
+                literal.append('%')
+                start = end + 1
+        if literal:
+            self._parts.append(''.join(literal))
+
+    def expand(self, metadata):
+        """ Expands the pattern with a metadata or a `TrackValues`
+
+        Raises PatternException if the pattern cannot be expanded.
+        """
+        values = _track_values(metadata)
+        parts = []
+        for part in self._parts:
+            if not isinstance(part, tuple):
+                parts.append(part)
+            elif part[0] is None:
+                parts.append(values.filename)
+            else:
+                parts.append(values.get(part[0]))
+        return ''.join(parts)
+
+
+class PathPattern(object):
+    """ A compiled directory pattern
+
+    See `expand_path` for the syntax of patterns.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.is_static = pattern != '%'
+        self._path = os.path.expanduser(pattern) if self.is_static else None
+
+    def expand(self, metadata):
+        """ Expands the pattern with a metadata or a `TrackValues`
+
+        Raises PatternException if the pattern cannot be expanded.
+        """
+        if self.is_static:
+            return self._path
+        return _track_values(metadata).dirname
+
+
+class PatternSet(object):
+    """ Compiled file name patterns and directory patterns of lyrics
+
+    >>> from osdlyrics.metadata import Metadata
+    >>> patterns = PatternSet(['%p-%t', '%t', '%f'], ['~/.lyrics', '%'])
+    >>> patterns.static_paths == [os.path.expanduser('~/.lyrics')]
+    True
+    >>> metadata = Metadata.from_dict({'title': 'Bar',
+    ...                                'location': 'file:///music/a.mp3'})
+    >>> for path, filename in patterns.expand(metadata):
+    ...     print(os.path.basename(path), filename)
+    .lyrics Bar
+    .lyrics a
+    music Bar
+    music a
+    """
+
+    def __init__(self, file_patterns, path_patterns):
+        self.file_patterns = [FilePattern(p) for p in file_patterns]
+        self.path_patterns = [PathPattern(p) for p in path_patterns]
+
+    @property
+    def static_paths(self):
+        """ The directories that do not depend on tracks
+        """
+        return [p.expand(None) for p in self.path_patterns if p.is_static]
+
+    def expand(self, metadata):
+        """ Yields tuples of directory and file name expanded from patterns
+
+        Patterns that cannot be expanded with the metadata are skipped.
+        """
+        values = _track_values(metadata)
+        filenames = None
+        for path_pattern in self.path_patterns:
+            try:
+                path = path_pattern.expand(values)
+            except PatternException:
+                continue
+            if filenames is None:
+                filenames = []
+                for file_pattern in self.file_patterns:
+                    try:
+                        filenames.append(file_pattern.expand(values))
+                    except PatternException:
+                        pass
+            for filename in filenames:
+                yield path, filename
+
+
+def _compile(cache, cls, pattern):
+    compiled = cache.get(pattern)
+    if compiled is None:
+        if len(cache) >= COMPILED_CACHE_SIZE:
+            cache.clear()
+        compiled = cache[pattern] = cls(pattern)
+    return compiled
+
+
 def expand_file(pattern, metadata):
     """
     Expands the pattern to a file name according to the infomation of a music
@@ -74,55 +301,7 @@ def expand_file(pattern, metadata):
         ...
     osdlyrics.errors.PatternException: title not in metadata
     """
-    keys = {'t': 'title',
-            'p': 'artist',
-            'a': 'album',
-            'n': 'tracknum',
-            }
-    start = 0
-    parts = []
-    while start < len(pattern):
-        end = pattern.find('%', start)
-        if end > -1:
-            parts.append(pattern[start:end])
-            has_tag = False
-            if end + 1 < len(pattern):
-                tag = pattern[end + 1]
-                if tag == '%':
-                    has_tag = True
-                    parts.append('%')
-                elif tag == 'f':
-                    location = metadata.location
-                    if not location:
-                        raise PatternException('Location not found in metadata')
-                    uri = urllib.parse.urlparse(location)
-                    if uri.scheme != '' and uri.scheme not in ['file']:
-                        raise PatternException('Unsupported file scheme %s' % uri.scheme)
-                    if uri.scheme == '':
-                        path = uri.path
-                    else:
-                        path = urllib.request.url2pathname(uri.path)
-                    basename = os.path.basename(path)
-                    root, ext = os.path.splitext(basename)
-                    has_tag = True
-                    parts.append(root)
-                elif tag in keys:
-                    value = getattr(metadata, keys[tag])
-                    if not value:
-                        raise PatternException('%s not in metadata' % keys[tag])
-                    if not isinstance(value, str):
-                        value = str(value)
-                    has_tag = True
-                    parts.append(value)
-            if has_tag:
-                start = end + 2
-            else:
-                start = end + 1
-                parts.append('%')
-        else:
-            parts.append(pattern[start:])
-            break
-    return ''.join(parts)
+    return _compile(_file_patterns, FilePattern, pattern).expand(metadata)
 
 
 def expand_path(pattern, metadata):
@@ -157,16 +336,7 @@ def expand_path(pattern, metadata):
         ...
     osdlyrics.errors.PatternException: Location not found in metadata
     """
-    if pattern == '%':
-        location = metadata.location
-        if not location:
-            raise PatternException('Location not found in metadata')
-        uri = urllib.parse.urlparse(location)
-        if uri.scheme not in ['file']:
-            raise PatternException('Unsupported file scheme %s' % uri.scheme)
-        path = urllib.request.url2pathname(uri.path)
-        return os.path.dirname(path)
-    return os.path.expanduser(pattern)
+    return _compile(_path_patterns, PathPattern, pattern).expand(metadata)
 
 
 if __name__ == '__main__':
@@ -29,7 +29,8 @@ import dbus.service
 from . import errors, timer
 from .app import App
 from .consts import (MPRIS2_PLAYER_INTERFACE, PLAYER_PROXY_INTERFACE,
-                     PLAYER_PROXY_OBJECT_PATH_PREFIX)
+                     PLAYER_PROXY_OBJECT_PATH_PREFIX,
+                     PLAYER_PROXY_PLAYER_INTERFACE)
 from .dbusext.service import Object as DBusObject, property as dbus_property
 
 
@@ -245,6 +246,7 @@ class BasePlayer(DBusObject):
     - `set_position`
     - `set_volume`
     - `get_volume`
+    - `get_next_tracks`
     """
 
     def __init__(self, proxy, name):
@@ -417,6 +419,18 @@ class BasePlayer(DBusObject):
         """
         raise NotImplementedError()
 
+    def get_next_tracks(self, count):
+        """
+        Gets the tracks to be played after the current one.
+
+        Returns a list of Metadata of at most `count` tracks, in the order they
+        will be played. An empty list is returned if the upcoming tracks are
+        unknown.
+
+        Derived classes that can peek in the playlist should reimplement this.
+        """
+        return []
+
     def _setup_timer_status(self, status):
         status_map = {
             STATUS.PAUSED: 'pause',
@@ -709,6 +723,12 @@ class BasePlayer(DBusObject):
     def Seeked(self, position):
         pass
 
+    @dbus.service.method(dbus_interface=PLAYER_PROXY_PLAYER_INTERFACE,
+                         in_signature='i',
+                         out_signature='aa{sv}')
+    def GetNextTracks(self, count):
+        return [metadata.to_mpris2() for metadata in self.get_next_tracks(count)]
+
     def track_changed(self, metadata=None):
         self._current_trackid += 1
         if self._timer is not None: